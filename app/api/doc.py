@@ -1,9 +1,15 @@
+import asyncio
+from typing import Optional
 from fastapi import APIRouter
 from fastapi import File, UploadFile
+from sse_starlette.sse import EventSourceResponse
 
-from app.exceptions.http.doc import ParseFileException, UnSupportedFileException
-from app.schemas.doc import FileDeleteResponse, FileListResponse, FileParseResponse
+from app.exceptions.http.doc import ParseFileException, ParseJobNotFoundException, UnSupportedFileException
+from app.schemas.doc import CacheStatsResponse, FileDeleteResponse, FileListResponse, FileParseResponse, ParseJobResponse
 from app.services.doc.parse import doc_parse_service_ins
+from app.support import xjson
+from app.support.cache import cache_stats_registry
+from config.config import settings
 
 
 router = APIRouter(
@@ -26,6 +32,61 @@ async def parse_file(file: UploadFile = File(...)):
     return FileParseResponse(file_meta=file_meta)
 
 
+@router.post("/jobs", response_model=ParseJobResponse)
+async def submit_parse_job(file: UploadFile = File(...), ingest_mode: Optional[bool] = None):
+    """
+    上传文件，后台异步解析，立即返回解析任务
+    ingest_mode: 是否开启批量写入模式(写入期间关闭切片索引refresh)，适用于大文件或批量回灌，默认取配置
+    """
+    if not doc_parse_service_ins.validate_file_type(file):
+        raise UnSupportedFileException()
+
+    job = await doc_parse_service_ins.submit_parse_job(file, ingest_mode)
+    return ParseJobResponse(job=job)
+
+
+@router.get("/jobs/{job_id}", response_model=ParseJobResponse)
+async def get_parse_job(job_id: str):
+    """
+    获取解析任务的状态、各阶段进度与耗时
+    """
+    return ParseJobResponse(job=doc_parse_service_ins.get_parse_job(job_id))
+
+
+@router.get("/jobs/{job_id}/events")
+async def parse_job_events(job_id: str):
+    """
+    SSE推送解析任务进度，任务结束后关闭连接
+    """
+    doc_parse_service_ins.get_parse_job(job_id)
+
+    async def _events():
+        last_updated_at = None
+        while True:
+            try:
+                _job = doc_parse_service_ins.get_parse_job(job_id)
+            except ParseJobNotFoundException as e:
+                # 内存存储中的任务可能在推送过程中被淘汰，推送错误后结束
+                yield dict(event="error", data=xjson.dumps(e.detail))
+                break
+            if _job.updated_at != last_updated_at:
+                last_updated_at = _job.updated_at
+                yield dict(event="progress", data=_job.model_dump_json())
+            if _job.finished:
+                break
+            await asyncio.sleep(settings.app.wf_parse.job_events_interval)
+
+    return EventSourceResponse(_events())
+
+
+@router.get("/cache/stats", response_model=CacheStatsResponse)
+async def cache_stats():
+    """
+    获取各缓存的命中统计
+    """
+    return CacheStatsResponse(caches={name: stats.to_dict() for name, stats in cache_stats_registry.items()})
+
+
 @router.delete("/{file_id}", response_model=FileDeleteResponse)
 async def delete_file(file_id: str):
     """
@@ -1,8 +1,13 @@
+import logging
 import mimetypes
-from fastapi import APIRouter
+import traceback
+from fastapi import APIRouter, Request
 from fastapi.responses import StreamingResponse
 
+from app.exceptions.http.minio import MinioFileDownloadErrorException, MinioFileNotFoundException
 from app.libs.minio import MinioClient
+from app.services.doc.page_image import page_image_ins
+from app.services.doc.pdf2md_result import codec_for_object
 
 router = APIRouter(
     prefix="/v1/minio"
@@ -10,14 +15,40 @@ router = APIRouter(
 
 
 @router.get("/{file_path:path}")
-async def download_minio_file(file_path: str) -> StreamingResponse:
+async def download_minio_file(file_path: str, request: Request) -> StreamingResponse:
     """
     下载文件（通过 MinIO 路径）
     :param file_path: MinIO 中的文件路径（例如 "folder/subfolder/file.txt"）
     """
-    file_stream, file_meta = await MinioClient().get_file(file_path)
-    if file_meta["filename"].endswith(".gz"):
-        content_type = "application/gzip"  # 或其他 MIME 类型，依据实际内容
+    try:
+        file_stream, file_meta = await MinioClient().get_file(file_path)
+    except MinioFileNotFoundException:
+        # 按需备份的页面图片，第一次访问时备份
+        try:
+            object_name = await page_image_ins.materialize(file_path)
+        except Exception as e:
+            logging.error(f'materialize page image {file_path} error: {e}, {traceback.format_exc()}')
+            raise MinioFileDownloadErrorException()
+        if object_name is None:
+            raise
+        file_stream, file_meta = await MinioClient().get_file(object_name)
+    headers = {}
+    if file_path.startswith("pdf2md/"):
+        # 解析结果(包括分块保存的清单与各块)写入后不再修改，允许浏览器缓存，翻页时不重复下载
+        headers["Cache-Control"] = "private, max-age=86400, immutable"
+    codec = codec_for_object(file_meta["filename"])
+    if codec is not None and codec.name == "zstd":
+        # zstd的json：浏览器支持且未使用字典时由浏览器解压，否则在服务端流式解压
+        content_type = "application/json"
+        if codec.dict_data is None:
+            # 响应内容取决于Accept-Encoding，缓存需按其区分
+            headers["Vary"] = "Accept-Encoding"
+        if codec.dict_data is None and "zstd" in request.headers.get("accept-encoding", ""):
+            headers["Content-Encoding"] = "zstd"
+        else:
+            file_stream = codec.iter_decompress(file_stream)
+    elif codec is not None:
+        content_type = codec.content_type  # 或其他 MIME 类型，依据实际内容
     else:
         content_type = mimetypes.guess_type(file_meta["filename"])[0] or "application/octet-stream"
     # 为图片或其他可渲染文件，设置 Content-Disposition 为 inline
@@ -27,7 +58,8 @@ async def download_minio_file(file_path: str) -> StreamingResponse:
         file_stream,
         media_type=content_type,
         headers={
-            "Content-Disposition": f'{content_disposition}; filename="{file_meta["filename"]}"'
+            "Content-Disposition": f'{content_disposition}; filename="{file_meta["filename"]}"',
+            **headers,
         }
     )
 
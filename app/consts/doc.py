@@ -20,3 +20,16 @@ FASTAPI_ALLOW_TYPES = [
     "image/png",    # .png
     "image/jpg",    # .jpg
 ]
+
+
+# 解析流程的阶段，按执行顺序
+PARSE_STAGES = [
+    "pdf2md",
+    "catalog",
+    "gen_origin_slices",
+    "gen_table_slices",
+    "gen_paragraph_slices",
+    "embedding_and_upload_slices",
+    "upload2minio",
+    "upload_file_info",
+]
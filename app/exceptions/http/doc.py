@@ -10,6 +10,9 @@ _ERR_CODE_GEN_PARAGRAPH_SLICES_FAIL = 10106
 _ERR_CODE_EMBEDDING_UOLOAD_SLICES_FAIL = 10107
 _ERR_CODE_UPLOAD_FILE_INFO_FAIL = 10108
 _ERR_CODE_UPLOAD2MINIO_INFO_FAIL = 10109
+_ERR_CODE_PARSE_JOB_QUEUE_FULL = 10110
+_ERR_CODE_PARSE_JOB_NOT_FOUND = 10111
+_ERR_CODE_PARSE_JOB_INTERRUPTED = 10112
 
 
 class _HTTPException(HTTPException):
@@ -115,3 +118,33 @@ class UploadFile2MinioException(_HTTPException):
         code=_ERR_CODE_UPLOAD2MINIO_INFO_FAIL,
         message="上传MINIO失败"
     )
+
+
+class ParseJobQueueFullException(_HTTPException):
+
+    status_code = 503
+
+    detail = dict(
+        code=_ERR_CODE_PARSE_JOB_QUEUE_FULL,
+        message="解析任务队列已满，请稍后重试"
+    )
+
+
+class ParseJobNotFoundException(_HTTPException):
+
+    status_code = 404
+
+    detail = dict(
+        code=_ERR_CODE_PARSE_JOB_NOT_FOUND,
+        message="解析任务不存在"
+    )
+
+
+class ParseJobInterruptedException(_HTTPException):
+
+    status_code = 500
+
+    detail = dict(
+        code=_ERR_CODE_PARSE_JOB_INTERRUPTED,
+        message="解析任务因服务重启中断，请重新提交"
+    )
@@ -1,11 +1,37 @@
 import numpy as np
-import heapq
+
+from app.support import scoring
+from app.support.cache import LRUTTLCache, register_cache_stats
 from app.support.helper import log_duration, retry_exponential_backoff
 from config.config import settings
 
+# 问题向量缓存，key为 (模型版本, 文本, 维度, 精度)，向量以float64数组保存
+query_embedding_cache_ins = LRUTTLCache(
+    max_entries=settings.api.embedding.query_cache_max_entries,
+    max_bytes=settings.api.embedding.query_cache_max_bytes,
+    ttl=settings.api.embedding.query_cache_ttl,
+    sizeof=lambda vector: vector.nbytes,
+    stats=register_cache_stats("query_embedding"),
+)
+
 
-@retry_exponential_backoff()
 def acge_embedding(text, dimension=settings.api.embedding.dimension, digit=settings.api.embedding.digit):
+    """
+    单条文本(问题)的向量，相同的文本在缓存有效期内只请求一次embedding服务
+    """
+    if not settings.api.embedding.query_cache_enabled:
+        return request_acge_embedding(text, dimension=dimension, digit=digit)
+
+    key = (settings.api.embedding.version, text, dimension, digit)
+    vector = query_embedding_cache_ins.get_or_load(
+        key, lambda: np.asarray(request_acge_embedding(text, dimension=dimension, digit=digit), dtype=np.float64)
+    )
+    # 返回新的list，调用方修改不影响缓存
+    return vector.tolist()
+
+
+@retry_exponential_backoff()
+def request_acge_embedding(text, dimension=settings.api.embedding.dimension, digit=settings.api.embedding.digit):
     import requests
 
     json_text = {
@@ -44,14 +70,8 @@ def get_similar_top_n(texts: list[str], sentence: str, dimension=settings.api.em
         return []
     texts_vec = acge_embedding_multi(texts, dimension=dimension)
     sentence_embedding = acge_embedding(sentence, dimension=dimension)
-    similarity_2d_list = (np.array([sentence_embedding]) @ np.array(texts_vec).T).tolist()
-
-    if not similarity_2d_list:
-        return []
-
-    similarity_list = similarity_2d_list[0]
-    topk_index = heapq.nlargest(top_n, range(len(similarity_list)), similarity_list.__getitem__)
+    topk_index, similarities = scoring.top_k_similarity(texts_vec, sentence_embedding, top_n)
 
     return [
-        (texts[i], np.round(similarity_list[i], 4)) for i in topk_index
+        (texts[i], round(similarity, 4)) for i, similarity in zip(topk_index.tolist(), similarities.tolist())
     ]
@@ -1,5 +1,7 @@
 import io
+from typing import Optional
 from minio import Minio, S3Error
+from minio.deleteobjects import DeleteObject
 
 # from aiobotocore.session import get_session
 from app.exceptions.http.minio import MinioFileNotFoundException, MinioFileDownloadErrorException
@@ -32,12 +34,62 @@ class MinioClient(object):
         except S3Error as e:
             raise e
 
-    def download_content(self, object_name):
+    def upload_fileobj(self, object_name, fileobj):
+        """
+        从文件对象上传，不把内容读入内存
+        """
+        length = fileobj.seek(0, io.SEEK_END)
+        fileobj.seek(0)
+        self._client.put_object(self._bucket_name, object_name, data=fileobj, length=length)
+
+    def download_content(self, object_name) -> bytes:
+        try:
+            response = self._client.get_object(self._bucket_name, object_name)
+        except S3Error as e:
+            raise e
+
+        try:
+            return response.read()
+        finally:
+            response.close()
+            response.release_conn()
+
+    def download_content_if_exists(self, object_name) -> Optional[bytes]:
+        """
+        对象不存在时返回None：不存在时同样只有一次GET请求(返回404)，比先stat再GET少一次往返
+        """
         try:
-            self._client.get_object(self._bucket_name, object_name)
+            return self.download_content(object_name)
         except S3Error as e:
+            if e.code == "NoSuchKey":
+                return None
+            raise e
+
+    def exists(self, object_name) -> bool:
+        try:
+            self._client.stat_object(self._bucket_name, object_name)
+            return True
+        except S3Error as e:
+            if e.code == "NoSuchKey":
+                return False
             raise e
 
+    def list_names(self, prefix: str) -> list[str]:
+        return [obj.object_name for obj in self._client.list_objects(self._bucket_name, prefix=prefix, recursive=True)]
+
+    def remove(self, object_name):
+        self._client.remove_object(self._bucket_name, object_name)
+
+    def remove_prefix(self, prefix: str) -> int:
+        """
+        删除指定前缀下的所有对象，返回删除数量
+        """
+        objects = self._client.list_objects(self._bucket_name, prefix=prefix, recursive=True)
+        delete_objects = [DeleteObject(obj.object_name) for obj in objects]
+        for error in self._client.remove_objects(self._bucket_name, delete_objects):
+            raise Exception(f"remove object {error.name} error: {error.message}")
+        return len(delete_objects)
+
     async def get_file(self, object_name):
         """
         获取文件流和元数据
@@ -19,7 +19,8 @@ class TextinOcr(object):
             'apply_document_tree': settings.api.pdf2md.options_apply_document_tree,
             'markdown_details': settings.api.pdf2md.options_markdown_details,
             'page_details': settings.api.pdf2md.options_page_details,
-            'char_details': settings.api.pdf2md.options_char_details,
+            # char_details_mode为none时不请求字符详情
+            'char_details': 0 if settings.app.wf_parse.char_details_mode == "none" else settings.api.pdf2md.options_char_details,
             'table_flavor': settings.api.pdf2md.options_table_flavor,
             'get_image': settings.api.pdf2md.options_get_image,
             'parse_mode': settings.api.pdf2md.options_parse_mode,
@@ -54,7 +55,11 @@ class TextinOcr(object):
 
         return requests.post(self.url, data=content, headers=headers, params=self.options)
 
-    async def aysnc_recognize_pdf2md(self, content):
+    async def aysnc_recognize_pdf2md(self, content, page_start: int = None, page_count: int = None):
+        """
+        content: 文件内容，bytes 或按块读取文件的异步迭代器
+        page_start/page_count 不为空时覆盖配置中的页码范围，用于按页窗口解析
+        """
         headers = {
             'x-ti-app-id': self._app_id,
             'x-ti-secret-code': self._app_secret
@@ -63,8 +68,15 @@ class TextinOcr(object):
         if isinstance(content, CoroutineType):
             content = await content
 
+        params = self.options
+        if page_start is not None:
+            params['page_start'] = page_start
+        if page_count is not None:
+            params['page_count'] = page_count
+
         async with httpx.AsyncClient() as client:
             # 异步发送 POST 请求
-            response = await client.post(self.url, data=content, headers=headers, params=self.options)
+            # content 为异步迭代器时以chunked方式流式上传
+            response = await client.post(self.url, content=content, headers=headers, params=params)
 
         return response
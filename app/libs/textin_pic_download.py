@@ -1,14 +1,37 @@
+import asyncio
 import httpx
 import requests
 from config.config import settings
 
 
 class TextinDownload(object):
+    # 进程内共享的异步连接池，复用与textin的连接；httpx客户端只能在创建它的事件循环中使用
+    _async_client: httpx.AsyncClient = None
+    _async_client_loop: asyncio.AbstractEventLoop = None
+
     def __init__(self, app_id: str = None, app_secret: str = None):
         self._app_id = app_id or settings.api.pdf2md.app_id
         self._app_secret = app_secret or settings.api.pdf2md.app_secret
         self.url = settings.api.pdf2md.download_url
 
+    @classmethod
+    def get_async_client(cls) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        if cls._async_client is None or cls._async_client_loop is not loop or cls._async_client.is_closed:
+            concurrency = settings.app.wf_parse.pic_download_concurrency
+            cls._async_client = httpx.AsyncClient(
+                timeout=60,
+                limits=httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency),
+            )
+            cls._async_client_loop = loop
+        return cls._async_client
+
+    @classmethod
+    async def aclose(cls):
+        if cls._async_client is not None and cls._async_client_loop is asyncio.get_running_loop():
+            await cls._async_client.aclose()
+        cls._async_client = cls._async_client_loop = None
+
     def download_textin_img(self, image_id: str):
         headers = {
             'x-ti-app-id': self._app_id,
@@ -24,8 +47,8 @@ class TextinDownload(object):
             'x-ti-secret-code': self._app_secret
         }
 
-        async with httpx.AsyncClient() as client:
-            # 异步发送 POST 请求
-            response = await client.get(f'{self.url}?image_id={image_id}', data={'image_id': image_id} , headers=headers)
+        # 异步发送 GET 请求，httpx的get不支持携带data
+        response = await self.get_async_client().get(f'{self.url}?image_id={image_id}', headers=headers)
+        response.raise_for_status()
 
         return response.json()['data']['image']
@@ -1,9 +1,12 @@
 
 
+import logging
+
 from fastapi import FastAPI
 from elasticsearch import Elasticsearch
 from elasticsearch_dsl import connections
 # from app.schemas.elasticsearch import initial_tables
+from app.schemas.elasticsearch import put_embedding_mappings
 from config.config import settings
 
 
@@ -13,6 +16,16 @@ def register(app: FastAPI):
     # initial_tables()
 
 
+def startup(app: FastAPI):
+    """
+    补充切片索引的向量字段映射，ES不可用时不影响启动
+    """
+    try:
+        put_embedding_mappings()
+    except Exception as e:
+        logging.warning(f"put embedding mappings error: {e}")
+
+
 def create_es_client() -> Elasticsearch:
     """
     创建一个 Elasticsearch 客户端。
@@ -0,0 +1,29 @@
+import logging
+
+from fastapi import FastAPI
+
+from app.services.doc.image_pipeline import image_pipeline_ins
+from app.services.doc.page_image import page_image_ins
+from app.services.doc.parse_job import parse_job_queue_ins
+from app.services.elasticsearch_ingest import ingest_mode_ins
+from config.config import settings
+
+
+def startup(app: FastAPI):
+    """
+    启动后台解析任务的worker，并恢复进程崩溃时遗留的批量写入模式索引配置
+    """
+    parse_job_queue_ins.start()
+    if settings.app.wf_parse.pic_backup_mode == "lazy":
+        # 后台补齐按需备份的页面图片，有解析任务时暂停
+        page_image_ins.start_sweeper(lambda: parse_job_queue_ins.busy)
+    try:
+        ingest_mode_ins.restore_if_idle()
+    except Exception as e:
+        logging.warning(f"restore ingest mode index settings error: {e}")
+
+
+def cleanup(app: FastAPI):
+    parse_job_queue_ins.stop()
+    page_image_ins.stop_sweeper()
+    image_pipeline_ins.shutdown()
@@ -48,6 +48,7 @@ class ChatResponse(BaseModel):
     content: Optional[str] = None
     total_tokens: int = 0
     retrieval: list[RetrieveContextResponse] = []
+    remote_calls: dict[str, dict] = {}  # 远程调用统计 {embedding|rerank: {requests, texts, saved}}，saved为备忘去重后未请求的文本数
 
     # 流式返回时的类型
     stream_content: Optional[ChatStreamGenerator] = None
@@ -1,6 +1,8 @@
 from datetime import datetime
-from typing import List, Optional, Union
-from pydantic import BaseModel
+from typing import Iterator, List, Optional, Union
+from pydantic import BaseModel, Field
+
+from app.support.spool import JsonLinesSpool
 
 
 class FileParseRequest(BaseModel):
@@ -37,6 +39,39 @@ class FileListResponse(BaseModel):
     files: List[FileMetaSchema]  # 文件元数据列表
 
 
+class ParseJobStageSchema(BaseModel):
+    name: str                               # 解析阶段名称
+    status: str = "pending"                 # pending | running | success | failed
+    started_at: Optional[datetime] = None   # 开始时间
+    duration_ms: Optional[float] = None     # 耗时(ms)
+    detail: dict = {}                       # 阶段附加信息，如命中率、吞吐量等
+
+
+class ParseJobSchema(BaseModel):
+    job_id: str
+    file_name: str
+    status: str = "pending"                 # pending | running | success | failed
+    progress: float = 0.0                   # 已完成阶段占比 0~1
+    stages: list[ParseJobStageSchema] = []
+    file_meta: Optional[FileMetaSchema] = None
+    error: Optional[dict] = None            # 失败时的错误信息 {code, message}
+    ingest_mode: bool = False               # 是否开启批量写入模式
+    created_at: datetime = Field(default_factory=datetime.now)
+    updated_at: datetime = Field(default_factory=datetime.now)
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("success", "failed")
+
+
+class ParseJobResponse(BaseModel):
+    job: ParseJobSchema
+
+
+class CacheStatsResponse(BaseModel):
+    caches: dict[str, dict] = {}   # 缓存名称 -> 命中统计(hits/misses/hit_ratio)
+
+
 class Pdf2MdSchema(BaseModel):
     class Metric(BaseModel):
         angle: int
@@ -64,13 +99,19 @@ class Pdf2MdSchema(BaseModel):
 
     class ResultData(BaseModel):
         # pages: List[Page]  # 如果需要激活此字段，取消注释
-        pages: List[dict]    # 直接解析即可
+        pages: List[dict]    # 直接解析即可，解析流程中转存到 _pages_spool，此处为空
         detail: List['Pdf2MdSchema.Detail']
         # markdown: str  # 如果需要激活此字段，取消注释
         # success_count: int  # 如果需要激活此字段，取消注释
         # total_count: int  # 如果需要激活此字段，取消注释
-        # total_page_count: int  # 如果需要激活此字段，取消注释
+        total_page_count: int = 0
         # valid_page_count: int  # 如果需要激活此字段，取消注释
+        _pages_spool: Optional[JsonLinesSpool] = None  # 转存到临时文件的pages
+
+        def iter_pages(self) -> Iterator[dict]:
+            if self._pages_spool is not None:
+                yield from self._pages_spool
+            yield from self.pages
 
     result: ResultData
     metrics: List[Metric]
@@ -122,6 +163,12 @@ class DocTableRowSchema(BaseModel):
     row_id: int = -1
     keywords: list[str] = []
     embed_text: str = ""
+    embedding: list[float] = []             # 关键词拼接后的向量，临时变量，用完即释放
+
+    @property
+    def keywords_text(self) -> str:
+        # 向量化与相似度过滤使用的文本
+        return "".join(self.keywords)
 
 
 class DocParagraphSchema(BaseModel):
@@ -1,11 +1,24 @@
 from datetime import datetime
-from elasticsearch_dsl import DenseVector, Document, Object, Text, Keyword, Integer, Date, Boolean
+from elasticsearch_dsl import DenseVector, Document, Double, Object, Text, Keyword, Integer, Date, Boolean, connections
 
 from app.schemas.doc import DocOriginSchema, DocParagraphSchema, DocTableRowSchema, FileMetaSchema, DocParagraphMetaTreeSchema
 from app.support import xjson
 from config.config import settings
 
 
+def embedding_field() -> DenseVector:
+    """
+    嵌入向量字段，建立HNSW索引用于knn检索
+    """
+    vector_settings = settings.elasticsearch.vector_settings
+    return DenseVector(
+        dims=settings.api.embedding.dimension,
+        index=True,
+        similarity=vector_settings.similarity,
+        index_options=dict(type=vector_settings.index_type, m=vector_settings.m, ef_construction=vector_settings.ef_construction),
+    )
+
+
 class ESFile(Document):
     uuid = Keyword(ignore_above=100)
     filename = Text()                                   # 文件名称
@@ -108,6 +121,7 @@ class ESTableRowSlice(Document):
     embed_text = Text()                                  # 嵌入文本
     row_id = Integer()                                  # 行号
     created_at = Date(format="yyyy-MM-dd HH:mm:ss")     # 创建时间
+    embedding = embedding_field()                       # 关键词拼接后的嵌入向量
 
     class Index:
         name = settings.elasticsearch.index_table_row_slice   # 定义索引名称
@@ -123,6 +137,7 @@ class ESTableRowSlice(Document):
             keywords=table_slice.keywords,          # 表格关键词列表【BM25搜索】 行B字段 list
             embed_text=table_slice.embed_text,      # 嵌入文本
             row_id=table_slice.row_id,              # 行号
+            embedding=table_slice.embedding or None,  # 嵌入向量
             created_at=datetime.now(),
         )
 
@@ -134,7 +149,8 @@ class ESTableRowSlice(Document):
             origin_slice_uuid=self.origin_slice_uuid,
             row_id=self.row_id,
             keywords=self.keywords,
-            embed_text=self.embed_text
+            embed_text=self.embed_text,
+            embedding=list(self.embedding or []),  # 历史数据没有向量
         )
 
     @classmethod
@@ -156,7 +172,7 @@ class ESParagraphSlice(Document):
     level = Integer()                                   # 切片所在文档树层级，从1开始
     created_at = Date(format="yyyy-MM-dd HH:mm:ss")     # 创建时间
     leaf = Boolean()                                    # 是否叶子切片
-    embedding = DenseVector(dim=settings.api.embedding.dimension)  # 嵌入向量
+    embedding = embedding_field()                       # 嵌入向量
 
     # ---- leaf切片属性 ----
     leaf_properties = Object(  # Store all leaf-related properties in one object
@@ -241,8 +257,36 @@ class ESParagraphSlice(Document):
         return list(keys - set(exclude))
 
 
+class ESIngestLease(Document):
+    owner = Keyword(ignore_above=200)                   # 持有租约的进程标识
+    expires_at = Double()                               # 租约过期时间(unix时间戳，秒)
+    # 开启批量写入模式前各切片索引的配置，json: {索引: {refresh_interval, number_of_replicas}}，恢复时使用
+    index_settings = Keyword(index=False, doc_values=False)
+
+    class Index:
+        name = settings.elasticsearch.index_ingest_lease
+        settings = dict(number_of_shards=1, number_of_replicas=0)
+
+
 def initial_tables():
     ESFile.init()
     ESOriginSlice.init()
     ESParagraphSlice.init()
     ESTableRowSlice.init()
+    ESIngestLease.init()
+
+
+def put_embedding_mappings():
+    """
+    给已存在的切片索引补充向量字段映射，字段不存在时按 embedding_field() 添加(如表格行索引新增的embedding)
+    已存在的向量字段(如历史索引中未建索引的dense_vector)不能修改，需要重建索引，在此之前检索时自动改用script_score
+    """
+    es_client = connections.get_connection()
+    for doc_cls in (ESParagraphSlice, ESTableRowSlice):
+        index = doc_cls.Index.name
+        if not es_client.indices.exists(index=index):
+            continue
+        field_mappings = es_client.indices.get_field_mapping(index=index, fields="embedding")
+        if any(index_mapping["mappings"] for index_mapping in field_mappings.values()):
+            continue
+        es_client.indices.put_mapping(index=index, properties={"embedding": embedding_field().to_dict()})
@@ -0,0 +1,78 @@
+import concurrent.futures
+import threading
+
+from app.libs.acge_embedding import acge_embedding, acge_embedding_multi
+from app.libs.rerank import rerank_api
+from app.support.helper import split_list
+from config.config import settings
+
+
+class RequestMemo(object):
+    """
+    单次问答内的远程调用备忘，挂在workflow的Context上，各阶段共用：
+    - 相同文本的向量只请求一次
+    - 相同 (query, text) 的rerank得分只请求一次，请求前先去重，未命中的文本再分批并发请求
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._embeddings: dict[tuple[str, int], list[float]] = {}
+        self._rerank_scores: dict[tuple[str, str], float] = {}
+        # requests: 远程请求次数，texts: 请求的文本数，saved: 由备忘返回、未请求的文本数
+        self._stats = {name: dict(requests=0, texts=0, saved=0) for name in ("embedding", "rerank")}
+
+    def _count(self, name: str, requests: int = 0, texts: int = 0, saved: int = 0):
+        with self._lock:
+            self._stats[name]["requests"] += requests
+            self._stats[name]["texts"] += texts
+            self._stats[name]["saved"] += saved
+
+    def stats(self) -> dict[str, dict]:
+        with self._lock:
+            return {name: dict(stats) for name, stats in self._stats.items()}
+
+    def embedding(self, text: str, dimension: int = settings.api.embedding.dimension) -> list[float]:
+        key = (text, dimension)
+        with self._lock:
+            vector = self._embeddings.get(key)
+        if vector is not None:
+            self._count("embedding", saved=1)
+            return vector
+
+        vector = acge_embedding(text, dimension=dimension)
+        self._count("embedding", requests=1, texts=1)
+        with self._lock:
+            self._embeddings[key] = vector
+        return vector
+
+    def embedding_multi(self, texts: list[str], dimension: int = settings.api.embedding.dimension) -> list[list[float]]:
+        with self._lock:
+            missing_texts = list(dict.fromkeys(text for text in texts if (text, dimension) not in self._embeddings))
+
+        if missing_texts:
+            vectors = acge_embedding_multi(missing_texts, dimension=dimension)
+            with self._lock:
+                self._embeddings.update({(text, dimension): vector for text, vector in zip(missing_texts, vectors)})
+        self._count("embedding", requests=1 if missing_texts else 0, texts=len(missing_texts), saved=len(texts) - len(missing_texts))
+
+        with self._lock:
+            return [self._embeddings[(text, dimension)] for text in texts]
+
+    def rerank(self, query: str, texts: list[str], chunk_size: int = 16, max_workers: int = 8) -> list[float]:
+        """
+        query与每个text的rerank得分(if_softmax=0)，与texts一一对应
+        """
+        with self._lock:
+            missing_texts = list(dict.fromkeys(text for text in texts if (query, text) not in self._rerank_scores))
+
+        chunks = split_list(missing_texts, chunk_size=chunk_size)
+        if chunks:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+                results = list(executor.map(lambda chunk: rerank_api([[query], chunk], if_softmax=0), chunks))
+            with self._lock:
+                for chunk, scores in zip(chunks, results):
+                    self._rerank_scores.update({(query, text): score for text, score in zip(chunk, scores)})
+        self._count("rerank", requests=len(chunks), texts=len(missing_texts), saved=len(texts) - len(missing_texts))
+
+        with self._lock:
+            return [self._rerank_scores[(query, text)] for text in texts]
@@ -6,14 +6,13 @@ import traceback
 from typing import Counter
 
 import numpy as np
-import concurrent
-from collections import OrderedDict
 
 from app.exceptions.http.chat import RerankQuestionException
-from app.libs.rerank import rerank_api
 from app.schemas.doc import DocParagraphSchema, DocTableRowSchema, DocParagraphMetaTreeSchema
+from app.services.chat.request_memo import RequestMemo
 from app.services.chat.workflow_chat.schemas import Context, RetrieveContext
-from app.support.helper import duplicates_list, log_duration, softmax, split_list
+from app.support import scoring
+from app.support.helper import duplicates_list, log_duration, softmax
 
 
 @log_duration()
@@ -24,7 +23,7 @@ def rerank_by_question(context: Context) -> list[RetrieveContext]:
 
         rerank_texts = [[strip_text_before_rerank(text)] for text in table_r_texts + paragraph_r_texts]
         # 调用 RerankApi 去获取分数
-        rerank_scores = rerank_max_score(context.question_analysis.rewrite_question, rerank_texts)
+        rerank_scores = rerank_max_score(context.question_analysis.rewrite_question, rerank_texts, context.memo)
         # 重排去重后去计算 repeat score
         r_contexts = generate_retrieve_contexts(context, rerank_scores)
         r_contexts.sort(key=lambda x: x.question_rerank_score, reverse=True)
@@ -120,7 +119,7 @@ def strip_text_before_rerank(str):
     return new_str
 
 
-def rerank_max_score(txt1: str, txt2s) -> list[float]:
+def rerank_max_score(txt1: str, txt2s, memo: RequestMemo) -> list[float]:
     """
     滑窗段落根据段落切分，算问题和召回内容的相似度.
     Args:
@@ -148,33 +147,11 @@ def rerank_max_score(txt1: str, txt2s) -> list[float]:
             # 表格线替换为空
             txt2 = txt2.replace('|', ' ')
             clean_txt2s.append(txt2)
-        concurrent_split_txts = split_list(txt2_combines_all, chunk_size=16)
-        pairs = [[[txt1], concurrent_split_txt] for concurrent_split_txt in concurrent_split_txts]
-        tasks_with_index = [
-            (i, txt2) for i, txt2 in enumerate(pairs)
-        ]
-
-        with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
-            futures = {executor.submit(rerank_api, txt2, if_softmax=0): idx for idx, txt2 in tasks_with_index}
-
-            # 使用OrderedDict来保证按原顺序收集结果
-            ordered_results = OrderedDict()
-            for future in concurrent.futures.as_completed(futures):
-                idx = futures[future]
-                result = future.result()
-                ordered_results[idx] = result
-
-            # 提取并排序结果
-            ress = [ordered_results[i] for i in range(len(ordered_results))]
-        text_span_scores = [score for text_span_score in ress for score in text_span_score]
-        text_span_scores = [round(score, 4) for score in softmax(text_span_scores)]
-
-        start = 0
-        for txt2_combine_length in txt2_combines_length:
-            text_span_score = text_span_scores[start:start + txt2_combine_length]
-            start += txt2_combine_length
-            similarity = max(text_span_score) if text_span_score else 0  # txt2 为空列表的时候
-            similarities.append(similarity)
+        # 请求内备忘去重，未命中的文本分批并发请求
+        text_span_scores = memo.rerank(txt1, txt2_combines_all)
+        # 每个召回内容取各span softmax得分的最大值，txt2 为空列表时为0
+        span_max_scores = scoring.segment_max(scoring.softmax(text_span_scores), txt2_combines_length)
+        similarities = [round(score, 4) for score in span_max_scores.tolist()]
     return np.array(similarities).tolist()
 
 
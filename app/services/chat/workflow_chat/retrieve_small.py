@@ -1,11 +1,13 @@
 import logging
+import numpy as np
 import traceback
+from typing import Callable
 from app.exceptions.http.chat import RetrieveSmallException
 from config.config import settings
-from app.libs.acge_embedding import get_similar_top_n
 from app.schemas.elasticsearch import ESParagraphSlice, ESTableRowSlice
+from app.services.chat.request_memo import RequestMemo
 from app.services.chat.workflow_chat.schemas import Context
-from app.services.elasticsearch_retrieval import elasticsearch_retrieve
+from app.services.elasticsearch_retrieval import RetrievalPlan, plan_elasticsearch_retrieve, plan_embeddings
 from app.support.helper import log_duration
 from app.schemas.doc import DocTableRowSchema, DocParagraphSchema
 from app.schemas.chat import EmbeddingArgSchema
@@ -15,8 +17,16 @@ from app.schemas.chat import EmbeddingArgSchema
 def retrieve_small(context: Context) -> tuple[list[DocTableRowSchema], list[DocParagraphSchema]]:
     try:
         file_ids = [cur.file_id for cur in context.file_meta_list]
-        table_retrieve_results = retrieve_by_table(context, file_ids)
-        paragraph_retrieve_results = retrieve_by_paragraph(context, file_ids)
+        # 表格与段落的全部查询合并为一次 _msearch
+        plan = RetrievalPlan()
+        collect_table = plan_by_table(plan, context, file_ids)
+        collect_paragraph = plan_by_paragraph(plan, context, file_ids)
+        plan.execute()
+        context.retrieval_took.extend(plan.stats())
+        logging.info(f'retrieve_small msearch took: {plan.stats()}')
+
+        table_retrieve_results = collect_table()
+        paragraph_retrieve_results = collect_paragraph()
         return table_retrieve_results, paragraph_retrieve_results
 
     except Exception as e:
@@ -24,32 +34,58 @@ def retrieve_small(context: Context) -> tuple[list[DocTableRowSchema], list[DocP
         raise RetrieveSmallException()
 
 
-def retrieve_by_table(context: Context, file_ids: list[str]) -> list[DocTableRowSchema]:
+def plan_by_table(plan: RetrievalPlan, context: Context, file_ids: list[str]) -> Callable[[], list[DocTableRowSchema]]:
     # 表格召回
-    table_retrieve_results = []
-    for keyword in context.question_analysis.keywords:
-        hits = elasticsearch_retrieve(
+    keyword_fuses = []
+    for idx, keyword in enumerate(context.question_analysis.keywords):
+        keyword_fuses.append(plan_elasticsearch_retrieve(
+            plan,
+            name=f"table_keyword{idx}",
             index=ESTableRowSlice.Index.name,
             bm25_text=keyword,
             b25_text_field="embed_text",
             bm25_size=min(200, 5 * len(file_ids)),
             op_fields=ESTableRowSlice.keys(),
             must_conditions=[dict(terms={"file_uuid.keyword": file_ids})]
-        )
+        ))
+
+    # 向量召回：问题向量与入库时的行向量做相似度，补充BM25未召回的行
+    question_embedding = context.memo.embedding(context.chat_request.question)
+    embedding_search = plan_embeddings(
+        plan,
+        name="table_acge",
+        index=ESTableRowSlice.Index.name,
+        embedding_field_name="embedding",
+        question_embedding=question_embedding,
+        size=min(200, 5 * len(file_ids)),
+        op_fields=ESTableRowSlice.keys(),
+        must_conditions=[dict(terms={"file_uuid.keyword": file_ids}), dict(exists={"field": "embedding"})]
+    )
+
+    def collect() -> list[DocTableRowSchema]:
+        table_retrieve_results = []
+        for fuse in keyword_fuses:
+            table_retrieve_results.extend(
+                ESTableRowSlice.from_es(hit).to_schema() for hit in fuse()
+            )
+
+        recalled_uuids = {hit.uuid for hit in table_retrieve_results}
         table_retrieve_results.extend(
-            ESTableRowSlice.from_es(hit).to_schema() for hit in hits
+            hit for hit in (ESTableRowSlice.from_es(hit).to_schema() for hit in embedding_search.hits) if hit.uuid not in recalled_uuids
         )
 
-    table_retrieve_results = filter_by_embedding(table_retrieve_results, context.chat_request.question, 0.5)
-    return table_retrieve_results[0:min(3 * len(file_ids), 100)]
+        table_retrieve_results = filter_by_embedding(table_retrieve_results, question_embedding, 0.5, context.memo)
+        return table_retrieve_results[0:min(3 * len(file_ids), 100)]
 
+    return collect
 
-def retrieve_by_paragraph(context: Context, file_ids: list[str]) -> list[DocParagraphSchema]:
-    # 段落召回
-    paragraph_retrieve_results = []
 
+def plan_by_paragraph(plan: RetrievalPlan, context: Context, file_ids: list[str]) -> Callable[[], list[DocParagraphSchema]]:
+    # 段落召回
     size = min(300, 15 * len(file_ids))
-    hits = elasticsearch_retrieve(
+    fuse = plan_elasticsearch_retrieve(
+        plan,
+        name="paragraph",
         index=ESParagraphSlice.Index.name,
         bm25_text=context.question_analysis.rewrite_question,
         bm25_size=size,
@@ -57,18 +93,36 @@ def retrieve_by_paragraph(context: Context, file_ids: list[str]) -> list[DocPara
         op_fields=ESParagraphSlice.keys(exclude=["embedding"]),
         text_for_embedding=context.question_analysis.rewrite_question,
         embedding_arg=EmbeddingArgSchema(field="embedding", dimension=settings.api.embedding.dimension, size=size),
-        must_conditions=[dict(terms={"file_uuid.keyword": file_ids})]
+        must_conditions=[dict(terms={"file_uuid.keyword": file_ids})],
+        embedding_func=context.memo.embedding
     )
 
-    paragraph_retrieve_results = [
-        ESParagraphSlice.from_es(hit).to_schema() for hit in hits
-    ]
+    def collect() -> list[DocParagraphSchema]:
+        paragraph_retrieve_results = [
+            ESParagraphSlice.from_es(hit).to_schema() for hit in fuse()
+        ]
+
+        return paragraph_retrieve_results[0:min(8 * len(file_ids), 150)]
+
+    return collect
+
 
-    return paragraph_retrieve_results[0:min(8 * len(file_ids), 150)]
+def filter_by_embedding(hits: list[DocTableRowSchema], sentence_embedding: list[float], match_score: float, memo: RequestMemo):
+    """
+    使用入库时的行向量在本地计算相似度，历史数据没有向量的行再调用embedding服务
+    """
+    texts_vec = {hit.keywords_text: hit.embedding for hit in hits if hit.embedding}
+    missing_texts = list({hit.keywords_text for hit in hits} - set(texts_vec))
+    if missing_texts:
+        texts_vec.update(zip(missing_texts, memo.embedding_multi(missing_texts)))
 
+    scores = {}
+    if texts_vec:
+        similarity_list = (np.array(list(texts_vec.values())) @ np.array(sentence_embedding)).tolist()
+        scores = {text: np.round(similarity, 4) for text, similarity in zip(texts_vec, similarity_list)}
 
-def filter_by_embedding(hits: list[DocTableRowSchema], sentence: str, match_score: float):
-    keywords = ["".join(hit.keywords) for hit in hits]
-    embedding_matches = get_similar_top_n(texts=keywords, sentence=sentence, top_n=len(keywords))
-    matches = [embedding_match for embedding_match in embedding_matches if embedding_match[1] >= match_score]
-    return [hit for hit in hits if "".join(hit.keywords) in list([match[0] for match in matches])]
+    matches = [hit for hit in hits if scores.get(hit.keywords_text, 0) >= match_score]
+    # 向量只用于过滤，避免后续阶段携带
+    for hit in matches:
+        hit.embedding = []
+    return matches
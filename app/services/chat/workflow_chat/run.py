@@ -25,7 +25,7 @@ def run_workflow(chat_request: ChatRequest, file_meta_list: list[FileMetaSchema]
         context.retrieve_contexts_by_answer = rerank_by_answer.rerank_by_answer(context)
         resp = ChatResponse(content=context.llm_answer, total_tokens=total_tokens, retrieval=[
             r.resp().model_dump() for r in context.retrieve_contexts_by_answer
-        ])
+        ], remote_calls=context.memo.stats())
         del context
         return resp
 
@@ -42,7 +42,8 @@ def process_generation_stream(context: Context, generation_resp: Generator[Union
         data=dict(
             retrieval=[
                 r.resp().model_dump() for r in context.retrieve_contexts_by_answer
-            ]
+            ],
+            remote_calls=context.memo.stats(),
         )
     )
     del context
@@ -4,6 +4,7 @@ import traceback
 from app.exceptions.http.chat import TrunctionException
 from app.schemas.doc import DocParagraphMetaTreeSchema, DocTableRowSchema, DocOriginSchema
 from app.services.chat.workflow_chat.schemas import Context, RetrieveContext
+from app.support import scoring
 from app.support.helper import duplicates_list, log_duration
 from config.config import settings
 
@@ -55,15 +56,8 @@ def generate_tree_text(retrieve_context: RetrieveContext, origin_slice_map: dict
 
 
 def top_p(retrieve_contexts: list[RetrieveContext], top_p_score) -> list[RetrieveContext]:
-    tt_score = sum([retrieval_info.rerank_score_before_llm for retrieval_info in retrieve_contexts])
-    top_p_score_this, results = 0.0, []
-    for retrieval_info in retrieve_contexts:
-        if top_p_score >= top_p_score_this:
-            results.append(retrieval_info)
-            top_p_score_this += retrieval_info.rerank_score_before_llm / tt_score
-        else:
-            break
-    return results
+    scores = [retrieval_info.rerank_score_before_llm for retrieval_info in retrieve_contexts]
+    return retrieve_contexts[:scoring.top_p_cutoff(scores, top_p_score, normalize=True)]
 
 
 def truncation_by_token_limit(retrieve_contexts: list[RetrieveContext], max_length) -> list[RetrieveContext]:
@@ -2,21 +2,20 @@
 import logging
 import re
 import traceback
-import concurrent
-from collections import OrderedDict
 
 import numpy as np
 from app.exceptions.http.global_chat import RerankAnswerException
-from app.libs.rerank import rerank_api
+from app.services.chat.request_memo import RequestMemo
 from app.services.chat.workflow_global_chat.schemas import Context, RetrieveContext
-from app.support.helper import log_duration, softmax, split_list
+from app.support import scoring
+from app.support.helper import log_duration
 from config.config import settings
 
 
 @log_duration()
 def rerank_by_answer(context: Context) -> list[RetrieveContext]:
     try:
-        return Reranking(context.retrieve_contexts)(question=context.question_analysis.rewrite_question, answer=context.llm_answer)
+        return Reranking(context.retrieve_contexts, context.memo)(question=context.question_analysis.rewrite_question, answer=context.llm_answer)
     except Exception as e:
         logging.error(f'rerank_by_answer error: {e}, {traceback.format_exc()}')
         raise RerankAnswerException()
@@ -27,8 +26,9 @@ class Reranking:
     根据结果进行排序.
     """
 
-    def __init__(self, retrieval_infos: list[RetrieveContext]):
+    def __init__(self, retrieval_infos: list[RetrieveContext], memo: RequestMemo = None):
         self.retrieval_infos = retrieval_infos
+        self.memo = memo or RequestMemo()
 
     @staticmethod
     def split_text_span(text, pattern):
@@ -52,9 +52,7 @@ class Reranking:
             # 表格线替换为空
             txt2 = txt2.replace('|', ' ')
             clean_txt2s.append(txt2)
-        pairs = [[txt1], clean_txt2s]
-        scores = rerank_api(pairs, headers=None, if_softmax=0)
-        return scores
+        return self.memo.rerank(txt1, clean_txt2s)
 
     def rerank_max_score(self, txt1: str, txt2s) -> np.ndarray:
         """
@@ -79,33 +77,12 @@ class Reranking:
                 txt2_combines_length.append(1)
         # 每个划窗的span的分数
         if len(txt2_combines_all) > 0:
+            # 请求内备忘去重，多个召回内容中重复的span只请求一次
+            text_span_scores = self.rerank_score(txt1, txt2_combines_all)
 
-            concurrent_split_txts = split_list(txt2_combines_all, chunk_size=16)
-            tasks_with_index = [
-                (i, txt2) for i, txt2 in enumerate(concurrent_split_txts)
-            ]
-            with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
-                futures = {executor.submit(self.rerank_score, txt1, txt2): idx for idx, txt2 in tasks_with_index}
-
-                # 使用OrderedDict来保证按原顺序收集结果
-                ordered_results = OrderedDict()
-                for future in concurrent.futures.as_completed(futures):
-                    idx = futures[future]
-                    result = future.result()
-                    ordered_results[idx] = result
-
-                # 提取并排序结果
-                ress = [ordered_results[i] for i in range(len(ordered_results))]
-            text_span_scores = [score for text_span_score in ress for score in text_span_score]
-            text_span_scores = [round(score, 4) for score in softmax(text_span_scores)]
-
-            # text_span_scores = self.rerank_score(txt1, txt2_combines_all)
-            start = 0
-            for txt2_combine_length in txt2_combines_length:
-                text_span_score = text_span_scores[start:start + txt2_combine_length]
-                start += txt2_combine_length
-                similarity = max(text_span_score) if text_span_score else 0
-                similarities.append(similarity)
+            # 每个召回内容取各span softmax得分的最大值
+            span_max_scores = scoring.segment_max(scoring.softmax(text_span_scores), txt2_combines_length)
+            similarities = [round(score, 4) for score in span_max_scores.tolist()]
         return np.array(similarities)
 
     def replace_info(self, answer):
@@ -161,11 +138,5 @@ class Reranking:
 
 
 def top_p(retrieval_infos: list[RetrieveContext], top_p_score) -> list[RetrieveContext]:
-    top_p_score_this, results = 0.0, []
-    for retrieval_info in retrieval_infos:
-        if top_p_score >= top_p_score_this:
-            results.append(retrieval_info)
-            top_p_score_this += retrieval_info.answer_rerank_score
-        else:
-            break
-    return results
+    scores = [retrieval_info.answer_rerank_score for retrieval_info in retrieval_infos]
+    return retrieval_infos[:scoring.top_p_cutoff(scores, top_p_score)]
@@ -1,11 +1,13 @@
 import logging
+import numpy as np
 import traceback
+from typing import Callable
 
 from app.exceptions.http.global_chat import RetrieveSmallGlobalException
-from app.libs.acge_embedding import get_similar_top_n
 from app.schemas.elasticsearch import ESParagraphSlice, ESTableRowSlice
+from app.services.chat.request_memo import RequestMemo
 from app.services.chat.workflow_global_chat.schemas import Context
-from app.services.elasticsearch_retrieval import elasticsearch_retrieve
+from app.services.elasticsearch_retrieval import RetrievalPlan, plan_elasticsearch_retrieve, plan_embeddings
 from app.support.helper import log_duration
 from app.schemas.doc import DocTableRowSchema, DocParagraphSchema, FileMetaSchema
 from app.schemas.chat import EmbeddingArgSchema
@@ -17,8 +19,16 @@ from config.config import settings
 @log_duration()
 def retrieve_small_global(context: Context) -> tuple[list[DocTableRowSchema], list[DocParagraphSchema], list[FileMetaSchema]]:
     try:
-        table_retrieve_results = retrieve_by_table(context)
-        paragraph_retrieve_results = retrieve_by_paragraph(context)
+        # 表格与段落的全部查询合并为一次 _msearch，文件信息依赖召回结果，单独查询
+        plan = RetrievalPlan()
+        collect_table = plan_by_table(plan, context)
+        collect_paragraph = plan_by_paragraph(plan, context)
+        plan.execute()
+        context.retrieval_took.extend(plan.stats())
+        logging.info(f'retrieve_small_global msearch took: {plan.stats()}')
+
+        table_retrieve_results = collect_table()
+        paragraph_retrieve_results = collect_paragraph()
         global_locate_file_uuids = [_t.file_uuid for _t in table_retrieve_results] + [_p.file_uuid for _p in paragraph_retrieve_results]
         global_locate_file_uuids = list(set(global_locate_file_uuids))
         global_locate_files: list[ESFile] = ESFile.search().extra(
@@ -33,30 +43,56 @@ def retrieve_small_global(context: Context) -> tuple[list[DocTableRowSchema], li
         raise RetrieveSmallGlobalException()
 
 
-def retrieve_by_table(context: Context) -> list[DocTableRowSchema]:
+def plan_by_table(plan: RetrievalPlan, context: Context) -> Callable[[], list[DocTableRowSchema]]:
     # 表格召回
-    table_retrieve_results = []
-    for keyword in context.question_analysis.keywords:
-        hits = elasticsearch_retrieve(
+    keyword_fuses = []
+    for idx, keyword in enumerate(context.question_analysis.keywords):
+        keyword_fuses.append(plan_elasticsearch_retrieve(
+            plan,
+            name=f"table_keyword{idx}",
             index=ESTableRowSlice.Index.name,
             bm25_text=keyword,
             b25_text_field="embed_text",
             bm25_size=25,
             op_fields=ESTableRowSlice.keys(),
-        )
+        ))
+
+    # 向量召回：问题向量与入库时的行向量做相似度，补充BM25未召回的行
+    question_embedding = context.memo.embedding(context.chat_request.question)
+    embedding_search = plan_embeddings(
+        plan,
+        name="table_acge",
+        index=ESTableRowSlice.Index.name,
+        embedding_field_name="embedding",
+        question_embedding=question_embedding,
+        size=25,
+        op_fields=ESTableRowSlice.keys(),
+        must_conditions=[dict(exists={"field": "embedding"})]
+    )
+
+    def collect() -> list[DocTableRowSchema]:
+        table_retrieve_results = []
+        for fuse in keyword_fuses:
+            table_retrieve_results.extend(
+                ESTableRowSlice.from_es(hit).to_schema() for hit in fuse()
+            )
+
+        recalled_uuids = {hit.uuid for hit in table_retrieve_results}
         table_retrieve_results.extend(
-            ESTableRowSlice.from_es(hit).to_schema() for hit in hits
+            hit for hit in (ESTableRowSlice.from_es(hit).to_schema() for hit in embedding_search.hits) if hit.uuid not in recalled_uuids
         )
 
-    table_retrieve_results = filter_by_embedding(table_retrieve_results, context.chat_request.question, 0.5)
-    return table_retrieve_results
+        table_retrieve_results = filter_by_embedding(table_retrieve_results, question_embedding, 0.5, context.memo)
+        return table_retrieve_results
 
+    return collect
 
-def retrieve_by_paragraph(context: Context) -> list[DocParagraphSchema]:
-    # 段落召回
-    paragraph_retrieve_results = []
 
-    hits = elasticsearch_retrieve(
+def plan_by_paragraph(plan: RetrievalPlan, context: Context) -> Callable[[], list[DocParagraphSchema]]:
+    # 段落召回
+    fuse = plan_elasticsearch_retrieve(
+        plan,
+        name="paragraph",
         index=ESParagraphSlice.Index.name,
         bm25_text=context.question_analysis.rewrite_question,
         bm25_size=25,
@@ -64,17 +100,35 @@ def retrieve_by_paragraph(context: Context) -> list[DocParagraphSchema]:
         op_fields=ESParagraphSlice.keys(exclude=["embedding"]),
         text_for_embedding=context.question_analysis.rewrite_question,
         embedding_arg=EmbeddingArgSchema(field="embedding", dimension=settings.api.embedding.dimension, size=25),
+        embedding_func=context.memo.embedding
     )
 
-    paragraph_retrieve_results = [
-        ESParagraphSlice.from_es(hit).to_schema() for hit in hits
-    ]
+    def collect() -> list[DocParagraphSchema]:
+        paragraph_retrieve_results = [
+            ESParagraphSlice.from_es(hit).to_schema() for hit in fuse()
+        ]
+
+        return paragraph_retrieve_results
+
+    return collect
+
 
-    return paragraph_retrieve_results
+def filter_by_embedding(hits: list[DocTableRowSchema], sentence_embedding: list[float], match_score: float, memo: RequestMemo):
+    """
+    使用入库时的行向量在本地计算相似度，历史数据没有向量的行再调用embedding服务
+    """
+    texts_vec = {hit.keywords_text: hit.embedding for hit in hits if hit.embedding}
+    missing_texts = list({hit.keywords_text for hit in hits} - set(texts_vec))
+    if missing_texts:
+        texts_vec.update(zip(missing_texts, memo.embedding_multi(missing_texts)))
 
+    scores = {}
+    if texts_vec:
+        similarity_list = (np.array(list(texts_vec.values())) @ np.array(sentence_embedding)).tolist()
+        scores = {text: np.round(similarity, 4) for text, similarity in zip(texts_vec, similarity_list)}
 
-def filter_by_embedding(hits: list[DocTableRowSchema], sentence: str, match_score: float):
-    keywords = ["".join(hit.keywords) for hit in hits]
-    embedding_matches = get_similar_top_n(texts=keywords, sentence=sentence, top_n=len(keywords))
-    matches = [embedding_match for embedding_match in embedding_matches if embedding_match[1] >= match_score]
-    return [hit for hit in hits if "".join(hit.keywords) in list([match[0] for match in matches])]
+    matches = [hit for hit in hits if scores.get(hit.keywords_text, 0) >= match_score]
+    # 向量只用于过滤，避免后续阶段携带
+    for hit in matches:
+        hit.embedding = []
+    return matches
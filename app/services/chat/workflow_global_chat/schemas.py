@@ -1,9 +1,10 @@
 
 from typing import Union
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 from app.schemas.chat import GlobalChatRequest, QuestionAnalysisSchema, RetrieveContextResponse
 from app.schemas.doc import FileMetaSchema, DocTableRowSchema, DocParagraphSchema, DocOriginSchema, DocParagraphMetaTreeSchema
+from app.services.chat.request_memo import RequestMemo
 
 
 class Context(BaseModel):
@@ -18,11 +19,16 @@ class Context(BaseModel):
     f_paragraph_retrieve_results: list[DocParagraphSchema] = []  # 段落检索结果【通过locate_files】
     table_retrieve_results: list[DocTableRowSchema] = []        # 表格检索结果【Merge】
     paragraph_retrieve_results: list[DocParagraphSchema] = []   # 段落检索结果【Merge】
+    retrieval_took: list[dict] = []                             # 召回查询的ES耗时 [{name, index, took, hits}]
     origin_slice_map: dict[str, DocOriginSchema] = []           # 源文件检索结果【DocOriginSchema.uuid: DocOriginSchema】
     paragraph_meta_tree_map: dict[str, DocParagraphMetaTreeSchema] = {}   # 段落uuid对应DocParagraphMeta的映射 【DocParagraphMetaTreeSchema.uuid, DocParagraphMetaTreeSchema】
     retrieve_contexts: list["RetrieveContext"] = []             # Rerank之后的召回列表
     retrieve_contexts_by_answer: list["RetrieveContext"] = []   # Rerank By Answer之后的召回列表
     llm_answer: str = ""                                        # llm的回答
+    memo: RequestMemo = Field(default_factory=RequestMemo, exclude=True)  # 本次问答的embedding/rerank调用备忘
+
+    class Config:
+        arbitrary_types_allowed = True  # 允许 RequestMemo 类型
 
 
 class RetrieveContext(BaseModel):
@@ -0,0 +1,176 @@
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+from app.libs.acge_embedding import acge_embedding_multi
+from app.libs.minio import MinioClient
+from app.support.cache import CacheStats, register_cache_stats
+from config.config import settings
+
+EMBEDDING_CACHE_PREFIX = "embedding-cache/"
+
+
+class EmbeddingStore(ABC):
+    """
+    向量持久化存储，key为 hash(模型, 维度, 精度, 文本)
+    """
+
+    @abstractmethod
+    def get_many(self, keys: list[str]) -> dict[str, list[float]]:
+        ...
+
+    @abstractmethod
+    def set_many(self, embeddings: dict[str, list[float]]):
+        ...
+
+
+class SqliteEmbeddingStore(EmbeddingStore):
+    """
+    本地磁盘存储，条目数超过 max_entries 时淘汰最久未访问的向量
+    """
+
+    def __init__(self, path: str = settings.app.wf_parse.embedding_cache_path, max_entries: int = settings.app.wf_parse.embedding_cache_max_entries):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._max_entries = max_entries
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute("CREATE TABLE IF NOT EXISTS embedding (key TEXT PRIMARY KEY, vector BLOB NOT NULL, accessed_at REAL NOT NULL)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embedding_accessed_at ON embedding (accessed_at)")
+            self._count = self._conn.execute("SELECT COUNT(*) FROM embedding").fetchone()[0]
+
+    def get_many(self, keys: list[str]) -> dict[str, list[float]]:
+        if not keys:
+            return {}
+
+        placeholders = ",".join("?" * len(keys))
+        with self._lock, self._conn:
+            rows = self._conn.execute(f"SELECT key, vector FROM embedding WHERE key IN ({placeholders})", keys).fetchall()
+            if rows:
+                self._conn.executemany("UPDATE embedding SET accessed_at = ? WHERE key = ?", [(time.time(), key) for key, _ in rows])
+        return {key: np.frombuffer(vector, dtype=np.float64).tolist() for key, vector in rows}
+
+    def set_many(self, embeddings: dict[str, list[float]]):
+        if not embeddings:
+            return
+
+        now = time.time()
+        rows = [(key, np.asarray(vector, dtype=np.float64).tobytes(), now) for key, vector in embeddings.items()]
+        with self._lock, self._conn:
+            before = self._conn.total_changes
+            self._conn.executemany("INSERT OR IGNORE INTO embedding (key, vector, accessed_at) VALUES (?, ?, ?)", rows)
+            self._count += self._conn.total_changes - before
+            if self._count > self._max_entries:
+                evict_count = self._count - self._max_entries
+                self._conn.execute(
+                    "DELETE FROM embedding WHERE key IN (SELECT key FROM embedding ORDER BY accessed_at LIMIT ?)", (evict_count,)
+                )
+                self._count -= evict_count
+
+
+class MinioEmbeddingStore(EmbeddingStore):
+    """
+    MinIO存储，多实例共享；过期淘汰依赖 embedding-cache/ 前缀上配置的生命周期规则
+    每个向量一个对象，一批的读写在线程池中并发执行；未命中的key也是一次GET请求(404)
+    """
+
+    def __init__(self, concurrency: int = settings.app.wf_parse.embedding_cache_minio_concurrency):
+        self._concurrency = concurrency
+
+    def get_many(self, keys: list[str]) -> dict[str, list[float]]:
+        if not keys:
+            return {}
+
+        minio_client = MinioClient()
+        with ThreadPoolExecutor(max_workers=min(self._concurrency, len(keys))) as executor:
+            contents = executor.map(lambda key: minio_client.download_content_if_exists(f"{EMBEDDING_CACHE_PREFIX}{key}"), keys)
+            return {
+                key: np.frombuffer(content, dtype=np.float64).tolist()
+                for key, content in zip(keys, contents) if content is not None
+            }
+
+    def set_many(self, embeddings: dict[str, list[float]]):
+        if not embeddings:
+            return
+
+        minio_client = MinioClient()
+        with ThreadPoolExecutor(max_workers=min(self._concurrency, len(embeddings))) as executor:
+            futures = [
+                executor.submit(minio_client.upload_content, f"{EMBEDDING_CACHE_PREFIX}{key}", np.asarray(vector, dtype=np.float64).tobytes())
+                for key, vector in embeddings.items()
+            ]
+            for future in futures:
+                future.result()
+
+
+def make_embedding_store() -> EmbeddingStore:
+    if settings.app.wf_parse.embedding_cache_store == "minio":
+        return MinioEmbeddingStore()
+    return SqliteEmbeddingStore()
+
+
+class EmbeddingCache(object):
+    """
+    入库向量缓存：批内去重，只把缓存未命中的文本发给embedding服务
+    """
+
+    def __init__(self):
+        self.stats = register_cache_stats("embedding")
+        self._store = None
+        self._lock = threading.Lock()
+
+    @property
+    def store(self) -> EmbeddingStore:
+        with self._lock:
+            if self._store is None:
+                self._store = make_embedding_store()
+        return self._store
+
+    @staticmethod
+    def make_key(text: str, dimension: int, digit: int, model_id: str) -> str:
+        return hashlib.sha256(f"{model_id}\0{dimension}\0{digit}\0{text}".encode("utf-8")).hexdigest()
+
+    def embedding_multi(self, text_list: list[str], stats: CacheStats = None,
+                        dimension=settings.api.embedding.dimension, digit=settings.api.embedding.digit) -> list[list[float]]:
+        """
+        Args:
+            stats: 本次解析的命中统计，tier: store(持久化缓存命中) | batch(批内重复文本)
+        """
+        if not settings.app.wf_parse.embedding_cache_enabled:
+            return acge_embedding_multi(text_list, dimension=dimension, digit=digit)
+
+        keys = [self.make_key(text, dimension, digit, settings.api.embedding.version) for text in text_list]
+        key_texts = dict(zip(keys, text_list))
+
+        try:
+            embeddings = self.store.get_many(list(key_texts))
+        except Exception as e:
+            # 缓存异常不影响入库流程
+            logging.warning(f"embedding cache get error: {e}")
+            embeddings = {}
+
+        miss_keys = [key for key in key_texts if key not in embeddings]
+        if miss_keys:
+            miss_embeddings = dict(zip(miss_keys, acge_embedding_multi([key_texts[key] for key in miss_keys], dimension=dimension, digit=digit)))
+            try:
+                self.store.set_many(miss_embeddings)
+            except Exception as e:
+                logging.warning(f"embedding cache set error: {e}")
+            embeddings.update(miss_embeddings)
+
+        for _stats in filter(None, (self.stats, stats)):
+            _stats.hit("store", len(key_texts) - len(miss_keys))
+            _stats.hit("batch", len(keys) - len(key_texts))
+            _stats.miss(len(miss_keys))
+
+        return [embeddings[key] for key in keys]
+
+
+embedding_cache_ins = EmbeddingCache()
@@ -0,0 +1,68 @@
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import logging
+import multiprocessing
+import os
+import threading
+
+from app.support.image import convert_page_image
+from config.config import settings
+
+
+class ImagePipeline(object):
+    """
+    进程内共享的页面图片转换：图片解码与WebP编码是CPU密集操作，放到进程池中执行，不受GIL限制
+    所有解析任务共用同一个进程池，进程池在第一次使用时创建
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._executor: ProcessPoolExecutor = None
+
+    @staticmethod
+    def workers() -> int:
+        return settings.app.wf_parse.pic_convert_workers or min(4, os.cpu_count() or 1)
+
+    @staticmethod
+    def variants() -> dict[str, tuple[int, int]]:
+        return {name: (int(size), int(quality)) for name, (size, quality) in settings.app.wf_parse.pic_variants.items()}
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                # 服务进程中有ES写入等后台线程，使用spawn创建子进程，避免fork继承锁的状态
+                self._executor = ProcessPoolExecutor(max_workers=self.workers(), mp_context=multiprocessing.get_context("spawn"))
+            return self._executor
+
+    def _reset_executor(self, executor: ProcessPoolExecutor):
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    async def convert(self, image_base64: str) -> dict:
+        """
+        转换一页图片，返回 convert_page_image 的结果
+        子进程异常退出(如内存不足被kill)时重建进程池并重试一次
+        """
+        loop = asyncio.get_running_loop()
+        args = (image_base64, settings.app.wf_parse.pic_webp_quality, self.variants())
+        for retry in range(2):
+            executor = self._get_executor()
+            try:
+                return await loop.run_in_executor(executor, convert_page_image, *args)
+            except BrokenProcessPool:
+                logging.warning("image pipeline process pool broken, recreate it")
+                self._reset_executor(executor)
+                if retry:
+                    raise
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+
+image_pipeline_ins = ImagePipeline()
@@ -0,0 +1,197 @@
+import asyncio
+import base64
+import logging
+import re
+import traceback
+from typing import Callable, Optional
+
+from app.libs.minio import MinioClient
+from app.libs.textin_pic_download import TextinDownload
+from app.services.doc.image_pipeline import image_pipeline_ins
+from app.support import xjson
+from config.config import settings
+
+# 页面图片对象名：pics/{file_id}_{页序号}.webp，其他尺寸为 pics/{file_id}_{页序号}_{名称}.webp
+PAGE_IMAGE_PATTERN = re.compile(r"^pics/(?P<file_id>[0-9A-Za-z]+)_(?P<page_idx>\d+)(?:_(?P<variant>\w+))?\.webp$")
+# 尚未备份完的文件，记录每页对应的textin image_id
+PENDING_PREFIX = "pic-pending/"
+
+
+def page_image_name(file_id: str, page_idx: int, variant: str = None, ext: str = "webp") -> str:
+    if variant:
+        return f"pics/{file_id}_{page_idx}_{variant}.{ext}"
+    return f"pics/{file_id}_{page_idx}.{ext}"
+
+
+def pending_name(file_id: str) -> str:
+    return f"{PENDING_PREFIX}{file_id}.json"
+
+
+async def backup_page_image(file_id: str, page_idx: int, image_id: str) -> dict:
+    """
+    下载textin页面图片，在进程池中转换为WebP(以及配置的其他尺寸)后上传minio
+    :return: {url, variants: {名称: url}, convert_ms, src_bytes, dst_bytes}
+    """
+    try:
+        file_img_base64 = await TextinDownload().aysnc_download_textin_img(image_id)
+    except Exception as e:
+        logging.error(f"download textin image {image_id} error: {e}")
+        raise e
+
+    try:
+        converted = await image_pipeline_ins.convert(file_img_base64)
+    except Exception as e:
+        logging.error(f"convert image {image_id} to webp error: {e}")
+        converted = None
+
+    # minio上传是阻塞操作，放到线程中执行
+    return await asyncio.to_thread(save_img, file_id, page_idx, file_img_base64, converted)
+
+
+def save_img(file_id, page_idx, file_img_base64: str, converted: dict = None) -> dict:
+    if converted is None:
+        # 转换失败时保存原图
+        file_img_stream = base64.b64decode(file_img_base64)
+        object_name = page_image_name(file_id, page_idx, ext="png")
+        MinioClient().upload_content(object_name, file_img_stream)
+        return dict(url=object_name, variants={}, convert_ms=0, src_bytes=len(file_img_stream), dst_bytes=len(file_img_stream))
+
+    object_name = page_image_name(file_id, page_idx)
+    MinioClient().upload_content(object_name, converted["webp"])
+    variants = {}
+    for name, variant_bytes in converted["variants"].items():
+        variants[name] = page_image_name(file_id, page_idx, name)
+        MinioClient().upload_content(variants[name], variant_bytes)
+
+    return dict(
+        url=object_name,
+        variants=variants,
+        convert_ms=converted["duration_ms"],
+        src_bytes=converted["src_bytes"],
+        dst_bytes=len(converted["webp"]),
+    )
+
+
+class PageImageBackup(object):
+    """
+    页面图片按需备份(pic_backup_mode=lazy)：
+    - 解析时只备份前 pic_eager_pages 页，其余页面的image_id记录在 pic-pending/{file_id}.json
+    - 第一次访问页面图片时下载、转换并保存到minio
+    - 后台任务在没有解析任务执行时逐页补齐，全部备份后删除记录
+    """
+
+    def __init__(self):
+        # 同一页面同时只备份一次，key为 (file_id, page_idx)
+        self._inflight: dict[tuple[str, int], asyncio.Task] = {}
+        self._sweeper: asyncio.Task = None
+
+    @staticmethod
+    def save_pending(file_id: str, image_ids: list[str]):
+        MinioClient().upload_content(pending_name(file_id), xjson.dumpb(dict(image_ids=image_ids)))
+
+    @staticmethod
+    def load_pending(file_id: str) -> Optional[list[str]]:
+        client = MinioClient()
+        if not client.exists(pending_name(file_id)):
+            return None
+        return xjson.loads(client.download_content(pending_name(file_id)))["image_ids"]
+
+    @staticmethod
+    def remove_pending(file_id: str):
+        MinioClient().remove(pending_name(file_id))
+
+    async def backup(self, file_id: str, page_idx: int, image_id: str) -> dict:
+        key = (file_id, page_idx)
+        task = self._inflight.get(key)
+        if task is None:
+            task = self._inflight[key] = asyncio.ensure_future(backup_page_image(file_id, page_idx, image_id))
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def materialize(self, object_name: str) -> Optional[str]:
+        """
+        按需备份访问的页面图片，返回可以读取的对象名，不是待备份的页面时返回None
+        转换失败时保存的是png原图，返回png的对象名
+        """
+        match = PAGE_IMAGE_PATTERN.match(object_name)
+        if not match:
+            return None
+        file_id, page_idx, variant = match.group("file_id"), int(match.group("page_idx")), match.group("variant")
+        if variant and variant not in settings.app.wf_parse.pic_variants:
+            return None
+
+        client = MinioClient()
+        png_name = page_image_name(file_id, page_idx, ext="png")
+        if await asyncio.to_thread(client.exists, png_name):
+            return png_name
+
+        image_ids = await asyncio.to_thread(self.load_pending, file_id)
+        if image_ids is None or page_idx >= len(image_ids):
+            return None
+
+        page = await self.backup(file_id, page_idx, image_ids[page_idx])
+        return page["variants"].get(variant, page["url"]) if variant else page["url"]
+
+    async def backfill(self, file_id: str, should_pause: Callable[[], bool]) -> bool:
+        """
+        补齐文件中尚未备份的页面，全部完成后删除待备份记录
+        每页备份前检查待备份记录是否仍存在，文件已删除时停止补齐
+        :return: 是否全部完成，should_pause 返回True时中途暂停
+        """
+        image_ids = await asyncio.to_thread(self.load_pending, file_id)
+        if image_ids is None:
+            return True
+
+        client = MinioClient()
+        failed = 0
+        for page_idx, image_id in enumerate(image_ids):
+            if should_pause():
+                return False
+            if not await asyncio.to_thread(client.exists, pending_name(file_id)):
+                # 补齐过程中文件被删除，清理本轮已保存的页面图片后结束
+                removed = await asyncio.to_thread(client.remove_prefix, f"pics/{file_id}_")
+                logging.info(f"file {file_id} deleted while backfilling page images, removed: {removed}")
+                return True
+            if await asyncio.to_thread(client.exists, page_image_name(file_id, page_idx)) \
+                    or await asyncio.to_thread(client.exists, page_image_name(file_id, page_idx, ext="png")):
+                continue
+            try:
+                await self.backup(file_id, page_idx, image_id)
+            except Exception as e:
+                # 保留待备份记录，下一轮重试，不影响其他页面与文件
+                logging.warning(f"backfill file {file_id} page {page_idx} image error: {e}")
+                failed += 1
+
+        if not failed:
+            await asyncio.to_thread(self.remove_pending, file_id)
+        logging.info(f"file {file_id} page images backfilled, pages: {len(image_ids)}, failed: {failed}")
+        return True
+
+    async def _sweep(self, should_pause: Callable[[], bool]):
+        while True:
+            await asyncio.sleep(settings.app.wf_parse.pic_sweeper_interval)
+            if should_pause():
+                continue
+            try:
+                object_names = await asyncio.to_thread(MinioClient().list_names, PENDING_PREFIX)
+                for object_name in object_names:
+                    file_id = object_name[len(PENDING_PREFIX):].removesuffix(".json")
+                    if not await self.backfill(file_id, should_pause):
+                        break
+            except Exception as e:
+                logging.error(f'page image sweeper error: {e}, {traceback.format_exc()}')
+
+    def start_sweeper(self, should_pause: Callable[[], bool]):
+        """
+        启动后台补齐任务，should_pause 返回True时(如有解析任务在执行)让出资源
+        """
+        if self._sweeper is None:
+            self._sweeper = asyncio.create_task(self._sweep(should_pause))
+
+    def stop_sweeper(self):
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            self._sweeper = None
+
+
+page_image_ins = PageImageBackup()
@@ -1,10 +1,17 @@
+import asyncio
+import logging
+import traceback
+
 from fastapi import File, UploadFile
 
 from config.config import settings
 from app.consts.doc import EXT_ALLOW_TYPES
-from app.schemas.doc import FileDeleteResponse, FileMetaSchema
+from app.exceptions.http.doc import ParseJobNotFoundException
+from app.schemas.doc import FileDeleteResponse, FileMetaSchema, ParseJobSchema
 from app.schemas.elasticsearch import ESFile, ESOriginSlice, ESParagraphSlice, ESTableRowSlice
+from app.services.doc.parse_job import parse_job_queue_ins
 from app.services.doc.workflow_parse.run import run_workflow
+from app.services.doc.workflow_parse.upload2minio import remove_file_objects
 
 
 class DocParserService:
@@ -26,6 +33,17 @@ class DocParserService:
     async def parse_file(self, file: UploadFile = File(...)) -> FileMetaSchema:
         return await run_workflow(file)
 
+    async def submit_parse_job(self, file: UploadFile = File(...), ingest_mode: bool = None) -> ParseJobSchema:
+        if ingest_mode is None:
+            ingest_mode = settings.app.wf_parse.ingest_mode
+        return await parse_job_queue_ins.submit(file, ingest_mode)
+
+    def get_parse_job(self, job_id: str) -> ParseJobSchema:
+        job = parse_job_queue_ins.store.get(job_id)
+        if not job:
+            raise ParseJobNotFoundException()
+        return job
+
     async def get_all_files(self) -> list[FileMetaSchema]:
         es_files: list[ESFile] = ESFile.search().extra(size=settings.app.file_list_max_size).source(excludes=["paragraph_slices_meta", "extra"]).execute().hits
         return [es_file.to_schema() for es_file in es_files]
@@ -48,6 +66,13 @@ class DocParserService:
         file_query = ESFile.search().filter("term", **{"uuid.keyword": file_id})
         file_delete_count = file_query.delete().total
 
+        # 删除minio中的解析结果与页面图片，ES记录已删除，失败时只记录日志
+        try:
+            removed = await asyncio.to_thread(remove_file_objects, file_id)
+            logging.info(f"delete file {file_id}, minio objects: {removed}")
+        except Exception as e:
+            logging.error(f'delete file {file_id} minio objects error: {e}, {traceback.format_exc()}')
+
         return FileDeleteResponse(
             file_delete_count=file_delete_count,
             origin_slice_delete_count=origin_slice_delete_count,
@@ -0,0 +1,258 @@
+from abc import ABC, abstractmethod
+import asyncio
+from collections import OrderedDict
+from datetime import datetime
+import logging
+import os
+import shutil
+import socket
+import sqlite3
+import tempfile
+import threading
+import time
+import traceback
+from typing import Optional
+
+from fastapi import HTTPException, UploadFile
+
+from app.consts.doc import PARSE_STAGES
+from app.exceptions.http.doc import ParseFileException, ParseJobInterruptedException, ParseJobQueueFullException
+from app.schemas.doc import ParseJobSchema, ParseJobStageSchema
+from app.services.doc.workflow_parse.run import run_workflow
+from app.support.helper import uuid_base62
+from config.config import settings
+
+
+class ParseJobStore(ABC):
+    """
+    解析任务状态存储
+    """
+
+    @abstractmethod
+    def get(self, job_id: str) -> Optional[ParseJobSchema]:
+        ...
+
+    @abstractmethod
+    def save(self, job: ParseJobSchema):
+        ...
+
+    def heartbeat(self):
+        """
+        记录本进程仍然存活，多个进程共用存储时，其他进程据此判断任务是否仍在执行
+        """
+
+    def fail_stale(self, error: dict, ttl: float) -> int:
+        """
+        把所属进程已退出(超过ttl秒没有心跳)的未结束(pending/running)任务标记为失败，返回标记的任务数
+        这些任务排队中的文件随进程退出已丢失，不会再执行
+        """
+        return 0
+
+
+class MemoryParseJobStore(ParseJobStore):
+    """
+    进程内存储，仅保留最近 max_size 个任务
+    """
+
+    def __init__(self, max_size: int = settings.app.wf_parse.job_store_max_size):
+        self._max_size = max_size
+        self._jobs: OrderedDict[str, str] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, job_id: str) -> Optional[ParseJobSchema]:
+        with self._lock:
+            job_json = self._jobs.get(job_id)
+        return ParseJobSchema.model_validate_json(job_json) if job_json else None
+
+    def save(self, job: ParseJobSchema):
+        job_json = job.model_dump_json()
+        with self._lock:
+            self._jobs[job.job_id] = job_json
+            self._jobs.move_to_end(job.job_id)
+            while len(self._jobs) > self._max_size:
+                self._jobs.popitem(last=False)
+
+
+class SqliteParseJobStore(ParseJobStore):
+    """
+    SQLite存储，进程重启后仍可查询任务状态
+    多个进程可以共用一个文件：每个任务记录所属进程(owner)，各进程定时写入心跳
+    """
+
+    def __init__(self, path: str = settings.app.wf_parse.job_store_path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.owner = f"{socket.gethostname()}-{os.getpid()}-{uuid_base62()}"
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute("CREATE TABLE IF NOT EXISTS parse_job (job_id TEXT PRIMARY KEY, data TEXT NOT NULL, updated_at TEXT NOT NULL)")
+            # 旧版本创建的表没有owner列
+            if "owner" not in [row[1] for row in self._conn.execute("PRAGMA table_info(parse_job)")]:
+                self._conn.execute("ALTER TABLE parse_job ADD COLUMN owner TEXT")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS parse_job_owner (owner TEXT PRIMARY KEY, heartbeat_at REAL NOT NULL)")
+
+    def get(self, job_id: str) -> Optional[ParseJobSchema]:
+        with self._lock:
+            row = self._conn.execute("SELECT data FROM parse_job WHERE job_id = ?", (job_id,)).fetchone()
+        return ParseJobSchema.model_validate_json(row[0]) if row else None
+
+    def save(self, job: ParseJobSchema):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO parse_job (job_id, data, updated_at, owner) VALUES (?, ?, ?, ?)",
+                (job.job_id, job.model_dump_json(), job.updated_at.isoformat(), self.owner)
+            )
+
+    def heartbeat(self):
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO parse_job_owner (owner, heartbeat_at) VALUES (?, ?)", (self.owner, time.time()))
+
+    def fail_stale(self, error: dict, ttl: float) -> int:
+        expired_at = time.time() - ttl
+        with self._lock, self._conn:
+            # 旧版本写入的任务没有owner，按已退出处理
+            rows = self._conn.execute(
+                "SELECT data FROM parse_job WHERE json_extract(data, '$.status') IN ('pending', 'running') "
+                "AND owner IS NOT ? AND (owner IS NULL OR owner NOT IN (SELECT owner FROM parse_job_owner WHERE heartbeat_at > ?))",
+                (self.owner, expired_at)
+            ).fetchall()
+            self._conn.execute("DELETE FROM parse_job_owner WHERE heartbeat_at <= ?", (expired_at,))
+
+        for row in rows:
+            job = ParseJobSchema.model_validate_json(row[0])
+            job.status = "failed"
+            job.error = error
+            job.updated_at = datetime.now()
+            self.save(job)
+        return len(rows)
+
+
+def make_parse_job_store() -> ParseJobStore:
+    if settings.app.wf_parse.job_store == "sqlite":
+        return SqliteParseJobStore()
+    return MemoryParseJobStore()
+
+
+class ParseJobQueue:
+    """
+    后台解析任务队列：上传后立即返回job，由固定数量的worker执行解析流程
+    """
+
+    def __init__(self, store: ParseJobStore):
+        self.store = store
+        self._queue: asyncio.Queue = None
+        self._workers: list[asyncio.Task] = []
+        self._heartbeat_task: asyncio.Task = None
+        self._active = 0
+
+    @property
+    def busy(self) -> bool:
+        """
+        是否有排队或执行中的解析任务
+        """
+        return self._active > 0 or (self._queue is not None and not self._queue.empty())
+
+    def start(self, fail_stale: bool = True):
+        """
+        启动worker与心跳；fail_stale 为True时(服务启动时)还会定时把已退出进程遗留的任务标记为失败
+        """
+        # 先写入心跳，其他进程不会把本进程随后保存的任务当作遗留任务
+        self.store.heartbeat()
+        self._queue = asyncio.Queue(maxsize=settings.app.wf_parse.job_queue_size)
+        self._workers = [asyncio.create_task(self._work()) for _ in range(settings.app.wf_parse.job_workers)]
+        self._heartbeat_task = asyncio.create_task(self._heartbeat(fail_stale))
+
+    def stop(self):
+        for task in self._workers + [self._heartbeat_task]:
+            if task is not None:
+                task.cancel()
+        self._workers = []
+        self._heartbeat_task = None
+
+    async def _heartbeat(self, fail_stale: bool):
+        ttl = settings.app.wf_parse.job_owner_ttl
+        while True:
+            try:
+                self.store.heartbeat()
+                if fail_stale:
+                    interrupted = self.store.fail_stale(ParseJobInterruptedException.detail, ttl)
+                    if interrupted:
+                        logging.warning(f"{interrupted} parse jobs of exited processes marked as failed")
+            except Exception as e:
+                logging.warning(f"parse job heartbeat error: {e}")
+            await asyncio.sleep(ttl / 3)
+
+    async def submit(self, file: UploadFile, ingest_mode: bool = False) -> ParseJobSchema:
+        if self._queue is None:
+            self.start(fail_stale=False)
+        if self._queue.full():
+            raise ParseJobQueueFullException()
+
+        # 请求结束后UploadFile会被关闭，先把文件落盘
+        spooled_file = await asyncio.to_thread(spool_upload_file, file)
+        job = ParseJobSchema(
+            job_id=uuid_base62(),
+            file_name=file.filename,
+            ingest_mode=ingest_mode,
+            stages=[ParseJobStageSchema(name=name) for name in PARSE_STAGES],
+        )
+        try:
+            self._queue.put_nowait((job, spooled_file))
+        except asyncio.QueueFull:
+            await spooled_file.close()
+            raise ParseJobQueueFullException()
+
+        self.store.save(job)
+        return job
+
+    async def _work(self):
+        while True:
+            job, file = await self._queue.get()
+            self._active += 1
+            try:
+                await self._run(job, file)
+            except Exception as e:
+                logging.error(f'parse job {job.job_id} error: {e}, {traceback.format_exc()}')
+            finally:
+                self._active -= 1
+                await file.close()
+                self._queue.task_done()
+
+    async def _run(self, job: ParseJobSchema, file: UploadFile):
+        job.status = "running"
+        self._save(job)
+        try:
+            job.file_meta = await run_workflow(file, on_progress=lambda stage: self._on_progress(job, stage), ingest_mode=job.ingest_mode)
+            job.status = "success"
+        except HTTPException as e:
+            job.status = "failed"
+            job.error = e.detail if isinstance(e.detail, dict) else dict(message=str(e.detail))
+        except Exception:
+            job.status = "failed"
+            job.error = ParseFileException.detail
+            raise
+        finally:
+            self._save(job)
+
+    def _on_progress(self, job: ParseJobSchema, stage: ParseJobStageSchema):
+        job.stages = [stage if _stage.name == stage.name else _stage for _stage in job.stages]
+        job.progress = round(sum(1 for _stage in job.stages if _stage.status == "success") / len(job.stages), 4)
+        self._save(job)
+
+    def _save(self, job: ParseJobSchema):
+        job.updated_at = datetime.now()
+        self.store.save(job)
+
+
+def spool_upload_file(file: UploadFile) -> UploadFile:
+    """
+    将上传文件复制到临时文件中，返回新的UploadFile
+    """
+    spooled = tempfile.TemporaryFile()
+    file.file.seek(0)
+    shutil.copyfileobj(file.file, spooled, 1024 * 1024)
+    spooled.seek(0)
+    return UploadFile(file=spooled, filename=file.filename, headers=file.headers)
+
+
+parse_job_queue_ins = ParseJobQueue(make_parse_job_store())
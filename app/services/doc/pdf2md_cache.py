@@ -0,0 +1,85 @@
+import hashlib
+import logging
+import os
+import tempfile
+from typing import Optional
+
+from minio import S3Error
+
+from app.libs.minio import MinioClient
+from app.schemas.doc import Pdf2MdSchema
+from app.services.doc.pdf2md_result import decompress, get_codec, load_pdf2md_result, write_pdf2md_result
+from app.support import xjson
+from app.support.cache import DiskLRUCache, register_cache_stats
+from config.config import settings
+
+PDF2MD_CACHE_PREFIX = "pdf2md-cache/"
+
+
+class Pdf2MdCache(object):
+    """
+    pdf2md结果缓存，key为 文件内容sha256 + 影响输出的TextIn参数
+    两级存储：本地磁盘LRU -> MinIO(pdf2md-cache/)
+    """
+
+    def __init__(self):
+        self.stats = register_cache_stats("pdf2md")
+        self._disk = None
+
+    @property
+    def disk(self) -> DiskLRUCache:
+        if self._disk is None:
+            self._disk = DiskLRUCache(settings.app.wf_parse.pdf2md_cache_dir, settings.app.wf_parse.pdf2md_cache_max_bytes)
+        return self._disk
+
+    @staticmethod
+    def make_key(file_hash: str, options: dict) -> str:
+        options_hash = hashlib.sha256(xjson.dumps(sorted(options.items())).encode("utf-8")).hexdigest()
+        return f"{file_hash}-{options_hash[:16]}"
+
+    @staticmethod
+    def object_name(key: str) -> str:
+        return f"{PDF2MD_CACHE_PREFIX}{key}.json{get_codec().ext}"
+
+    def get(self, key: str) -> Optional[Pdf2MdSchema]:
+        try:
+            content = self.disk.get(key)
+            if content is not None:
+                self.stats.hit("disk")
+            else:
+                content = self._download(key)
+                if content is not None:
+                    self.stats.hit("minio")
+                    self.disk.set(key, content)
+
+            if content is None:
+                self.stats.miss()
+                return None
+
+            return load_pdf2md_result(decompress(content))
+        except Exception as e:
+            # 缓存异常不影响解析流程
+            logging.warning(f"pdf2md cache get {key} error: {e}")
+            return None
+
+    def set(self, key: str, pdf2md_result: Pdf2MdSchema):
+        try:
+            # 压缩结果流式写入临时文件，不在内存中保留完整的压缩结果
+            os.makedirs(settings.app.wf_parse.pdf2md_spool_dir, exist_ok=True)
+            with tempfile.TemporaryFile(dir=settings.app.wf_parse.pdf2md_spool_dir) as f:
+                write_pdf2md_result(pdf2md_result, f)
+                self.disk.set_fileobj(key, f)
+                MinioClient().upload_fileobj(self.object_name(key), f)
+        except Exception as e:
+            logging.warning(f"pdf2md cache set {key} error: {e}")
+
+    def _download(self, key: str) -> Optional[bytes]:
+        try:
+            return MinioClient().download_content(self.object_name(key))
+        except S3Error as e:
+            if e.code != "NoSuchKey":
+                raise e
+            return None
+
+
+pdf2md_cache_ins = Pdf2MdCache()
@@ -0,0 +1,211 @@
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import lru_cache
+import os
+import tempfile
+from typing import BinaryIO, Callable, Iterator, Optional
+
+from app.libs.minio import MinioClient
+from app.schemas.doc import Pdf2MdSchema
+from app.support import xjson
+from app.support.codec import GZIP_MAGIC, ZSTD_MAGIC, Codec, GzipCodec, ZstdCodec
+from app.support.spool import JsonLinesSpool
+from config.config import settings
+
+DETAIL_FIELDS = tuple(Pdf2MdSchema.Detail.model_fields)
+METRIC_FIELDS = tuple(Pdf2MdSchema.Metric.model_fields)
+
+
+def new_pages_spool() -> JsonLinesSpool:
+    return JsonLinesSpool(settings.app.wf_parse.pdf2md_spool_dir)
+
+
+@lru_cache(maxsize=None)
+def get_codec(name: str = None) -> Codec:
+    """
+    pdf2md结果的压缩格式，默认使用配置的 pdf2md_codec
+    """
+    name = name or settings.app.wf_parse.pdf2md_codec
+    if name == "zstd":
+        return ZstdCodec(settings.app.wf_parse.pdf2md_zstd_level, settings.app.wf_parse.pdf2md_zstd_dict_path)
+    if name == "gzip":
+        return GzipCodec(settings.app.wf_parse.pdf2md_gzip_level)
+    raise ValueError(f"unknown pdf2md codec: {name}")
+
+
+def codec_for_content(content: bytes) -> Codec:
+    """
+    按压缩内容的magic判断格式，切换压缩格式后仍可以读取之前保存的结果
+    """
+    if content.startswith(ZSTD_MAGIC):
+        return get_codec("zstd")
+    if content.startswith(GZIP_MAGIC):
+        return get_codec("gzip")
+    raise ValueError("unknown compressed content")
+
+
+def codec_for_object(object_name: str) -> Optional[Codec]:
+    """
+    按对象名后缀判断格式，不是压缩对象时返回None
+    """
+    if object_name.endswith(ZstdCodec.ext):
+        return get_codec("zstd")
+    if object_name.endswith(GzipCodec.ext):
+        return get_codec("gzip")
+    return None
+
+
+def decompress(content: bytes) -> bytes:
+    return codec_for_content(content).decompress(content)
+
+
+def load_pdf2md_result(content: bytes) -> Pdf2MdSchema:
+    """
+    解析pdf2md的返回结果
+    - detail/metrics 只保留目录树与切片需要的字段，使用 model_construct 跳过逐条校验
+    - pages(含字符级坐标等，体积最大) 逐页转存到临时文件，不随结果常驻内存
+    """
+    response_dict = xjson.loads(content)
+    if response_dict["code"] != 200:
+        raise Exception(response_dict["code"])
+
+    result_dict = response_dict["result"]
+    pages_spool = new_pages_spool()
+    pages = result_dict.pop("pages", [])
+    # 边转存边释放已写入的页
+    pages.reverse()
+    while pages:
+        pages_spool.append(pages.pop())
+
+    result = Pdf2MdSchema.ResultData.model_construct(
+        pages=[],
+        detail=[
+            Pdf2MdSchema.Detail.model_construct(**{k: item[k] for k in DETAIL_FIELDS if k in item})
+            for item in result_dict.get("detail", [])
+        ],
+        total_page_count=result_dict.get("total_page_count", 0),
+    )
+    result._pages_spool = pages_spool
+
+    return Pdf2MdSchema.model_construct(
+        result=result,
+        metrics=[
+            Pdf2MdSchema.Metric.model_construct(**{k: item[k] for k in METRIC_FIELDS if k in item})
+            for item in response_dict.get("metrics", [])
+        ],
+        version=response_dict.get("version", ""),
+        duration=response_dict.get("duration", 0),
+        code=response_dict["code"],
+    )
+
+
+def iter_page_lines(result: Pdf2MdSchema.ResultData, page_hook: Callable[[dict], None] = None) -> Iterator[bytes]:
+    """
+    逐页输出序列化后的pages，不需要修改页面内容时直接使用转存的原始行
+    """
+    if page_hook is None and result._pages_spool is not None:
+        yield from result._pages_spool.iter_lines()
+        pages = result.pages
+    else:
+        pages = result.iter_pages()
+
+    for page in pages:
+        if page_hook is not None:
+            page_hook(page)
+        yield xjson.dumpb(page)
+
+
+def write_pdf2md_result(pdf2md_result: Pdf2MdSchema, fileobj: BinaryIO, codec: Codec = None, page_hook: Callable[[dict], None] = None):
+    """
+    流式压缩写入json，结构与 xjson.dumps(pdf2md_result.model_dump()) 一致
+    pages逐页写入压缩流，不在内存中拼出完整的json字符串
+    """
+    result_rest = xjson.dumpb(pdf2md_result.result.model_dump(exclude={"pages"}))
+    response_rest = xjson.dumpb(pdf2md_result.model_dump(exclude={"result"}))
+
+    with (codec or get_codec()).open_writer(fileobj) as f:
+        f.write(b'{"result":{"pages":[')
+        for idx, line in enumerate(iter_page_lines(pdf2md_result.result, page_hook)):
+            if idx:
+                f.write(b",")
+            f.write(line)
+        # 去掉其余字段的开头"{"，拼接在pages之后
+        f.write(b"]," + result_rest[1:] + b"," + response_rest[1:])
+
+
+def upload_pdf2md_object(object_name: str, pdf2md_result: Pdf2MdSchema, codec: Codec = None, page_hook: Callable[[dict], None] = None):
+    """
+    压缩结果写入临时文件后上传minio，不在内存中保留完整的压缩结果
+    """
+    os.makedirs(settings.app.wf_parse.pdf2md_spool_dir, exist_ok=True)
+    with tempfile.TemporaryFile(dir=settings.app.wf_parse.pdf2md_spool_dir) as f:
+        write_pdf2md_result(pdf2md_result, f, codec, page_hook)
+        MinioClient().upload_fileobj(object_name, f)
+
+
+def upload_pdf2md_chunks(prefix: str, pdf2md_result: Pdf2MdSchema, toc: list[dict], codec: Codec = None,
+                         page_hook: Callable[[dict], None] = None, chunk_pages: int = 10) -> str:
+    """
+    按页分块保存，前端先获取清单，再按需获取页面所在的块，首屏不再依赖文档长度
+    - {prefix}/manifest.json: 目录、页数、每页尺寸以及各块的路径，不压缩
+    - {prefix}/pages_{起始页序号}{ext}: 每 chunk_pages 页一块，内容为pages的json数组
+    - {prefix}/result{ext}: 除pages以外的结果，结构与完整结果一致，pages为空
+    :return: 清单的对象名
+    """
+    codec = codec or get_codec()
+    concurrency = settings.app.wf_parse.pdf2md_upload_concurrency
+    chunks = []
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        # 上传中的块，超过并发数时等待最早的块上传完成，内存中最多保留 concurrency 个压缩后的块
+        futures: deque[Future] = deque()
+
+        def submit(object_name: str, content: bytes):
+            while len(futures) >= concurrency:
+                futures.popleft().result()
+            futures.append(executor.submit(MinioClient().upload_content, object_name, content))
+
+        def upload_chunk(lines: list[bytes]):
+            page_start = sum(chunk["page_count"] for chunk in chunks)
+            object_name = f"{prefix}/pages_{page_start}{codec.ext}"
+            content = codec.compress(b"[" + b",".join(lines) + b"]")
+            chunks.append(dict(url=object_name, page_start=page_start, page_count=len(lines), bytes=len(content)))
+            submit(object_name, content)
+
+        lines = []
+        for line in iter_page_lines(pdf2md_result.result, page_hook):
+            lines.append(line)
+            if len(lines) >= chunk_pages:
+                upload_chunk(lines)
+                lines = []
+        if lines:
+            upload_chunk(lines)
+
+        result_name = f"{prefix}/result{codec.ext}"
+        submit(result_name, dump_pdf2md_result_rest(pdf2md_result, codec))
+        while futures:
+            futures.popleft().result()
+
+    manifest_name = f"{prefix}/manifest.json"
+    MinioClient().upload_content(manifest_name, xjson.dumpb(dict(
+        codec=codec.name,
+        total_page_count=pdf2md_result.result.total_page_count,
+        page_count=sum(chunk["page_count"] for chunk in chunks),
+        chunk_pages=chunk_pages,
+        pages=[
+            dict(page_id=metric.page_id, width=metric.page_image_width, height=metric.page_image_height, angle=metric.angle)
+            for metric in pdf2md_result.metrics
+        ],
+        toc=toc,
+        result_url=result_name,
+        chunks=chunks,
+    )))
+    return manifest_name
+
+
+def dump_pdf2md_result_rest(pdf2md_result: Pdf2MdSchema, codec: Codec = None) -> bytes:
+    """
+    压缩除pages以外的结果
+    """
+    result_rest = xjson.dumpb(pdf2md_result.result.model_dump(exclude={"pages"}))
+    response_rest = xjson.dumpb(pdf2md_result.model_dump(exclude={"result"}))
+    return (codec or get_codec()).compress(b'{"result":{"pages":[],' + result_rest[1:] + b"," + response_rest[1:])
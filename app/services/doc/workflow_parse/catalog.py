@@ -5,26 +5,25 @@ import traceback
 from app.exceptions.http.doc import CatalogException
 from app.schemas.doc import CatalogTreeSchema, Pdf2MdSchema
 
-from app.services.doc.workflow_parse.schemas import Context
+from app.services.doc.workflow_parse.schemas import CatalogTree, Context
 from app.support.helper import log_duration
 
 
 @log_duration()
-def catalog(context: Context) -> CatalogTreeSchema:
+def catalog(context: Context) -> CatalogTree:
     try:
         if is_ppt(context):
             tree = build_tree_by_page(context.pdf2md_result.result.detail)
-            catalog = CatalogTreeSchema(tree=[tree], generate=[])
 
         else:
             new_detail = detail_process(context.pdf2md_result.result.detail, keep_hierarchy=False)
             tree = TreeBuild(new_detail)
-            catalog = CatalogTreeSchema(tree=[tree], generate=tree_generate(tree))
+            tree.generate = tree_generate(tree)
 
-        if len(catalog.tree) == 0:
+        if len(tree) == 0:
             raise Exception("目录树解析为空")
 
-        return catalog
+        return tree
 
     except Exception as e:
         logging.error(f'catalog error: {e}, {traceback.format_exc()}')
@@ -39,7 +38,7 @@ def is_ppt(context: Context):
     return is_ppt
 
 
-def build_tree_by_page(md_detail: list[Pdf2MdSchema.Detail]):
+def build_tree_by_page(md_detail: list[Pdf2MdSchema.Detail]) -> CatalogTree:
     """
     Args:
         md_detail: pdf2md的结果
@@ -49,37 +48,20 @@ def build_tree_by_page(md_detail: list[Pdf2MdSchema.Detail]):
 
     """
     # 构造基础目录树
-    tree = CatalogTreeSchema.TreeNode(
-        label="Root",
-        page_id=0,
-        pos=[0, 0, 1, 0, 1, 1, 0, 1],
-        ori_ids=["-1,-1"],
-        content=["Root"],
-        tree_level=0
-    )
+    tree = CatalogTree()
+    root = tree.add_node(-1, label="Root", pos=[0, 0, 1, 0, 1, 1, 0, 1], ori_ids=["-1,-1"], text="Root", tree_level=0, page_id=0)
     # 去掉页眉页脚
     md_detail = [d for d in md_detail if d.content != 1 or d.text.strip() != ""]
     grouped_data = groupby(md_detail, key=lambda x: x.page_id)
     for page_id, group in grouped_data:
-        page = CatalogTreeSchema.TreeNode(page_id=page_id)
-        grouped_items = list(group)
-        for ind, item in enumerate(grouped_items):
+        page = -1
+        for ind, item in enumerate(group):
+            ori_ids = [str(item.page_id - 1) + "," + str(item.paragraph_id)]
             if ind == 0:
-                page.label = "Heading"
-                page.pos = item.position
-                page.ori_ids = [str(item.page_id - 1) + "," + str(item.paragraph_id)]
-                page.content = [item.text]
-                page.tree_level = 1
+                page = tree.add_node(root, label="Heading", pos=item.position, ori_ids=ori_ids, text=item.text, tree_level=1, page_id=page_id)
             else:
-                leaf_node = CatalogTreeSchema.TreeNode(page_id=page_id)
-                leaf_node.label = "Table" if item.type == "table" else "Text"
-                leaf_node.pos = item.position
-                leaf_node.ori_ids = [
-                    str(item.page_id - 1) + "," + str(item.paragraph_id)]
-                leaf_node.content = [item.text]
-                leaf_node.tree_level = 2
-                page.children.append(leaf_node)
-        tree.children.append(page)
+                tree.add_node(page, label="Table" if item.type == "table" else "Text", pos=item.position, ori_ids=ori_ids,
+                              text=item.text, tree_level=2, page_id=page_id)
 
     return tree
 
@@ -143,56 +125,39 @@ def detail_process(md_detail: list[Pdf2MdSchema.Detail], keep_hierarchy=False):
     return new_detail
 
 
-def TreeBuild(preorder: list[Pdf2MdSchema.Detail]):
+def TreeBuild(preorder: list[Pdf2MdSchema.Detail]) -> CatalogTree:
+    tree = CatalogTree()
     if not preorder:
-        return None
-
-    root = CatalogTreeSchema.TreeNode(
-        content=[preorder[0].text],
-        page_id=preorder[0].page_id,
-        tree_level=preorder[0]._tree_level + 1,
-        label=preorder[0]._label,
-        pos=preorder[0].position,
-        ori_ids=[str(preorder[0].page_id - 1) + ","
-                 + str(preorder[0].paragraph_id)]
-    )
-    stack = [(root, root.tree_level - 1)]
-
-    for ind, p in enumerate(preorder[1:]):
-        depth = preorder[ind + 1]._tree_level
+        return tree
+
+    # (节点编号, 深度)
+    stack = []
+    for p in preorder:
+        depth = p._tree_level
         while stack and stack[-1][1] >= depth:
             stack.pop()
 
-        node = CatalogTreeSchema.TreeNode(
-            content=[p.text],
-            page_id=p.page_id,
-            tree_level=p._tree_level + 1,
+        node = tree.add_node(
+            stack[-1][0] if stack else -1,
             label=p._label,
             pos=p.position,
-            ori_ids=[str(p.page_id - 1) + "," + str(p.paragraph_id)]
+            ori_ids=[str(p.page_id - 1) + "," + str(p.paragraph_id)],
+            text=p.text,
+            tree_level=p._tree_level + 1,
+            page_id=p.page_id,
         )
-        if stack:
-            stack[-1][0].children.append(node)
         stack.append((node, depth))
 
-    return root
-
-
-def tree_generate(tree: CatalogTreeSchema.TreeNode):
+    return tree
 
-    result = []
-    if tree.children:
-        if tree.tree_level > 0:
-            result.append(
-                CatalogTreeSchema.TreeGenerateNode(
-                    content=tree.content[0] if tree.content else "",
-                    pageNum=tree.page_id,
-                    pos=tree.pos,
-                    level=tree.tree_level)
-            )
-        for child in tree.children:
-            result.extend(
-                tree_generate(child)
-            )
 
-    return result
+def tree_generate(tree: CatalogTree) -> list[CatalogTreeSchema.TreeGenerateNode]:
+    # 节点按先序编号，顺序遍历即为先序遍历
+    return [
+        CatalogTreeSchema.TreeGenerateNode(
+            content=tree.text[idx],
+            pageNum=tree.page_id[idx],
+            pos=tree.pos[idx],
+            level=tree.tree_level[idx])
+        for idx in range(len(tree)) if tree.has_children(idx) and tree.tree_level[idx] > 0
+    ]
@@ -1,77 +1,114 @@
-
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import suppress
 import logging
+import threading
 import traceback
 import pypeln as pl
-from elasticsearch.helpers import bulk
-from elasticsearch_dsl import Document
 
 from app.exceptions.http.doc import EmbeddingUploadSlicesException
-from app.schemas.doc import DocParagraphSchema, DocTableRowSchema, Pdf2MdSchema
-from app.schemas.elasticsearch import ESParagraphSlice, ESTableRowSlice
+from app.schemas.doc import DocOriginSchema, DocParagraphSchema, DocTableRowSchema, Pdf2MdSchema
+from app.schemas.elasticsearch import ESOriginSlice, ESParagraphSlice, ESTableRowSlice
+from app.services.doc.embedding_cache import embedding_cache_ins
 from app.services.doc.workflow_parse.schemas import Context
+from app.services.elasticsearch_bulk import BulkSession, bulk_indexer_ins
+from app.services.elasticsearch_ingest import ingest_mode_ins
+from app.support.cache import CacheStats
 from app.support.helper import batch_generator, log_duration
-from app.providers.elasticsearch_provider import get_es_client
-from app.libs.acge_embedding import acge_embedding_multi
 from config.config import settings
 
 
 @log_duration()
 def embedding_and_upload_slices(context: Context) -> Pdf2MdSchema:
+    bulk_session = None
     try:
-        upload_paragraph_slices(context.paragraph_slices, context.file_uuid)
-        upload_table_slices(context.table_row_slices, context.file_uuid)
+        # 本次解析的向量缓存命中统计
+        embedding_stats = CacheStats()
+        # 段落、表格行、原文切片同时写入共享的bulk队列，段落和表格行共用embedding并发数
+        # 解析流程中其他阶段失败时(context.cancel_event)，写入随之取消
+        bulk_session = bulk_indexer_ins.session(context.cancel_event)
+        embedding_semaphore = threading.Semaphore(settings.app.wf_parse.embedding_concurrency)
+        with ingest_mode_ins.ingest(context.ingest_mode), ThreadPoolExecutor(max_workers=3) as executor:
+            futures = [
+                executor.submit(upload_paragraph_slices, context.paragraph_slices, context.file_uuid, bulk_session, embedding_semaphore, embedding_stats),
+                executor.submit(upload_table_slices, context.table_row_slices, context.file_uuid, bulk_session, embedding_semaphore, embedding_stats),
+                executor.submit(upload_origin_slices, context.origin_slices, context.file_uuid, bulk_session),
+            ]
+            try:
+                [future.result() for future in futures]
+            except BaseException:
+                # 任一类切片写入失败时取消会话，其他切片的写入随之结束
+                bulk_session.cancel()
+                raise
+            bulk_stats = bulk_session.wait()
+
+        logging.info(f"file {context.file_uuid} embedding cache: {embedding_stats.to_dict()}, bulk: {bulk_stats}")
+        if "embedding_and_upload_slices" in context.stages:
+            context.stages["embedding_and_upload_slices"].detail.update(embedding_cache=embedding_stats.to_dict(), bulk=bulk_stats)
     except Exception as e:
         logging.error(f'embedding_and_upload_slices error: {e}, {traceback.format_exc()}')
+        if bulk_session is not None:
+            # 等待已发送的批次结束，返回后不再有本次解析的写入，便于清理
+            bulk_session.cancel()
+            with suppress(Exception):
+                bulk_session.wait()
         raise EmbeddingUploadSlicesException()
 
 
+def embedding_stage(slices: list, embedding_multi, embedding_semaphore: threading.Semaphore):
+    """
+    分批向量化，输出队列有界，写入队列阻塞时向量化随之暂停
+    """
+    def _embedding_multi(_slices: list):
+        with embedding_semaphore:
+            return embedding_multi(_slices)
+
+    return (
+        batch_generator(slices, settings.app.wf_parse.embedding_batch_size)
+        | pl.thread.map(
+            _embedding_multi,
+            workers=settings.app.wf_parse.embedding_concurrency,
+            maxsize=settings.app.wf_parse.embedding_concurrency,
+        )
+        | pl.sync.flat_map(lambda x: x)
+    )
+
+
 @log_duration(prefix="embedding_and_upload_slices_")
-def upload_paragraph_slices(paragraph_slices: list[DocParagraphSchema], file_uuid: str):
+def upload_paragraph_slices(paragraph_slices: list[DocParagraphSchema], file_uuid: str, bulk_session: BulkSession,
+                            embedding_semaphore: threading.Semaphore, embedding_stats: CacheStats = None):
 
     def _acge_embedding_multi(_paragraph_slices: list[DocParagraphSchema]):
-        embeddings = acge_embedding_multi([x.embed_text for x in _paragraph_slices])
+        embeddings = embedding_cache_ins.embedding_multi([x.embed_text for x in _paragraph_slices], stats=embedding_stats)
         for _paragraph_slice, embedding in zip(_paragraph_slices, embeddings):
             _paragraph_slice.embedding = embedding
 
         return _paragraph_slices
 
-    def _insert_es(_paragraph_slices: list[DocParagraphSchema]):
-        es_paragraph_slices = [ESParagraphSlice.from_schema(paragraph_slice, file_uuid=file_uuid) for paragraph_slice in _paragraph_slices]
-        if not bulk_create_documents(es_paragraph_slices):
-            raise Exception("bulk_create_paragraph_slices error")
-
-        for _paragraph_slice in _paragraph_slices:
-            del _paragraph_slice.embedding
-
-        for _es_paragraph_slice in es_paragraph_slices:
-            del _es_paragraph_slice.embedding
-
-    batch_generator(
-        (
-            batch_generator(paragraph_slices, settings.app.wf_parse.embedding_batch_size)
-            | pl.thread.map(
-                _acge_embedding_multi,
-                workers=settings.app.wf_parse.embedding_concurrency,
-            )
-            | pl.sync.flat_map(lambda x: x)
-        ),
-        settings.app.wf_parse.insert_es_with_vector_batch_size
-    ) | pl.thread.map(_insert_es, workers=settings.app.wf_parse.insert_es_concurrency) | list
+    for paragraph_slice in embedding_stage(paragraph_slices, _acge_embedding_multi, embedding_semaphore):
+        bulk_session.add(ESParagraphSlice.from_schema(paragraph_slice, file_uuid=file_uuid))
+        # 写入队列中保存的是序列化后的结果，向量用完即释放
+        del paragraph_slice.embedding
 
 
 @log_duration(prefix="embedding_and_upload_slices_")
-def upload_table_slices(table_slices: list[DocTableRowSchema], file_uuid: str):
+def upload_table_slices(table_slices: list[DocTableRowSchema], file_uuid: str, bulk_session: BulkSession,
+                        embedding_semaphore: threading.Semaphore, embedding_stats: CacheStats = None):
 
-    def _insert_es(_table_slices: list[DocTableRowSchema]):
-        es_table_row_slices = [ESTableRowSlice.from_schema(table_slice, file_uuid=file_uuid) for table_slice in _table_slices]
-        if not bulk_create_documents(es_table_row_slices):
-            raise Exception("bulk_create_table_slices error")
+    def _acge_embedding_multi(_table_slices: list[DocTableRowSchema]):
+        # 关键词为空的行不做向量化
+        _embed_slices = [x for x in _table_slices if x.keywords_text]
+        embeddings = embedding_cache_ins.embedding_multi([x.keywords_text for x in _embed_slices], stats=embedding_stats) if _embed_slices else []
+        for _table_slice, embedding in zip(_embed_slices, embeddings):
+            _table_slice.embedding = embedding
 
-    batch_generator(table_slices, settings.app.wf_parse.insert_es_batch_size) | pl.thread.map(_insert_es, workers=settings.app.wf_parse.insert_es_concurrency) | list
+        return _table_slices
 
+    for table_slice in embedding_stage(table_slices, _acge_embedding_multi, embedding_semaphore):
+        bulk_session.add(ESTableRowSlice.from_schema(table_slice, file_uuid=file_uuid))
+        del table_slice.embedding
 
-def bulk_create_documents(documents: list[Document]) -> bool:
-    success, _ = bulk(get_es_client(), [
-        doc.to_dict(include_meta=True) for doc in documents
-    ])
-    return success == len(documents)
+
+@log_duration(prefix="embedding_and_upload_slices_")
+def upload_origin_slices(origin_slices: list[DocOriginSchema], file_uuid: str, bulk_session: BulkSession):
+    for origin_slice in origin_slices:
+        bulk_session.add(ESOriginSlice.from_schema(origin_slice, file_uuid=file_uuid))
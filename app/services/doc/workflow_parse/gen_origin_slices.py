@@ -1,27 +1,34 @@
 import logging
 import re
 import traceback
-from typing import List, Tuple
+from typing import List
 
 from app.exceptions.http.doc import GenOriginSlicesException
-from app.schemas.doc import CatalogTreeSchema, DocOriginSchema
+from app.schemas.doc import DocOriginSchema
 
-from app.services.doc.workflow_parse.schemas import Context
+from app.services.doc.workflow_parse.schemas import CatalogTree, Context, TitlePaths
 from app.support.helper import log_duration, uuid_base62
-from app.support.transform import html2markdown
+from app.support.table import Table
+
+
+# 标题中的序号、章节等字符
+TITLE_STRIP_PATTERN = re.compile(r'[第一二三四五六七八九十零壹贰叁肆伍陆柒捌玖拾章节、（）()0123456789. ]')
 
 
 @log_duration()
 def gen_origin_slices(context: Context) -> List[DocOriginSchema]:
     try:
-        origin_slices, catalog_tree_nodes = doctree_dfs(context.catalog_tree.tree[0])
-        for origin_slice, catalog_tree_node in zip(origin_slices, catalog_tree_nodes):
+        tree = context.catalog_tree
+        # 原文切片与目录树节点一一对应，下标即节点编号
+        origin_slices = doctree_preorder(tree)
+        for idx, origin_slice in enumerate(origin_slices):
             if origin_slice.type == "table":
-                markdown_str_list = [html2markdown(html) for html in merge_table_htmls(origin_slice.content_html)]
-                markdown_str = "\n".join(markdown_str_list)
+                # 表格只解析一次，后续阶段通过 context.tables 直接使用
+                table = context.tables[origin_slice.uuid] = Table.from_htmls(origin_slice.content_html)
+                markdown_str = table.markdown
                 origin_slice.content_md = markdown_str
-                # 修改context, catalog_tree_node.content 为markdown字符串
-                catalog_tree_node.content = [markdown_str]
+                # 修改context, 目录树节点内容为markdown字符串
+                tree.text[idx] = markdown_str
 
         return origin_slices
 
@@ -30,66 +37,37 @@ def gen_origin_slices(context: Context) -> List[DocOriginSchema]:
         raise GenOriginSlicesException()
 
 
-def doctree_dfs(doctree_node: CatalogTreeSchema.TreeNode, titles=[]) -> Tuple[List[DocOriginSchema], List[CatalogTreeSchema.TreeNode]]:
-    _type = "paragraph"
-    for _content in doctree_node.content:
-        if _content.startswith("<table border="):
-            _type = "table"
-            break
-
-    if _type == "table":
-        content = doctree_node.content  # content is list, 后续需要处理
-    else:
-        content = "\n".join(doctree_node.content)
-
-    origin_item = DocOriginSchema(
-        uuid=uuid_base62(),
-        titles=titles,
-        ori_ids=doctree_node.ori_ids,
-        # content_md=content,
-        content_html=content,
-        type=_type,
-    )
-    # 设置对应关系，到origin_item的uuid，构造PARAGRAPH的时候需要使用上
-    doctree_node.origin_slice_uuid = origin_item.uuid
-    r1, r2 = [origin_item], [doctree_node]
-    if doctree_node.children:
-        if isinstance(content, list):
-            content = content[0] if content else ""
-        child_titles = titles + [re.sub(r'[第一二三四五六七八九十零壹贰叁肆伍陆柒捌玖拾章节、（）()0123456789. ]', '', content)]
-        for child in doctree_node.children:
-            _r1, _r2 = doctree_dfs(child, titles=child_titles)
-            r1.extend(_r1)
-            r2.extend(_r2)
-
-    return r1, r2
-
-
-def merge_table_htmls(htmls) -> list[str]:
+def doctree_preorder(tree: CatalogTree) -> List[DocOriginSchema]:
     """
-    合并表格，合并逻辑为连续的表格进行合并
-    :param lst:
-    :return:
+    按先序遍历顺序为每个目录树节点生成原文切片，标题为各级祖先节点去掉序号后的内容
     """
+    title_paths = TitlePaths()
+    # 节点的子节点共享的标题路径
+    child_title_path = [0] * len(tree)
+    origin_slices = []
+    for idx in range(len(tree)):
+        text = tree.text[idx]
+        parent = tree.parent[idx]
+        title_path = child_title_path[parent] if parent != -1 else 0
 
-    def end_id(i, htmls):
-        while i < len(htmls) - 1:
-            if """<table border="1">""" in htmls[i] and """<table border="1">""" in htmls[i + 1]:
-                i += 1
-            else:
-                break
-        return i
-
-    result = []
-    i = 0
-    while i < len(htmls):
-        if """<table border="1">""" in htmls[i]:
-            j = end_id(i, htmls)
-            result.append("""<table border="1">"""
-                          + "".join([r.replace("""<table border="1">""", "").replace("""</table>""", "") for r in htmls[i:j + 1]])
-                          + """</table>""")
-            i = j + 1
+        if text.startswith("<table border="):
+            _type, content = "table", [text]  # content is list, 后续需要处理
         else:
-            result.append(htmls[i])
-            i += 1
-    return result
+            _type, content = "paragraph", text
+
+        origin_item = DocOriginSchema(
+            uuid=uuid_base62(),
+            titles=title_paths.get(title_path),
+            ori_ids=tree.ori_ids[idx],
+            # content_md=content,
+            content_html=content,
+            type=_type,
+        )
+        # 设置对应关系，到origin_item的uuid，构造PARAGRAPH的时候需要使用上
+        tree.origin_slice_uuid[idx] = origin_item.uuid
+        origin_slices.append(origin_item)
+
+        if tree.has_children(idx):
+            child_title_path[idx] = title_paths.add(title_path, TITLE_STRIP_PATTERN.sub('', text))
+
+    return origin_slices
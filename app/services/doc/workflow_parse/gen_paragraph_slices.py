@@ -1,21 +1,23 @@
 import logging
 import traceback
-from typing import List
+from typing import Callable, List
 
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 
 from app.exceptions.http.doc import GenParagraphSlicesException
-from app.schemas.doc import CatalogTreeSchema, DocParagraphSchema
+from app.schemas.doc import DocParagraphSchema
 
-from app.services.doc.workflow_parse.schemas import Context
+from app.services.doc.workflow_parse.schemas import CatalogTree, Context, TitlePaths
 from app.support.helper import log_duration, uuid_base62
-from app.support.transform import is_financial_string, markdown2list, uneven_list_to_markdown_table
+from app.support.table import Table
+from app.support.transform import get_token_counter, is_financial_string, markdown2list, uneven_list_to_markdown_table
+from config.config import settings
 
 
 @log_duration()
 def gen_paragraph_slices(context: Context) -> List[DocParagraphSchema]:
     try:
-        paragraph_slices = create_paragraph_slices(context.catalog_tree.tree[0])
+        paragraph_slices = create_paragraph_slices(context.catalog_tree, tables=context.tables)
         return paragraph_slices
 
     except Exception as e:
@@ -23,49 +25,73 @@ def gen_paragraph_slices(context: Context) -> List[DocParagraphSchema]:
         raise GenParagraphSlicesException()
 
 
-def create_paragraph_slices(node: CatalogTreeSchema.TreeNode, parent_uuid: str = "", level: int = 1, titles=[]) -> list[DocParagraphSchema]:
+def create_paragraph_slices(tree: CatalogTree, tables: dict[str, Table] = {}) -> list[DocParagraphSchema]:
     """
-    递归地将CatalogTreeSchema.TreeNode转换为DocParagraphSchema列表。
+    将目录树转换为DocParagraphSchema列表，使用显式栈做后序遍历，子节点的切片排在父节点之前。
 
-    :param node: 当前处理的CatalogTreeSchema.TreeNode节点。
-    :param parent_uuid: 父DocParagraphSchema的uuid，默认为空字符串表示根节点。
-    :param level: 当前节点在树中的层级，默认为1。
-    :return: 由当前节点及其子节点生成的DocParagraphSchema列表。
+    :param tree: 目录树。
+    :param tables: gen_origin_slices阶段解析好的表格，key为原文切片uuid。
+    :return: 目录树所有节点生成的DocParagraphSchema列表。
     """
     paragraph_slices = []
-    content = "\n".join(node.content)
-
-    # 处理带有子节点的Heading节点【目录除外】
-    if node.children and content.strip().replace(" ", "") != "目录":
-        paragraph_slice = DocParagraphSchema(
-            uuid=uuid_base62(),  # 生成唯一uuid
-            origin_slice_uuid=node.origin_slice_uuid,
-            type=node.label.lower(),
-            parent_uuid=parent_uuid,
-            embed_text=gen_embedding_text(titles, content),
-            level=level,
-            token_length=len(content),
-            tree_token_length=len(content)
-        )
-        child_level = level + 1
-        child_titles = titles if node.label == "Root" else titles + [content]
-        for child in node.children:
-            child_paragraph_slices = create_paragraph_slices(child, paragraph_slice.uuid, child_level, child_titles)
-            # 包含了所有子树的节点
-            paragraph_slices.extend(child_paragraph_slices)
-            # 仅获取第一层的子节点uuid
-            paragraph_slice.children_uuids.extend([f.uuid for f in child_paragraph_slices if f.parent_uuid == paragraph_slice.uuid])
-            paragraph_slice.tree_token_length += sum(f.tree_token_length for f in child_paragraph_slices if f.parent_uuid == paragraph_slice.uuid)
+    title_paths = TitlePaths()
+    # 非叶子节点的切片，子节点切片生成时累加到父节点上，不再回扫子树结果
+    branch_slices: dict[str, DocParagraphSchema] = {}
 
+    def append_slice(paragraph_slice: DocParagraphSchema):
         paragraph_slices.append(paragraph_slice)
+        parent_slice = branch_slices.get(paragraph_slice.parent_uuid)
+        if parent_slice is not None:
+            parent_slice.children_uuids.append(paragraph_slice.uuid)
+            parent_slice.tree_token_length += paragraph_slice.tree_token_length
+
+    # (节点编号, 父切片uuid, 层级, 标题路径, 子节点已处理完、待加入结果的节点切片)
+    stack = [(0, "", 1, 0, None)] if len(tree) else []
+    while stack:
+        idx, parent_uuid, level, title_path, finished_slice = stack.pop()
+        if finished_slice is not None:
+            append_slice(finished_slice)
+            continue
+
+        content = tree.text[idx]
+        # 处理带有子节点的Heading节点【目录除外】
+        if tree.has_children(idx) and content.strip().replace(" ", "") != "目录":
+            paragraph_slice = DocParagraphSchema(
+                uuid=uuid_base62(),  # 生成唯一uuid
+                origin_slice_uuid=tree.origin_slice_uuid[idx],
+                type=tree.label[idx].lower(),
+                parent_uuid=parent_uuid,
+                embed_text=gen_embedding_text(title_paths.get(title_path), content),
+                level=level,
+                token_length=len(content),
+                tree_token_length=len(content)
+            )
+            branch_slices[paragraph_slice.uuid] = paragraph_slice
+            child_title_path = title_path if tree.label[idx] == "Root" else title_paths.add(title_path, content)
+            stack.append((idx, parent_uuid, level, title_path, paragraph_slice))
+            stack.extend((child, paragraph_slice.uuid, level + 1, child_title_path, None) for child in reversed(tree.children(idx)))
+
+        else:
+            for leaf_slice in create_leaf_slices(tree, idx, parent_uuid, level, title_paths.get(title_path), tables):
+                append_slice(leaf_slice)
+
+    return paragraph_slices
+
 
-    elif node.label == "Text":   # 处理叶子节点text
+def create_leaf_slices(tree: CatalogTree, idx: int, parent_uuid: str, level: int, titles: list[str], tables: dict[str, Table]) -> list[DocParagraphSchema]:
+    """
+    叶子节点切片：文本按长度切分，表格按token上限切分为多个子表
+    """
+    leaf_slices = []
+    content = tree.text[idx]
+
+    if tree.label[idx] == "Text":   # 处理叶子节点text
         chunks, offsets = split_with_offsets(content, chunk_size=500, chunk_overlap=20)
-        paragraph_slices.extend(
+        leaf_slices.extend(
             DocParagraphSchema(
                 uuid=uuid_base62(),  # 生成唯一uuid
-                origin_slice_uuid=node.origin_slice_uuid,
-                type=node.label.lower(),  # text | table | title
+                origin_slice_uuid=tree.origin_slice_uuid[idx],
+                type=tree.label[idx].lower(),  # text | table | title
                 parent_uuid=parent_uuid,
                 children_uuids=[],
                 embed_text=gen_embedding_text(titles, chunk),
@@ -74,22 +100,28 @@ def create_paragraph_slices(node: CatalogTreeSchema.TreeNode, parent_uuid: str =
                 tree_token_length=len(chunk),
                 leaf=True,
                 leaf_properties=DocParagraphSchema.LeafProperties(
-                    l_idx=idx + 1,
+                    l_idx=chunk_idx + 1,
                     l_num=len(chunks),
                     l_p_start=start_offset,
                     l_p_end=start_offset + len(chunk) - 1,
                 )
 
-            ) for idx, (chunk, start_offset) in enumerate(zip(chunks, offsets))
+            ) for chunk_idx, (chunk, start_offset) in enumerate(zip(chunks, offsets))
         )
 
-    elif node.label == "Table":  # 处理叶子节点table
-        sub_tables = split_table_by_token_limit(content, token_limit=1000)
-        paragraph_slices.extend(
+    elif tree.label[idx] == "Table":  # 处理叶子节点table
+        table = tables.get(tree.origin_slice_uuid[idx])
+        sub_tables = split_table_by_token_limit(
+            content,
+            token_limit=settings.app.wf_parse.table_split_token_limit,
+            table_list=table.rows if table else None,
+            count_tokens=get_token_counter(settings.app.wf_parse.table_split_token_encoding),
+        )
+        leaf_slices.extend(
             DocParagraphSchema(
                 uuid=uuid_base62(),  # 生成唯一uuid
-                origin_slice_uuid=node.origin_slice_uuid,
-                type=node.label.lower(),  # text | table | title
+                origin_slice_uuid=tree.origin_slice_uuid[idx],
+                type=tree.label[idx].lower(),  # text | table | title
                 parent_uuid=parent_uuid,
                 children_uuids=[],
                 embed_text=gen_embedding_text(titles, _markdown_str),
@@ -108,7 +140,7 @@ def create_paragraph_slices(node: CatalogTreeSchema.TreeNode, parent_uuid: str =
             ) for _idx, (_title_row_idx, _start_row_idx, _end_row_idx, _markdown_str) in enumerate(sub_tables)
         )
 
-    return paragraph_slices
+    return leaf_slices
 
 
 def split_with_offsets(text, chunk_size, chunk_overlap):
@@ -125,14 +157,34 @@ def split_with_offsets(text, chunk_size, chunk_overlap):
     return chunks, offsets
 
 
-def split_table_by_token_limit(table_markdown: str, token_limit: int = 1000):
+def split_table_by_token_limit(table_markdown: str, token_limit: int = 1000, table_list: list[list[str]] = None, count_tokens: Callable[[str], int] = len):
+    """
+    按token上限拆分表格，每个子表都带上标题行，长度不一的行用"-"补齐
+
+    子表长度按行累加计算，不再每加一行就重新渲染整个子表：
+    markdown长度 = 各行长度之和 + 补齐单元格长度 + 分隔行长度，补齐量只与子表的最大列数有关
+    """
+
+    if table_list is None:
+        table_list = markdown2list(table_markdown)
 
-    table_list = markdown2list(table_markdown)
+    pad_tokens = count_tokens("-|")
+    sep_tokens = count_tokens("|") + count_tokens("\n")
 
     sub_tables = []
     sub_table = []
+    # 子表中各行(未补齐)的token数之和、列数之和以及最大列数
+    rows_tokens = rows_cells = max_cells = 0
     title_row_idx = start_row_idx = 0
     title_row = None
+
+    def row_tokens(row):
+        return count_tokens("|" + "|".join(row) + "|\n")
+
+    def table_tokens(n_rows, cells, max_cells):
+        # 补齐的单元格 + 标题行后的分隔行
+        return (n_rows * max_cells - cells) * pad_tokens + sep_tokens + max_cells * pad_tokens
+
     for row_id, row in enumerate(table_list):
         row = [x if not is_financial_string(x) else "" for x in row]
         if not row:
@@ -141,22 +193,26 @@ def split_table_by_token_limit(table_markdown: str, token_limit: int = 1000):
         if not title_row:
             title_row = row
             title_row_idx = row_id
+            title_tokens = row_tokens(title_row)
             continue
 
-        if not sub_table:
-            sub_table = [title_row, row]
-            start_row_idx = row_id
-            continue
-
-        if len(uneven_list_to_markdown_table(sub_table + [row], fill_value="-")) > token_limit:
-            markdown_str = uneven_list_to_markdown_table(sub_table, fill_value="-")
+        tokens = row_tokens(row)
+        if sub_table and rows_tokens + tokens + table_tokens(len(sub_table) + 1, rows_cells + len(row), max(max_cells, len(row))) > token_limit:
             sub_tables.append(
-                (title_row_idx, start_row_idx, row_id - 1, markdown_str)
+                (title_row_idx, start_row_idx, row_id - 1, uneven_list_to_markdown_table(sub_table, fill_value="-"))
             )
+            # 超出上限的行作为下一个子表的第一行
             sub_table = []
 
-        else:
-            sub_table.append(row)
+        if not sub_table:
+            sub_table = [title_row]
+            rows_tokens, rows_cells, max_cells = title_tokens, len(title_row), len(title_row)
+            start_row_idx = row_id
+
+        sub_table.append(row)
+        rows_tokens += tokens
+        rows_cells += len(row)
+        max_cells = max(max_cells, len(row))
 
     if sub_table:
         sub_tables.append(
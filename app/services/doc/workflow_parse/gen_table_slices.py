@@ -7,7 +7,8 @@ from app.schemas.doc import DocOriginSchema, DocTableRowSchema
 
 from app.services.doc.workflow_parse.schemas import Context
 from app.support.helper import log_duration, uuid_base62
-from app.support.transform import list2markdown, markdown2list
+from app.support.table import Table
+from app.support.transform import list2markdown
 
 
 @log_duration()
@@ -16,7 +17,7 @@ def gen_table_slices(context: Context) -> List[DocTableRowSchema]:
         table_slices = [origin_slice for origin_slice in context.origin_slices if origin_slice.type == "table"]
         table_row_slices = []
         for table in table_slices:
-            row_slices = extract_row_data_from_table(table)
+            row_slices = extract_row_data_from_table(table, context.tables.get(table.uuid))
             table_row_slices.extend(row_slices)
 
         return table_row_slices
@@ -26,12 +27,12 @@ def gen_table_slices(context: Context) -> List[DocTableRowSchema]:
         raise GenTableSlicesException()
 
 
-def extract_row_data_from_table(origin_table: DocOriginSchema) -> list[DocTableRowSchema]:
+def extract_row_data_from_table(origin_table: DocOriginSchema, table: Table = None) -> list[DocTableRowSchema]:
     """
     从普通表格中抽取并上报
     """
     row_data_list = []
-    table_list = markdown2list(origin_table.content_md)
+    table_list = (table or Table.from_htmls(origin_table.content_html)).rows
 
     title_row = []
 
@@ -1,26 +1,138 @@
-
+import asyncio
 import logging
+from typing import BinaryIO
 from fastapi import UploadFile
 import traceback
 
 from app.exceptions.http.doc import Pdf2MdException
 from app.libs.textin_ocr import TextinOcr
 from app.schemas.doc import Pdf2MdSchema
-from app.support import xjson
+from app.services.doc.pdf2md_cache import Pdf2MdCache, pdf2md_cache_ins
+from app.services.doc.pdf2md_result import load_pdf2md_result, new_pages_spool
+from app.support.file_stream import aiter_file, ensure_disk_file, file_sha256
 from app.support.helper import async_log_duration
+from config.config import settings
 
 
 @async_log_duration()
 async def pdf2md(file: UploadFile) -> Pdf2MdSchema:
     try:
-        file_content = file.read()
-        response = await TextinOcr().aysnc_recognize_pdf2md(file_content)
-        response.raise_for_status()
-        response_dict = xjson.loads(response.content)
-        if response_dict["code"] != 200:
-            raise Exception(response_dict["code"])
-
-        return Pdf2MdSchema.model_validate(response_dict)
+        # 上传文件落盘后分块读取，内存占用与文件大小无关
+        source = await asyncio.to_thread(ensure_disk_file, file.file)
+        textin_ocr = TextinOcr()
+
+        # 相同内容的文件命中缓存时跳过TextIn调用
+        cache_key = None
+        if settings.app.wf_parse.pdf2md_cache_enabled:
+            file_hash = await asyncio.to_thread(file_sha256, source)
+            cache_key = Pdf2MdCache.make_key(file_hash, textin_ocr.options)
+            pdf2md_result = await asyncio.to_thread(pdf2md_cache_ins.get, cache_key)
+            if pdf2md_result:
+                logging.info(f"pdf2md cache hit: {cache_key}")
+                return pdf2md_result
+
+        if settings.api.pdf2md.window_size > 0:
+            pdf2md_result = await recognize_by_windows(textin_ocr, source)
+        else:
+            pdf2md_result = await recognize(textin_ocr, source)
+        if cache_key:
+            await asyncio.to_thread(pdf2md_cache_ins.set, cache_key, pdf2md_result)
+        return pdf2md_result
     except Exception as e:
         logging.error(f'parse file error: {e}, {traceback.format_exc()}')
         raise Pdf2MdException()
+
+
+async def recognize(textin_ocr: TextinOcr, source: BinaryIO, page_start: int = None, page_count: int = None) -> Pdf2MdSchema:
+    # 每次请求使用独立的读取迭代器，按块流式上传
+    response = await textin_ocr.aysnc_recognize_pdf2md(aiter_file(source), page_start=page_start, page_count=page_count)
+    response.raise_for_status()
+    # 大文件的json解析与校验比较耗时，放到线程中执行
+    return await asyncio.to_thread(load_pdf2md_result, response.content)
+
+
+async def recognize_by_windows(textin_ocr: TextinOcr, source: BinaryIO) -> Pdf2MdSchema:
+    """
+    按页窗口切分文档并发请求TextIn，再合并为一个完整的结果
+    先请求第一个窗口拿到总页数，其余窗口在并发上限内同时请求
+    没有返回总页数，或第一个窗口的页数不足窗口大小(文档已结束)时，不再请求其他窗口
+    """
+    window_size = settings.api.pdf2md.window_size
+    page_start = settings.api.pdf2md.options_page_start
+    page_end = page_start + settings.api.pdf2md.options_page_count
+    first_count = min(window_size, page_end - page_start)
+    first_result = await recognize(textin_ocr, source, page_start, first_count)
+
+    # metrics 每页一条
+    first_pages = len(first_result.metrics)
+    if first_result.result.total_page_count and first_pages >= first_count:
+        page_end = min(page_end, first_result.result.total_page_count)
+    else:
+        page_end = page_start + first_pages
+    window_starts = list(range(page_start + window_size, page_end, window_size))
+
+    semaphore = asyncio.Semaphore(settings.api.pdf2md.window_concurrency)
+
+    async def recognize_window(window_start: int) -> Pdf2MdSchema:
+        async with semaphore:
+            return await recognize(textin_ocr, source, window_start, min(window_size, page_end - window_start))
+
+    results = await asyncio.gather(*[recognize_window(window_start) for window_start in window_starts])
+    logging.info(f"pdf2md by windows, pages: {page_start}-{page_end}, windows: {len(window_starts) + 1}")
+    return merge_pdf2md_results(list(zip([page_start] + window_starts, [first_result] + list(results))))
+
+
+def merge_pdf2md_results(window_results: list[tuple[int, Pdf2MdSchema]]) -> Pdf2MdSchema:
+    """
+    合并按页窗口请求的结果，page_id统一为文档内页码(从1开始)
+    paragraph_id 如果是文档级编号(跨页递增)，则接着前一个窗口继续编号
+    编号方式按所有窗口一起判断：只有一页的窗口无法单独判断(如最后一个窗口)，窗口大小为1时按每页编号处理
+    Args:
+        window_results: [(窗口起始页(从0开始), 窗口解析结果)]
+    """
+    pages_spool, detail, metrics = new_pages_spool(), [], []
+    duration, paragraph_offset = 0, 0
+    document_scoped = any(is_document_scoped_paragraph_id(window_result.result.detail) for _, window_result in window_results)
+
+    for window_start, window_result in window_results:
+        page_ids = [metric.page_id for metric in window_result.metrics] + [item.page_id for item in window_result.result.detail]
+        # 窗口内的页码可能从1开始也可能是文档页码，统一换算成文档页码
+        page_offset = window_start + 1 - min(page_ids) if page_ids else 0
+
+        for metric in window_result.metrics:
+            metric.page_id += page_offset
+        for page in window_result.result.iter_pages():
+            if "page_id" in page:
+                page["page_id"] += page_offset
+            pages_spool.append(page)
+        if window_result.result._pages_spool is not None:
+            window_result.result._pages_spool.close()
+        for item in window_result.result.detail:
+            item.page_id += page_offset
+            if document_scoped:
+                item.paragraph_id += paragraph_offset
+
+        if document_scoped and window_result.result.detail:
+            paragraph_offset = max(item.paragraph_id for item in window_result.result.detail) + 1
+
+        metrics.extend(window_result.metrics)
+        detail.extend(window_result.result.detail)
+        duration += window_result.duration
+
+    merged = window_results[0][1]
+    merged.result.pages, merged.result.detail, merged.metrics, merged.duration = [], detail, metrics, duration
+    merged.result._pages_spool = pages_spool
+    return merged
+
+
+def is_document_scoped_paragraph_id(detail: list[Pdf2MdSchema.Detail]) -> bool:
+    """
+    判断paragraph_id是否为跨页递增的编号：存在某一页的第一个元素id不为0
+    """
+    page_ids = set()
+    for item in detail:
+        if item.page_id not in page_ids:
+            page_ids.add(item.page_id)
+            if item.paragraph_id != 0:
+                return True
+    return False
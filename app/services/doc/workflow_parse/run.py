@@ -1,24 +1,113 @@
+import asyncio
+from datetime import datetime
+import logging
+import time
+import traceback
+from typing import Awaitable, Callable
 from fastapi import UploadFile, File
 
-from app.schemas.doc import DocParagraphMetaTreeSchema, FileMetaSchema
+from app.providers.elasticsearch_provider import get_es_client
+from app.schemas.doc import DocParagraphMetaTreeSchema, FileMetaSchema, ParseJobStageSchema
+from app.schemas.elasticsearch import ESFile, ESOriginSlice, ESParagraphSlice, ESTableRowSlice
 from app.services.doc.workflow_parse import catalog, pdf2md, gen_origin_slices, gen_table_slices, gen_paragraph_slices, embedding_and_upload_slices, upload_file_info, upload2minio
 from app.services.doc.workflow_parse.schemas import Context
-from app.support.helper import uuid_base62
+from app.support.helper import get_peak_rss_mb, uuid_base62
+from config.config import settings
 
 
-async def run_workflow(file: UploadFile = File(...)) -> FileMetaSchema:
+async def run_workflow(file: UploadFile = File(...), on_progress: Callable[[ParseJobStageSchema], None] = None, ingest_mode: bool = None) -> FileMetaSchema:
 
-    context = Context(file_uuid=uuid_base62())
+    if ingest_mode is None:
+        ingest_mode = settings.app.wf_parse.ingest_mode
+    context = Context(file_uuid=uuid_base62(), on_progress=on_progress, ingest_mode=ingest_mode)
     file_meta = context.file_meta = FileMetaSchema(file_id=context.file_uuid, file_name=file.filename)
-    context.pdf2md_result = await pdf2md.pdf2md(file)
-    context.catalog_tree = catalog.catalog(context)
-    context.origin_slices = gen_origin_slices.gen_origin_slices(context)
-    context.table_row_slices = gen_table_slices.gen_table_slices(context)
-    context.paragraph_slices = gen_paragraph_slices.gen_paragraph_slices(context)
-    context.file_meta.paragraph_slices_meta = DocParagraphMetaTreeSchema.from_paragraphs(context.paragraph_slices)
-    embedding_and_upload_slices.embedding_and_upload_slices(context)
-    # 上传extra信息到minio中，如果不需要前端展示，注释此行即可
-    context.file_meta.extra, context.file_meta.thumbnail = upload2minio.upload2minio(context)
-    upload_file_info.upload_file_info(context)
-    del context
+    context.pdf2md_result = await run_stage(context, "pdf2md", pdf2md.pdf2md(file))
+    # CPU密集以及同步IO(ES/Embedding)的阶段放到线程中执行，避免阻塞事件循环
+    context.catalog_tree = await run_stage(context, "catalog", asyncio.to_thread(catalog.catalog, context))
+    context.origin_slices = await run_stage(context, "gen_origin_slices", asyncio.to_thread(gen_origin_slices.gen_origin_slices, context))
+    context.table_row_slices = await run_stage(context, "gen_table_slices", asyncio.to_thread(gen_table_slices.gen_table_slices, context))
+    context.paragraph_slices = await run_stage(context, "gen_paragraph_slices", asyncio.to_thread(gen_paragraph_slices.gen_paragraph_slices, context))
+    context.file_meta.paragraph_slices_meta = await asyncio.to_thread(DocParagraphMetaTreeSchema.from_paragraphs, context.paragraph_slices)
+    # 切片写入ES与图片/pdf2md结果上传minio互不依赖，并发执行
+    _, (context.file_meta.extra, context.file_meta.thumbnail) = await run_concurrent_stages(context, {
+        "embedding_and_upload_slices": lambda: asyncio.to_thread(embedding_and_upload_slices.embedding_and_upload_slices, context),
+        # 上传extra信息到minio中，如果不需要前端展示，去掉此阶段即可
+        "upload2minio": lambda: upload2minio.upload2minio(context),
+    })
+    try:
+        await run_stage(context, "upload_file_info", asyncio.to_thread(upload_file_info.upload_file_info, context))
+    except BaseException:
+        # 切片与minio对象已全部写入，文件信息写入失败时同样清理
+        await asyncio.to_thread(cleanup_partial_writes, context.file_uuid)
+        raise
+    logging.info(f"parse {context.file_uuid} done, stages(ms): {({name: stage.duration_ms for name, stage in context.stages.items()})}, peak rss: {get_peak_rss_mb()}MB")
     return file_meta
+
+
+async def run_stage(context: Context, name: str, stage: Awaitable):
+    """
+    执行解析阶段，记录阶段的状态与耗时，并通知 context.on_progress
+    """
+    stage_info = context.stages[name] = ParseJobStageSchema(name=name, status="running", started_at=datetime.now())
+    notify_progress(context, stage_info)
+    start_time = time.time()
+    try:
+        ret = await stage
+        stage_info.status = "success"
+        return ret
+    except BaseException:
+        stage_info.status = "failed"
+        raise
+    finally:
+        stage_info.duration_ms = round((time.time() - start_time) * 1000, 1)
+        # 进程内存峰值，多个解析任务并发时为所有任务共同的峰值
+        stage_info.detail["peak_rss_mb"] = get_peak_rss_mb()
+        notify_progress(context, stage_info)
+
+
+async def run_concurrent_stages(context: Context, stages: dict[str, Callable[[], Awaitable]]) -> list:
+    """
+    并发执行互不依赖的阶段，总耗时为其中最慢的阶段
+    任一阶段失败时通过 context.cancel_event 通知其他阶段尽快结束，等待全部结束后清理本次解析已写入的数据
+    """
+    errors = []
+
+    async def _run_stage(name: str, stage: Callable[[], Awaitable]):
+        try:
+            return await run_stage(context, name, stage())
+        except BaseException as e:
+            # 记录最先失败的阶段，其他阶段因取消产生的异常不作为失败原因
+            errors.append(e)
+            context.cancel_event.set()
+            raise
+
+    results = await asyncio.gather(*[_run_stage(name, stage) for name, stage in stages.items()], return_exceptions=True)
+    if not errors:
+        return results
+
+    await asyncio.to_thread(cleanup_partial_writes, context.file_uuid)
+    raise errors[0]
+
+
+def cleanup_partial_writes(file_uuid: str):
+    """
+    清理解析失败时已写入的切片、文件信息与minio对象
+    """
+    try:
+        indices = [ESParagraphSlice.Index.name, ESTableRowSlice.Index.name, ESOriginSlice.Index.name]
+        # 批量写入模式下refresh关闭，先refresh保证已写入的切片可以被删除
+        get_es_client().indices.refresh(index=",".join(indices))
+        for doc_type in (ESParagraphSlice, ESTableRowSlice, ESOriginSlice):
+            doc_type.search().filter("term", **{"file_uuid.keyword": file_uuid}).params(conflicts="proceed").delete()
+        # 文件信息写入超时时可能已经写入
+        ESFile.search().filter("term", **{"uuid.keyword": file_uuid}).params(conflicts="proceed").delete()
+
+        removed = upload2minio.remove_file_objects(file_uuid)
+        logging.info(f"parse {file_uuid} failed, cleanup partial writes, minio objects: {removed}")
+    except Exception as e:
+        logging.error(f'cleanup partial writes {file_uuid} error: {e}, {traceback.format_exc()}')
+
+
+def notify_progress(context: Context, stage_info: ParseJobStageSchema):
+    if context.on_progress:
+        context.on_progress(stage_info)
@@ -1,14 +1,118 @@
 
-from pydantic import BaseModel
+import threading
+from typing import Callable, Optional
+from pydantic import BaseModel, Field
 
-from app.schemas.doc import CatalogTreeSchema, DocOriginSchema, DocParagraphSchema, DocTableRowSchema, FileMetaSchema, Pdf2MdSchema
+from app.schemas.doc import CatalogTreeSchema, DocOriginSchema, DocParagraphSchema, DocTableRowSchema, FileMetaSchema, Pdf2MdSchema, ParseJobStageSchema
+from app.support.table import Table
+
+
+class TitlePaths(object):
+    """
+    标题路径的共享存储：每条路径只记录最后一级标题和上一级路径的编号，子节点共享父节点的路径
+    路径0为空路径
+    """
+
+    __slots__ = ("parent", "title", "_cache")
+
+    def __init__(self):
+        self.parent: list[int] = [-1]
+        self.title: list[str] = [""]
+        self._cache: dict[int, list[str]] = {0: []}
+
+    def add(self, parent: int, title: str) -> int:
+        self.parent.append(parent)
+        self.title.append(title)
+        return len(self.title) - 1
+
+    def get(self, path: int) -> list[str]:
+        """
+        展开为标题列表，同一路径只展开一次，返回的列表不要修改
+        """
+        titles = self._cache.get(path)
+        if titles is None:
+            titles = self._cache[path] = self.get(self.parent[path]) + [self.title[path]]
+        return titles
+
+
+class CatalogTree(object):
+    """
+    数组存储的目录树，解析阶段使用，代替逐层嵌套的 CatalogTreeSchema.TreeNode
+
+    - 节点按先序遍历顺序编号，0为根节点，按编号顺序遍历即为先序遍历
+    - parent / first_child / next_sibling 记录节点关系，-1表示不存在
+    - 节点属性按列存储，每个节点只有一段文本
+    """
+
+    __slots__ = ("label", "pos", "ori_ids", "text", "tree_level", "page_id", "origin_slice_uuid",
+                 "parent", "first_child", "next_sibling", "_last_child", "generate")
+
+    def __init__(self):
+        self.label: list[str] = []              # Root|Text|Heading|Table
+        self.pos: list[list[int]] = []
+        self.ori_ids: list[list[str]] = []      # 段落唯一标识集合"page_id-1, paragraph_id"
+        self.text: list[str] = []               # 节点内容，表格节点在gen_origin_slices阶段替换为markdown
+        self.tree_level: list[int] = []
+        self.page_id: list[int] = []
+        self.origin_slice_uuid: list[str] = []  # 对应原始slice的uuid
+        self.parent: list[int] = []
+        self.first_child: list[int] = []
+        self.next_sibling: list[int] = []
+        self._last_child: list[int] = []
+        self.generate: list[CatalogTreeSchema.TreeGenerateNode] = []  # 目录
+
+    def __len__(self):
+        return len(self.label)
+
+    def add_node(self, parent: int, label: str, pos: list[int], ori_ids: list[str], text: str, tree_level: int, page_id: int) -> int:
+        """
+        按先序遍历顺序添加节点，返回节点编号
+        """
+        idx = len(self.label)
+        self.label.append(label)
+        self.pos.append(pos)
+        self.ori_ids.append(ori_ids)
+        self.text.append(text)
+        self.tree_level.append(tree_level)
+        self.page_id.append(page_id)
+        self.origin_slice_uuid.append("")
+        self.parent.append(parent)
+        self.first_child.append(-1)
+        self.next_sibling.append(-1)
+        self._last_child.append(-1)
+        if parent != -1:
+            if self._last_child[parent] == -1:
+                self.first_child[parent] = idx
+            else:
+                self.next_sibling[self._last_child[parent]] = idx
+            self._last_child[parent] = idx
+        return idx
+
+    def has_children(self, idx: int) -> bool:
+        return self.first_child[idx] != -1
+
+    def children(self, idx: int) -> list[int]:
+        result = []
+        child = self.first_child[idx]
+        while child != -1:
+            result.append(child)
+            child = self.next_sibling[child]
+        return result
 
 
 class Context(BaseModel):
+    class Config:
+        arbitrary_types_allowed = True  # 允许 Table、CatalogTree、Event 类型
+
     file_uuid: str = ""                                     # 文件唯一标识
     pdf2md_result : Pdf2MdSchema = None                     # pdf2md解析结果
-    catalog_tree: CatalogTreeSchema = None                  # 目录树
+    catalog_tree: CatalogTree = None                        # 目录树
     origin_slices: list[DocOriginSchema] = []               # 文档原文信息
+    tables: dict[str, Table] = {}                           # 表格原文切片解析结果，key为原文切片uuid
     table_row_slices: list[DocTableRowSchema] = []          # 文档原文信息
     paragraph_slices: list[DocParagraphSchema] = []         # 文档原文信息
     file_meta: FileMetaSchema = None                        # 文件元数据
+    stages: dict[str, ParseJobStageSchema] = {}             # 各阶段的状态与耗时
+    on_progress: Optional[Callable[[ParseJobStageSchema], None]] = None  # 阶段状态变更回调
+    ingest_mode: bool = False                               # 写入切片时是否开启批量写入模式
+    cancel_event: threading.Event = Field(default_factory=threading.Event)  # 并发执行的阶段失败时通知其他阶段停止
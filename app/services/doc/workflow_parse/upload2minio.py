@@ -1,31 +1,49 @@
-import base64
+import asyncio
 from concurrent.futures import ThreadPoolExecutor
 import logging
 from math import inf
+import threading
 import traceback
 from loguru import logger
 
 from app.exceptions.http.doc import UploadFile2MinioException
-from app.libs.textin_pic_download import TextinDownload
 from app.schemas.doc import DocOriginSchema, Pdf2MdSchema
+from app.services.doc.page_image import backup_page_image, page_image_ins, page_image_name, pending_name
+from app.services.doc.pdf2md_result import get_codec, upload_pdf2md_chunks, upload_pdf2md_object
 from app.services.doc.workflow_parse.schemas import Context
 from app.support import xjson
-from app.support.helper import compress, convert_base64_to_webp, log_duration
+from app.support.table import Table, merge_table_htmls
+from app.support.helper import async_log_duration, log_duration
 from app.libs.minio import MinioClient
+from config.config import settings
 
 
-@log_duration()
-def upload2minio(context: Context) -> tuple[dict, str]:
+@async_log_duration()
+async def upload2minio(context: Context) -> tuple[dict, str]:
     try:
-        pdf2md_url = upload_pdf2md_result(context.file_uuid, context.pdf2md_result)
-        pic_urls = upload_pics(context.file_uuid, context.pdf2md_result)
-        cross_page_elements = get_cross_page_elements(context.origin_slices)
-        return dict(
+        toc = [item.model_dump() for item in context.catalog_tree.generate]
+        pdf2md_url = await asyncio.to_thread(upload_pdf2md_result, context.file_uuid, context.pdf2md_result, toc)
+        pages = await upload_pics(context.file_uuid, context.pdf2md_result, context.cancel_event)
+        cross_page_elements = await asyncio.to_thread(get_cross_page_elements, context.origin_slices, context.tables)
+
+        stats = pics_stats(pages)
+        logging.info(f"file {context.file_uuid} pics: {stats}")
+        if "upload2minio" in context.stages:
+            context.stages["upload2minio"].detail.update(pics=stats)
+
+        pic_urls = [page["url"] for page in pages]
+        extra = dict(
             pdf2md_url=pdf2md_url,
             pic_urls=pic_urls,
-            toc=[item.model_dump() for item in context.catalog_tree.generate],
+            toc=toc,
             cross_page_elements=cross_page_elements,
-        ), pic_urls[0]
+        )
+        if settings.app.wf_parse.pic_variants:
+            extra["pic_variant_urls"] = {
+                name: [page["variants"].get(name, page["url"]) for page in pages] for name in settings.app.wf_parse.pic_variants
+            }
+        thumbnail = pages[0]["variants"].get("thumbnail", pic_urls[0])
+        return extra, thumbnail
 
     except Exception as e:
         logging.error(f'upload2minio error: {e}, {traceback.format_exc()}')
@@ -33,7 +51,7 @@ def upload2minio(context: Context) -> tuple[dict, str]:
 
 
 @log_duration(prefix="upload2minio_")
-def upload_pdf2md_result(file_id, pdf2md_result: Pdf2MdSchema):
+def upload_pdf2md_result(file_id, pdf2md_result: Pdf2MdSchema, toc: list[dict] = None):
     def find_bounding_rectangle(rectangles):
         # 初始化边界值为无穷大或无穷小
         min_x = inf
@@ -64,49 +82,111 @@ def upload_pdf2md_result(file_id, pdf2md_result: Pdf2MdSchema):
             if content_positions and structured.get("type") == "textblock":
                 structured["pos"] = find_bounding_rectangle(content_positions)
 
-    [update_page_structure(page) for page in pdf2md_result.result.pages]
-    object_name = f"pdf2md/{file_id}.gz"
-    MinioClient().upload_content(object_name, compress(xjson.dumps(pdf2md_result.model_dump())))
+    codec = get_codec()
 
-    return object_name
+    def upload(page_hook):
+        if settings.app.wf_parse.pdf2md_layout == "chunked":
+            # 按页分块保存，返回清单的对象名
+            return upload_pdf2md_chunks(f"pdf2md/{file_id}", pdf2md_result, toc or [], codec, page_hook, settings.app.wf_parse.pdf2md_chunk_pages)
+        object_name = f"pdf2md/{file_id}{codec.ext}"
+        upload_pdf2md_object(object_name, pdf2md_result, codec, page_hook)
+        return object_name
 
+    if settings.app.wf_parse.char_details_mode != "split":
+        return upload(update_page_structure)
 
-@log_duration(prefix="upload2minio_")
-def upload_pics(file_id, pdf2md_result: Pdf2MdSchema):
-
-    def backup_img(file_id, page_idx, pic: Pdf2MdSchema.Metric):
-        try:
-            file_img_base64 = TextinDownload().download_textin_img(pic.image_id)
-        except Exception as e:
-            logger.error(f"download textin image {pic.image_id} error: {e}")
-            raise e
-
-        try:
-            file_img_stream = base64.b64decode(file_img_base64)
-            webp_bytes = convert_base64_to_webp(file_img_stream)
-            object_name = f"pics/{file_id}_{page_idx}.webp"
-            MinioClient().upload_content(object_name, webp_bytes)
-        except Exception as e:
-            logger.error(f"convert_base64_to_webp image {pic.image_id} error: {e}")
-            object_name = f"pics/{file_id}_{page_idx}.png"
-            MinioClient().upload_content(object_name, file_img_base64)
+    # 字符详情按页拆分为单独的对象，页面中记录对象路径，前端需要高亮时再按页获取
+    with ThreadPoolExecutor(max_workers=settings.app.wf_parse.pic_download_concurrency) as executor:
+        futures = []
+        page_idx = 0
 
-        return object_name
+        def split_page(page):
+            nonlocal page_idx
+            update_page_structure(page)
+            char_details = pop_char_details(page)
+            if char_details:
+                char_object_name = f"pdf2md/{file_id}/chars_{page_idx}{codec.ext}"
+                page["char_details_url"] = char_object_name
+                futures.append(executor.submit(MinioClient().upload_content, char_object_name, codec.compress(xjson.dumpb(char_details))))
+            page_idx += 1
 
-    object_names = []
-    futures = []
-    workers = min(len(pdf2md_result.metrics) + 1, 20)
-    with ThreadPoolExecutor(max_workers=workers) as executor:
-        for idx, pic in enumerate(pdf2md_result.metrics):
-            futures.append(executor.submit(backup_img, file_id, idx, pic))
+        object_name = upload(split_page)
+        for future in futures:
+            future.result()
+
+    return object_name
 
-    for future in futures:
-        object_names.append(future.result())
 
-    return object_names
+def pop_char_details(page: dict) -> list[dict]:
+    """
+    从页面的文本行中取出字符级详情(字符坐标、候选字等)，返回 [{id, char_pos, ...}]
+    """
+    char_details = []
+    for content in page.get("content", []):
+        detail = {key: content.pop(key) for key in list(content) if key.startswith("char_")}
+        if detail:
+            char_details.append(dict(id=content.get("id"), **detail))
+    return char_details
 
 
-def get_cross_page_elements(origin_slices: list[DocOriginSchema]):
+@async_log_duration(prefix="upload2minio_")
+async def upload_pics(file_id, pdf2md_result: Pdf2MdSchema, cancel_event: threading.Event = None) -> list[dict]:
+    """
+    备份页面图片，pic_backup_mode=lazy 时只备份前 pic_eager_pages 页，其余页面访问时再备份
+    :return: 每页的 {url, variants: {名称: url}, convert_ms, src_bytes, dst_bytes}，未备份的页面只有 url, variants
+    """
+    # 下载与转换共用并发数，限制同时驻留内存的页面图片数量
+    semaphore = asyncio.Semaphore(settings.app.wf_parse.pic_download_concurrency)
+
+    async def backup_img(file_id, page_idx, pic: Pdf2MdSchema.Metric):
+        async with semaphore:
+            # 解析流程中其他阶段失败时，不再下载剩余的图片
+            if cancel_event is not None and cancel_event.is_set():
+                raise Exception("upload pics cancelled")
+            return await backup_page_image(file_id, page_idx, pic.image_id)
+
+    metrics = pdf2md_result.metrics
+    eager_count = len(metrics)
+    if settings.app.wf_parse.pic_backup_mode == "lazy":
+        eager_count = min(settings.app.wf_parse.pic_eager_pages, len(metrics))
+        if eager_count < len(metrics):
+            # 先记录全部页面的image_id，解析返回后即可按需访问
+            await asyncio.to_thread(page_image_ins.save_pending, file_id, [pic.image_id for pic in metrics])
+
+    pages = list(await asyncio.gather(*[
+        backup_img(file_id, idx, pic) for idx, pic in enumerate(metrics[:eager_count])
+    ]))
+    for page_idx, page in enumerate(pages):
+        logger.debug(f"file {file_id} page {page_idx} image convert {page['convert_ms']}ms, {page['src_bytes']} -> {page['dst_bytes']} bytes")
+
+    # 按需备份的页面，对象名与备份后一致
+    pages.extend(
+        dict(url=page_image_name(file_id, idx), variants={name: page_image_name(file_id, idx, name) for name in settings.app.wf_parse.pic_variants})
+        for idx in range(eager_count, len(metrics))
+    )
+    return pages
+
+
+def pics_stats(pages: list[dict]) -> dict:
+    """
+    页面图片转换的统计：总耗时/最大耗时以及WebP节省的字节数
+    """
+    backed_up = [page for page in pages if "convert_ms" in page]
+    convert_ms = [page["convert_ms"] for page in backed_up]
+    src_bytes = sum(page["src_bytes"] for page in backed_up)
+    dst_bytes = sum(page["dst_bytes"] for page in backed_up)
+    return dict(
+        pages=len(backed_up),
+        lazy_pages=len(pages) - len(backed_up),
+        convert_ms_total=round(sum(convert_ms), 1),
+        convert_ms_max=max(convert_ms, default=0),
+        src_bytes=src_bytes,
+        dst_bytes=dst_bytes,
+        saved_bytes=src_bytes - dst_bytes,
+    )
+
+
+def get_cross_page_elements(origin_slices: list[DocOriginSchema], tables: dict[str, Table] = {}):
 
     def get_cross_page_slices(origin_slices: list[DocOriginSchema]) -> list[DocOriginSchema]:
         cross_page_slices = []
@@ -134,7 +214,7 @@ def get_cross_page_elements(origin_slices: list[DocOriginSchema]):
     cross_page_elements = []
     for _slice in get_cross_page_slices(origin_slices):
         if _slice.type == "table":
-            table_htmls = merge_table(_slice.content_html)
+            table_htmls = tables[_slice.uuid].htmls if _slice.uuid in tables else merge_table_htmls(_slice.content_html)
             html = table_htmls[0] if table_htmls else ""
         else:
             html = _slice.content_html
@@ -149,31 +229,11 @@ def get_cross_page_elements(origin_slices: list[DocOriginSchema]):
     return cross_page_elements
 
 
-def merge_table(infos):
+def remove_file_objects(file_id: str) -> int:
     """
-    合并表格，合并逻辑为连续的表格进行合并
-    :param lst:
-    :return:
+    删除文件在minio中保存的解析结果与页面图片，返回删除的对象数
+    先删除按需备份记录，不再补齐该文件的页面图片；各前缀都以分隔符结尾，不会删除id以此id开头的其他文件
     """
-
-    def end_id(i, infos):
-        while i < len(infos) - 1:
-            if """<table border="1">""" in infos[i] and """<table border="1">""" in infos[i + 1]:
-                i += 1
-            else:
-                break
-        return i
-
-    result = []
-    i = 0
-    while i < len(infos):
-        if """<table border="1">""" in infos[i]:
-            j = end_id(i, infos)
-            result.append("""<table border="1">"""
-                          + "".join([r.replace("""<table border="1">""", "").replace("""</table>""", "") for r in infos[i:j + 1]])
-                          + """</table>""")
-            i = j + 1
-        else:
-            result.append(infos[i])
-            i += 1
-    return result
+    minio_client = MinioClient()
+    return minio_client.remove_prefix(pending_name(file_id)) + minio_client.remove_prefix(f"pics/{file_id}_") \
+        + minio_client.remove_prefix(f"pdf2md/{file_id}.") + minio_client.remove_prefix(f"pdf2md/{file_id}/")
@@ -0,0 +1,201 @@
+from collections import deque
+import logging
+import threading
+import time
+import traceback
+
+from elasticsearch_dsl import Document
+
+from app.providers.elasticsearch_provider import get_es_client
+from app.support import xjson
+from config.config import settings
+
+# 可重试的单条写入失败状态码：集群繁忙或节点暂时不可用
+RETRYABLE_STATUS = {429, 502, 503, 504}
+
+
+class BulkSession(object):
+    """
+    一次解析的写入会话：记录写入的文档数、字节数以及失败信息
+    """
+
+    def __init__(self, indexer: 'BulkIndexer', cancel_event: threading.Event = None):
+        self._indexer = indexer
+        self._cancel_event = cancel_event
+        self.cancelled = False
+        self._cond = threading.Condition()
+        self._pending = 0
+        self._start_time = time.time()
+        self.docs = 0
+        self.bytes = 0
+        self.retries = 0
+        self.errors: list[str] = []
+
+    def add(self, doc: Document):
+        """
+        序列化后放入写入队列，队列已满时阻塞，对上游形成背压
+        """
+        if self.errors:
+            raise Exception(f"bulk index error: {self.errors[0]}")
+        if self.cancelled or (self._cancel_event is not None and self._cancel_event.is_set()):
+            self.cancel()
+            raise Exception("bulk session cancelled")
+
+        doc_dict = doc.to_dict(include_meta=True)
+        source = doc_dict.pop("_source")
+        action = xjson.dumpb({"index": doc_dict}) + b"\n" + xjson.dumpb(source) + b"\n"
+        with self._cond:
+            self._pending += 1
+        self._indexer.put(self, action)
+
+    def cancel(self):
+        """
+        取消会话：丢弃队列中尚未发送的文档，已发送的批次正常结束
+        """
+        self.cancelled = True
+        self._indexer.discard(self)
+
+    def wait(self) -> dict:
+        """
+        等待本会话的文档全部写入，有写入失败时抛出异常
+        """
+        with self._cond:
+            while self._pending > 0:
+                self._cond.wait()
+
+        if self.errors:
+            raise Exception(f"bulk index error: {len(self.errors)} docs failed, first: {self.errors[0]}")
+        return self.stats()
+
+    def stats(self) -> dict:
+        duration = max(time.time() - self._start_time, 1e-6)
+        return dict(
+            docs=self.docs,
+            bytes=self.bytes,
+            retries=self.retries,
+            duration_ms=round(duration * 1000, 1),
+            docs_per_sec=round(self.docs / duration, 1),
+            bytes_per_sec=round(self.bytes / duration, 1),
+        )
+
+    def _done(self, size: int, error: str = None):
+        with self._cond:
+            self._pending -= 1
+            if error:
+                self.errors.append(error)
+            else:
+                self.docs += 1
+                self.bytes += size
+            if self._pending == 0:
+                self._cond.notify_all()
+
+
+class BulkIndexer(object):
+    """
+    进程内共享的ES批量写入：
+    所有解析任务、所有索引的文档进入同一个按字节限制大小的队列，由固定数量的worker按条数/字节数攒批写入
+    单条文档的429/5xx失败会单独重试，不影响同批次的其他文档
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._actions: deque[tuple[BulkSession, bytes]] = deque()
+        self._queued_bytes = 0
+        self._workers: list[threading.Thread] = []
+
+    def session(self, cancel_event: threading.Event = None) -> BulkSession:
+        self._start()
+        return BulkSession(self, cancel_event)
+
+    def put(self, session: BulkSession, action: bytes):
+        with self._cond:
+            while self._actions and self._queued_bytes + len(action) > settings.app.wf_parse.bulk_queue_max_bytes:
+                self._cond.wait()
+            self._actions.append((session, action))
+            self._queued_bytes += len(action)
+            if self._batch_ready():
+                self._cond.notify_all()
+
+    def discard(self, session: BulkSession):
+        with self._cond:
+            discarded = [(_session, action) for _session, action in self._actions if _session is session]
+            if not discarded:
+                return
+            self._actions = deque((_session, action) for _session, action in self._actions if _session is not session)
+            self._queued_bytes -= sum(len(action) for _, action in discarded)
+            self._cond.notify_all()
+        for _, action in discarded:
+            session._done(len(action), error="cancelled")
+
+    def _start(self):
+        with self._cond:
+            if self._workers:
+                return
+            for i in range(settings.app.wf_parse.insert_es_concurrency):
+                worker = threading.Thread(target=self._work, name=f"bulk-indexer-{i}", daemon=True)
+                worker.start()
+                self._workers.append(worker)
+
+    def _batch_ready(self) -> bool:
+        return len(self._actions) >= settings.app.wf_parse.insert_es_batch_size or self._queued_bytes >= settings.app.wf_parse.bulk_flush_bytes
+
+    def _take_batch(self) -> list[tuple[BulkSession, bytes]]:
+        with self._cond:
+            # 攒够一批或等待超时后，把已有的文档写入
+            while not self._batch_ready():
+                if not self._cond.wait(timeout=settings.app.wf_parse.bulk_flush_interval) and self._actions:
+                    break
+
+            batch, batch_bytes = [], 0
+            while self._actions and len(batch) < settings.app.wf_parse.insert_es_batch_size and batch_bytes < settings.app.wf_parse.bulk_flush_bytes:
+                session, action = self._actions.popleft()
+                batch.append((session, action))
+                batch_bytes += len(action)
+            self._queued_bytes -= batch_bytes
+            # 唤醒因队列已满而阻塞的生产者
+            self._cond.notify_all()
+            return batch
+
+    def _work(self):
+        while True:
+            self._send(self._take_batch())
+
+    def _send(self, batch: list[tuple[BulkSession, bytes]]):
+        """
+        写入一批文档，每条文档只结束一次：重试时 batch 只包含尚未结束的文档，请求异常时只把这些文档记为失败
+        """
+        for retry in range(settings.app.wf_parse.bulk_max_retries + 1):
+            if retry:
+                time.sleep(min(2 ** (retry - 1), 10))
+
+            try:
+                resp = get_es_client().bulk(operations=b"".join(action for _, action in batch))
+            except Exception as e:
+                logging.error(f'bulk index error: {e}, {traceback.format_exc()}')
+                for session, action in batch:
+                    session._done(len(action), error=str(e))
+                return
+
+            if not resp["errors"]:
+                for session, action in batch:
+                    session._done(len(action))
+                return
+
+            retry_batch = []
+            for (session, action), item in zip(batch, resp["items"]):
+                result = next(iter(item.values()))
+                status = result.get("status", 500)
+                if status < 300:
+                    session._done(len(action))
+                elif status in RETRYABLE_STATUS and retry < settings.app.wf_parse.bulk_max_retries:
+                    session.retries += 1
+                    retry_batch.append((session, action))
+                else:
+                    session._done(len(action), error=f"{status}: {result.get('error')}")
+
+            if not retry_batch:
+                return
+            batch = retry_batch
+
+
+bulk_indexer_ins = BulkIndexer()
@@ -0,0 +1,187 @@
+from contextlib import contextmanager
+import logging
+import os
+import socket
+import threading
+import time
+import traceback
+
+from app.providers.elasticsearch_provider import get_es_client
+from app.schemas.elasticsearch import ESIngestLease
+from app.support import xjson
+from app.support.helper import uuid_base62
+from config.config import settings
+
+
+class IngestMode(object):
+    """
+    批量写入模式：写入期间关闭切片索引的refresh、副本数置0，全部写入结束后恢复配置并refresh
+
+    - 进程内：引用计数，多个解析任务共享一次设置变更
+    - 跨进程：每个进程在ES中持有一个带过期时间的租约文档并定时续期，
+      只有不存在其他有效租约时才恢复索引配置；进程崩溃后租约过期，由其他进程结束写入时或重启时恢复
+    - 租约中记录开启前的索引配置(refresh_interval、number_of_replicas)，恢复时写回原值而不是配置文件中的默认值
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._refcount = 0
+        self._lease_id = None
+        self._index_settings: dict[str, dict] = None
+        self._heartbeat_stop: threading.Event = None
+
+    @property
+    def indices(self) -> list[str]:
+        return [
+            settings.elasticsearch.index_paragraph_slice,
+            settings.elasticsearch.index_table_row_slice,
+            settings.elasticsearch.index_origin_slice,
+        ]
+
+    @contextmanager
+    def ingest(self, enabled: bool = True):
+        """
+        with ingest_mode_ins.ingest():
+            写入切片...
+        退出时refresh切片索引，保证本次写入的数据可被检索
+        """
+        if not enabled:
+            yield
+            return
+
+        self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def acquire(self):
+        with self._lock:
+            self._refcount += 1
+            if self._refcount > 1:
+                return
+
+            try:
+                if not get_es_client().indices.exists(index=settings.elasticsearch.index_ingest_lease):
+                    ESIngestLease.init()
+                self._index_settings = self._original_index_settings()
+                self._lease_id = f"{socket.gethostname()}-{os.getpid()}-{uuid_base62()}"
+                # 先写入租约再修改配置，其他进程看到修改后的配置时一定能读到租约中的原值
+                self._renew_lease()
+                self._put_index_settings(refresh_interval="-1", number_of_replicas=0)
+                self._heartbeat_stop = threading.Event()
+                threading.Thread(target=self._heartbeat, args=(self._heartbeat_stop,), name="ingest-lease-heartbeat", daemon=True).start()
+                logging.info(f"ingest mode on, lease: {self._lease_id}")
+            except Exception as e:
+                # 设置失败不影响写入，按普通模式继续
+                logging.warning(f"ingest mode acquire error: {e}, {traceback.format_exc()}")
+
+    def release(self):
+        with self._lock:
+            self._refcount -= 1
+            try:
+                if self._refcount == 0 and self._lease_id:
+                    self._heartbeat_stop.set()
+                    get_es_client().options(ignore_status=404).delete(index=settings.elasticsearch.index_ingest_lease, id=self._lease_id, refresh=True)
+                    logging.info(f"ingest mode off, lease: {self._lease_id}")
+                    self._lease_id = None
+                    self.restore_if_idle(self._index_settings)
+                # 其他任务仍在写入时refresh已关闭，显式refresh使本次写入可见
+                get_es_client().indices.refresh(index=",".join(self.indices))
+            except Exception as e:
+                logging.warning(f"ingest mode release error: {e}, {traceback.format_exc()}")
+
+    def restore_if_idle(self, index_settings: dict[str, dict] = None):
+        """
+        不存在有效租约时恢复索引配置，启动时也会调用以处理进程崩溃遗留的配置
+        只在租约索引中有已过期的租约(或本进程刚释放租约，传入 index_settings)时恢复，从未开启过批量写入模式时不修改索引配置
+        """
+        es_client = get_es_client()
+        lease_index = settings.elasticsearch.index_ingest_lease
+        if not es_client.indices.exists(index=lease_index):
+            return
+
+        leases = self._leases()
+        now = time.time()
+        expired = [lease for lease in leases if lease["expires_at"] <= now]
+        if len(expired) < len(leases):
+            # 其他进程仍在写入，由最后结束的进程恢复；过期租约保留，其中的原配置由最后恢复时使用
+            return
+        if index_settings is None:
+            if not expired:
+                return
+            index_settings = self._saved_index_settings(expired)
+
+        for index, values in index_settings.items():
+            es_client.indices.put_settings(index=index, settings={"index": values})
+        logging.info(f"ingest mode index settings restored: {index_settings}")
+        if expired:
+            es_client.delete_by_query(index=lease_index, query={"range": {"expires_at": {"lte": now}}}, refresh=True, conflicts="proceed")
+
+    def _leases(self) -> list[dict]:
+        resp = get_es_client().search(index=settings.elasticsearch.index_ingest_lease, size=1000, query={"match_all": {}})
+        return [hit["_source"] for hit in resp["hits"]["hits"]]
+
+    def _saved_index_settings(self, leases: list[dict]) -> dict[str, dict]:
+        """
+        租约中记录的开启前配置，旧版本写入的租约没有记录时使用配置文件中的值
+        """
+        for lease in leases:
+            if lease.get("index_settings"):
+                return xjson.loads(lease["index_settings"])
+        return {
+            index: dict(
+                refresh_interval=settings.elasticsearch.index_settings.refresh_interval,
+                number_of_replicas=settings.elasticsearch.index_settings.number_of_replicas,
+            )
+            for index in self.indices
+        }
+
+    def _original_index_settings(self) -> dict[str, dict]:
+        """
+        开启前的索引配置：先读取当前配置，已有其他租约(包括崩溃遗留的过期租约)时以租约中记录的为准，
+        因为此时索引配置已被修改
+        """
+        resp = get_es_client().indices.get_settings(
+            index=",".join(self.indices),
+            name="index.refresh_interval,index.number_of_replicas",
+            include_defaults=True,
+            flat_settings=True,
+        )
+        current = {}
+        # 索引名为别名时按实际索引记录
+        for index, index_resp in resp.items():
+            values = {**index_resp.get("defaults", {}), **index_resp.get("settings", {})}
+            current[index] = dict(
+                refresh_interval=values.get("index.refresh_interval", "1s"),
+                number_of_replicas=int(values.get("index.number_of_replicas", 1)),
+            )
+
+        leases = [lease for lease in self._leases() if lease.get("index_settings")]
+        if leases:
+            return xjson.loads(leases[0]["index_settings"])
+        return current
+
+    def _put_index_settings(self, **index_settings):
+        get_es_client().indices.put_settings(index=",".join(self.indices), settings={"index": index_settings})
+
+    def _renew_lease(self):
+        get_es_client().index(
+            index=settings.elasticsearch.index_ingest_lease,
+            id=self._lease_id,
+            document=dict(owner=self._lease_id, expires_at=time.time() + settings.elasticsearch.ingest_lease_ttl, index_settings=xjson.dumps(self._index_settings)),
+            refresh=True,
+        )
+
+    def _heartbeat(self, stop: threading.Event):
+        while not stop.wait(settings.elasticsearch.ingest_lease_ttl / 3):
+            try:
+                with self._lock:
+                    if stop.is_set():
+                        return
+                    self._renew_lease()
+            except Exception as e:
+                logging.warning(f"ingest lease heartbeat error: {e}")
+
+
+ingest_mode_ins = IngestMode()
@@ -1,20 +1,157 @@
-
+import logging
+import time
+from typing import Callable
 
 from app.libs.acge_embedding import acge_embedding
 from app.providers.elasticsearch_provider import get_es_client
 from app.schemas.chat import EmbeddingArgSchema
 from app.support.rrf import RRF
+from config.config import settings
 
+# rrf retriever 不可用(ES版本低于8.14不认识retriever，或license不支持rrf)时，一段时间内不再使用 es_rrf，到期后再尝试
+# 其他错误(参数错误、临时的权限或状态问题等)只对当次请求回退
+RRF_RETRY_INTERVAL = 600
+_es_rrf_unsupported_until = 0.0
+# 向量字段不支持knn(未建索引的历史映射，或动态映射为float)时，该索引改用script_score，到期后再尝试knn
+KNN_RETRY_INTERVAL = 600
+_knn_unsupported_until: dict[str, float] = {}
+# 向量字段映射不支持当前检索方式时，ES错误信息中的关键字
+VECTOR_MAPPING_ERROR_KEYWORDS = ("knn", "dense_vector", "in the mapping", "no field found")
 
-def retrieval_embeddings(index, embedding_field_name, question_embedding: list[float], size: int, op_fields: list = [], must_conditions: list = []):
+
+class PlannedSearch(object):
     """
-    稠密检索，如向量匹配.
-    Args:
-        question_embedding: 查询问题的索引
-        size: 返回的top-k的个数
-        embedding_name: 查询问题匹配的ES数据库的表名的索引
-    Returns:
+    检索计划中的一次查询，计划执行后填充 hits 与 took
+    """
+
+    __slots__ = ("name", "index", "body", "score_func", "fallback", "hits", "took")
+
+    def __init__(self, name: str, index: str, body: dict, score_func: Callable[[float], float] = None, fallback: Callable[[dict], None] = None):
+        self.name = name
+        self.index = index
+        self.body = body
+        self.score_func = score_func
+        # 查询失败时调用，参数为ES返回的error，用于向计划中加入备用查询
+        self.fallback = fallback
+        self.hits: list[dict] = None
+        self.took: int = None
+
+
+class RetrievalPlan(object):
+    """
+    检索计划：先收集一次问答中互不依赖的查询，再合并为一次 _msearch 请求，按添加顺序把结果分发回各查询
+    """
+
+    def __init__(self):
+        self.searches: list[PlannedSearch] = []
+
+    def add(self, name: str, index: str, body: dict, score_func: Callable[[float], float] = None, fallback: Callable[[dict], None] = None) -> PlannedSearch:
+        search = PlannedSearch(name, index, body, score_func, fallback)
+        self.searches.append(search)
+        return search
+
+    def execute(self):
+        """
+        执行尚未执行的查询，没有备用查询的查询失败时抛出异常
+        有备用查询的查询失败时，备用查询在下一轮 _msearch 中执行
+        """
+        searches = [search for search in self.searches if search.hits is None]
+        while searches:
+            body = []
+            for search in searches:
+                body.extend([{"index": search.index}, search.body])
+            resp = get_es_client().msearch(searches=body)
+
+            for search, item in zip(searches, resp["responses"]):
+                if "error" in item:
+                    if search.fallback is None:
+                        raise Exception(f"msearch {search.name} on {search.index} error: {item['error']}")
+                    search.hits = []
+                    search.fallback(item["error"])
+                    continue
+                search.took = item.get("took")
+                search.hits = to_hits(item, search.score_func)
+
+            searches = [search for search in self.searches if search.hits is None]
+
+    def stats(self) -> list[dict]:
+        """
+        每个查询的ES耗时(took, ms)与命中数
+        """
+        return [
+            dict(name=search.name, index=search.index, took=search.took, hits=len(search.hits or []))
+            for search in self.searches
+        ]
+
+
+def to_hits(resp, score_func: Callable[[float], float] = None) -> list[dict]:
+    return [
+        {
+            "score": score_func(hit["_score"]) if score_func else hit["_score"],
+            "_id": hit["_id"],
+            "_source": hit["_source"]
+        }
+        for hit in resp["hits"]["hits"]
+    ]
+
+
+def knn_similarity(score: float) -> float:
+    # cosine/dot_product 的 _score 为 (1 + 相似度) / 2，还原为相似度，负值记为0，与script_score的得分一致
+    return max(2 * score - 1, 0)
+
+
+def knn_enabled(index) -> bool:
+    return settings.elasticsearch.vector_settings.search == "knn" and _knn_unsupported_until.get(index, 0) <= time.time()
+
+
+def error_reasons(error: dict) -> str:
+    """
+    拼接ES错误及其 root_cause/caused_by/failed_shards 中的错误信息
+    """
+    if not isinstance(error, dict):
+        return ""
+    reasons = [str(error.get("reason", ""))]
+    reasons.extend(error_reasons(item) for item in error.get("root_cause", []))
+    reasons.extend(error_reasons(item.get("reason")) for item in error.get("failed_shards", []))
+    reasons.append(error_reasons(error.get("caused_by")))
+    return " ".join(reason for reason in reasons if reason)
+
+
+def is_rrf_unsupported_error(error: dict) -> bool:
+    """
+    错误信息是否表明集群不认识rrf retriever，或license不支持rrf
     """
+    reasons = error_reasons(error).lower()
+    unknown_retriever = "retriever" in reasons and ("unknown" in reasons or "unrecognized" in reasons)
+    unlicensed = "license" in reasons and ("rrf" in reasons or "reciprocal rank fusion" in reasons)
+    return unknown_retriever or unlicensed
+
+
+def is_vector_mapping_error(error: dict, embedding_field_name: str) -> bool:
+    reasons = error_reasons(error).lower()
+    return embedding_field_name.lower() in reasons and any(keyword in reasons for keyword in VECTOR_MAPPING_ERROR_KEYWORDS)
+
+
+def embeddings_search_body(embedding_field_name, question_embedding: list[float], size: int, op_fields: list = [], must_conditions: list = [], index=None) -> tuple[dict, Callable[[float], float]]:
+    """
+    稠密检索的查询体，返回 (查询体, 得分转换函数)
+    index: 传入时，该索引的向量字段不支持knn则使用script_score
+    """
+    if settings.elasticsearch.vector_settings.search == "knn" and (index is None or knn_enabled(index)):
+        # 基于HNSW索引的近似向量检索，must_conditions(如文件uuid)作为knn的前置过滤条件
+        return {
+            "_source": op_fields,
+            "size": size,
+            "knn": {
+                "field": embedding_field_name,
+                "query_vector": question_embedding,
+                "k": size,
+                # num_candidates 需不小于k，且不超过10000
+                "num_candidates": min(max(settings.elasticsearch.vector_settings.num_candidates, size), 10000),
+                "filter": must_conditions,
+            },
+        }, knn_similarity
+
     source_string = """
                     double dp = dotProduct(params.queryVector, '{}');
                     if (dp < 0) {{
@@ -23,52 +160,53 @@ def retrieval_embeddings(index, embedding_field_name, question_embedding: list[f
                     return dp;
                     """.format(embedding_field_name)
 
-    must_conditions.append(
-        {
-            "script_score": {
-                "query": {
-                    "match_all": {}
-                },
-                "script": {
-                    "source": source_string,
-                    "params": {
-                        "queryVector": question_embedding
-                    }
-                }
-            }
-
-        }
-    )
-    search_body = {
+    return {
         "_source": op_fields,
         "size": size,
         "query": {
             "bool": {
-                "must": must_conditions,
+                "must": must_conditions + [
+                    {
+                        "script_score": {
+                            "query": {
+                                "match_all": {}
+                            },
+                            "script": {
+                                "source": source_string,
+                                "params": {
+                                    "queryVector": question_embedding
+                                }
+                            }
+                        }
+
+                    }
+                ],
                 "filter": [
                 ]
             },
         }
-    }
+    }, None
 
-    resp = get_es_client().search(index=index, body=search_body)
-    return [
-        {
-            "score": hit["_score"],
-            "_id": hit["_id"],
-            "_source": hit["_source"]
-        }
-        for hit in resp["hits"]["hits"]
-    ]
 
-
-def retrieve_bm25(index, text, text_field, size: int, op_fields: list = [], must_conditions: list = []):
+def retrieval_embeddings(index, embedding_field_name, question_embedding: list[float], size: int, op_fields: list = [], must_conditions: list = []):
     """
-    稀疏检索,如bm25算法等.
+    稠密检索，如向量匹配.
     Args:
-        size: 检索返回的个数
+        question_embedding: 查询问题的索引
+        size: 返回的top-k的个数
+        embedding_name: 查询问题匹配的ES数据库的表名的索引
     Returns:
     """
+    if size <= 0:
+        return []
+
+    plan = RetrievalPlan()
+    search = plan_embeddings(plan, "embeddings", index, embedding_field_name, question_embedding, size, op_fields, must_conditions)
+    plan.execute()
+    return search.hits
+
+
+def bm25_search_body(text, text_field, size: int, op_fields: list = [], must_conditions: list = []) -> dict:
     query = {
         "bool": {
             "should": [
@@ -79,51 +217,149 @@ def retrieve_bm25(index, text, text_field, size: int, op_fields: list = [], must
             "must": must_conditions,
         }
     }
-    search_body = {
+    return {
         "_source": op_fields,
         "size": size,
         "query": query,
     }
-    resp = get_es_client().search(index=index, body=search_body)
-    return [
-        {
-            "score": hit["_score"],
-            "_id": hit["_id"],
-            "_source": hit["_source"]
-        }
-        for hit in resp["hits"]["hits"]
-    ]
 
 
-def elasticsearch_retrieve(index, bm25_text, b25_text_field="embed_text", bm25_size=10, text_for_embedding="", op_fields=[], embedding_arg: EmbeddingArgSchema = None, must_conditions: list = None):
+def retrieve_bm25(index, text, text_field, size: int, op_fields: list = [], must_conditions: list = []):
     """
-    ES 召回方式
-    如果传入embedding_args表明需要附加上 embedding的得分，使用rrf进行排名
+    稀疏检索,如bm25算法等.
+    Args:
+        size: 检索返回的个数
+    Returns:
+    """
+    resp = get_es_client().search(index=index, body=bm25_search_body(text, text_field, size, op_fields, must_conditions))
+    return to_hits(resp)
+
+
+def plan_embeddings(plan: RetrievalPlan, name: str, index, embedding_field_name, question_embedding: list[float], size: int, op_fields: list = [], must_conditions: list = []) -> PlannedSearch:
+    """
+    把稠密检索加入检索计划，参数同 retrieval_embeddings
+    向量字段的映射不支持knn时，在下一轮 _msearch 中改用script_score重新查询；script_score也不支持(字段不是dense_vector)时跳过向量召回
     """
+    search_body, score_func = embeddings_search_body(embedding_field_name, question_embedding, size, op_fields, must_conditions, index)
+
+    def script_score_fallback(error: dict):
+        if not is_vector_mapping_error(error, embedding_field_name):
+            raise Exception(f"msearch {name} on {index} error: {error}")
+        logging.warning(f"embedding search {name} on {index} error: {error}, skip embedding recall")
+
+    def knn_fallback(error: dict):
+        if not is_vector_mapping_error(error, embedding_field_name):
+            raise Exception(f"msearch {name} on {index} error: {error}")
+        _knn_unsupported_until[index] = time.time() + KNN_RETRY_INTERVAL
+        logging.warning(f"knn search {name} on {index} error: {error}, fallback to script_score")
+        search.body, search.score_func = embeddings_search_body(embedding_field_name, question_embedding, size, op_fields, must_conditions, index)
+        search.fallback = script_score_fallback
+        search.hits = None
 
-    def _filter_hit(_hit):
-        embed_text = _hit["_source"]["embed_text"]
-        # 去除根节点以及目录节点, 以及embed_text不为空
-        return embed_text and embed_text != "Root" and "......." not in embed_text
+    search = plan.add(name, index, search_body, score_func, fallback=knn_fallback if score_func else script_score_fallback)
+    if size <= 0:
+        search.hits = []
+    return search
 
-    hits = []
+
+def rrf_search_body(bm25_text, text_field, bm25_size: int, embedding_field_name, question_embedding: list[float], embedding_size: int, op_fields: list = [], must_conditions: list = [], index=None) -> dict:
+    """
+    ES rrf retriever 的查询体，BM25与向量召回在集群内融合，只返回融合后的结果
+    """
+    bm25_body = bm25_search_body(bm25_text, text_field, bm25_size, op_fields, must_conditions)
+    embedding_body, _ = embeddings_search_body(embedding_field_name, question_embedding, embedding_size, op_fields, must_conditions, index)
+    if "knn" in embedding_body:
+        embedding_retriever = {"knn": embedding_body["knn"]}
+    else:
+        embedding_retriever = {"standard": {"query": embedding_body["query"]}}
+
+    # rank_window_size 需不小于size，两路召回数量一般相同，取较大值
+    size = max(bm25_size, embedding_size)
+    return {
+        "_source": op_fields,
+        "size": size,
+        "retriever": {
+            "rrf": {
+                "retrievers": [
+                    {"standard": {"query": bm25_body["query"]}},
+                    embedding_retriever,
+                ],
+                "rank_window_size": size,
+                # 与服务内融合的 k = 1 一致
+                "rank_constant": 1,
+            }
+        },
+    }
+
+
+def plan_elasticsearch_retrieve(plan: RetrievalPlan, name: str, index, bm25_text, b25_text_field="embed_text", bm25_size=10, text_for_embedding="", op_fields=[], embedding_arg: EmbeddingArgSchema = None, must_conditions: list = None,
+                                embedding_func: Callable[..., list[float]] = acge_embedding) -> Callable[[], list[dict]]:
+    """
+    把 elasticsearch_retrieve 的查询加入检索计划，返回计划执行后获取rrf融合结果的函数
+    embedding_func: 获取问题向量的函数，参数为 (text, dimension)，问答中传入请求内的备忘
+    """
     op_fields = list(set(op_fields) | {"_id"})
     must_conditions = must_conditions or []
+    question_embedding = None
+    if embedding_arg:
+        question_embedding = embedding_func(text_for_embedding or bm25_text, dimension=embedding_arg.dimension)
 
-    # BM25 Recall
-    _hits = retrieve_bm25(index, bm25_text, b25_text_field, size=bm25_size, op_fields=op_fields, must_conditions=must_conditions)
-    hits.extend(
-        [dict(**_hit, retrieval_type="bm25") for _hit in _hits if _filter_hit(_hit)]
-    )
+    searches: dict[str, PlannedSearch] = {}
 
-    # Embedding Recall
-    if embedding_arg:
-        question_embedding = acge_embedding(text=text_for_embedding or bm25_text, dimension=embedding_arg.dimension)
-        _hits = retrieval_embeddings(index, embedding_arg.field, question_embedding, embedding_arg.size, op_fields, must_conditions)
-        hits.extend(
-            [dict(**_hit, retrieval_type="acge") for _hit in _hits if _filter_hit(_hit)]
+    def plan_python_fusion():
+        # BM25 Recall
+        searches["bm25"] = plan.add(f"{name}_bm25", index, bm25_search_body(bm25_text, b25_text_field, bm25_size, op_fields, must_conditions))
+
+        # Embedding Recall
+        if embedding_arg:
+            searches["acge"] = plan_embeddings(plan, f"{name}_acge", index, embedding_arg.field, question_embedding, embedding_arg.size, op_fields, must_conditions)
+
+    def fallback(error: dict):
+        global _es_rrf_unsupported_until
+        if is_rrf_unsupported_error(error):
+            _es_rrf_unsupported_until = time.time() + RRF_RETRY_INTERVAL
+        logging.warning(f"es rrf retriever {name} on {index} error: {error}, fallback to python fusion")
+        plan_python_fusion()
+
+    if embedding_arg and embedding_arg.size > 0 and es_rrf_enabled():
+        searches["rrf"] = plan.add(
+            f"{name}_rrf",
+            index,
+            rrf_search_body(bm25_text, b25_text_field, bm25_size, embedding_arg.field, question_embedding, embedding_arg.size, op_fields, must_conditions, index),
+            fallback=fallback,
         )
+    else:
+        plan_python_fusion()
+
+    def fuse() -> list[dict]:
+        if "bm25" not in searches:
+            # 集群内已融合，_score即rrf得分，根节点与目录节点在融合后过滤
+            return [
+                {**_hit, "rrf_score": _hit["score"], "id": _hit["_id"], "retrieval_type": "rrf", "score": {"rrf": _hit["score"]}}
+                for _hit in searches["rrf"].hits if _filter_hit(_hit)
+            ]
+
+        hits = [dict(**_hit, retrieval_type="bm25") for _hit in searches["bm25"].hits if _filter_hit(_hit)]
+        if "acge" in searches:
+            hits.extend(
+                [dict(**_hit, retrieval_type="acge") for _hit in searches["acge"].hits if _filter_hit(_hit)]
+            )
+        return rrf_fuse(hits)
+
+    return fuse
+
+
+def es_rrf_enabled() -> bool:
+    return settings.elasticsearch.vector_settings.fusion == "es_rrf" and _es_rrf_unsupported_until <= time.time()
+
+
+def _filter_hit(_hit):
+    embed_text = _hit["_source"]["embed_text"]
+    # 去除根节点以及目录节点, 以及embed_text不为空
+    return embed_text and embed_text != "Root" and "......." not in embed_text
 
+
+def rrf_fuse(hits: list[dict]) -> list[dict]:
     # k = 1 for test
     rerank_list = RRF().reciprocal_rank_fusion(hits, group_key="retrieval_type", k=1)
     results = [
@@ -137,3 +373,14 @@ def elasticsearch_retrieve(index, bm25_text, b25_text_field="embed_text", bm25_s
     ]
 
     return results
+
+
+def elasticsearch_retrieve(index, bm25_text, b25_text_field="embed_text", bm25_size=10, text_for_embedding="", op_fields=[], embedding_arg: EmbeddingArgSchema = None, must_conditions: list = None):
+    """
+    ES 召回方式
+    如果传入embedding_args表明需要附加上 embedding的得分，使用rrf进行排名
+    """
+    plan = RetrievalPlan()
+    fuse = plan_elasticsearch_retrieve(plan, "retrieve", index, bm25_text, b25_text_field, bm25_size, text_for_embedding, op_fields, embedding_arg, must_conditions)
+    plan.execute()
+    return fuse()
@@ -0,0 +1,241 @@
+from collections import OrderedDict
+import os
+import shutil
+import tempfile
+import threading
+import time
+from typing import Any, BinaryIO, Callable, Optional
+
+
+class CacheStats(object):
+    """
+    缓存命中统计
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits: dict[str, int] = {}   # 各缓存层的命中次数
+        self.misses = 0
+
+    def hit(self, tier: str = "memory", count: int = 1):
+        with self._lock:
+            self.hits[tier] = self.hits.get(tier, 0) + count
+
+    def miss(self, count: int = 1):
+        with self._lock:
+            self.misses += count
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            total = sum(self.hits.values()) + self.misses
+            return dict(
+                hits=dict(self.hits),
+                misses=self.misses,
+                hit_ratio=round(sum(self.hits.values()) / total, 4) if total else 0.0,
+            )
+
+
+# 进程内所有缓存的统计信息，name -> CacheStats
+cache_stats_registry: dict[str, CacheStats] = {}
+
+
+def register_cache_stats(name: str) -> CacheStats:
+    return cache_stats_registry.setdefault(name, CacheStats())
+
+
+class DiskLRUCache(object):
+    """
+    本地磁盘LRU缓存，每个key一个文件，总大小超过 max_bytes 时淘汰最久未访问的文件
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int):
+        self._cache_dir = cache_dir
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[str, int] = OrderedDict()  # key -> size，按访问时间排序
+        self._total_bytes = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        files = []
+        for filename in os.listdir(self._cache_dir):
+            path = os.path.join(self._cache_dir, filename)
+            if os.path.isfile(path) and not filename.startswith("."):
+                stat = os.stat(path)
+                files.append((stat.st_mtime, filename, stat.st_size))
+
+        for _, filename, size in sorted(files):
+            self._entries[filename] = size
+            self._total_bytes += size
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self._cache_dir, key)
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+
+        try:
+            with open(self._path(key), "rb") as f:
+                content = f.read()
+            os.utime(self._path(key))
+            return content
+        except FileNotFoundError:
+            with self._lock:
+                self._total_bytes -= self._entries.pop(key, 0)
+            return None
+
+    def set(self, key: str, content: bytes):
+        if len(content) > self._max_bytes:
+            return
+
+        # 先写临时文件再rename，避免读到写了一半的文件
+        fd, tmp_path = tempfile.mkstemp(dir=self._cache_dir, prefix=".")
+        with os.fdopen(fd, "wb") as f:
+            f.write(content)
+        self._commit(key, tmp_path, len(content))
+
+    def set_fileobj(self, key: str, fileobj: BinaryIO):
+        """
+        从文件对象分块复制，不把内容读入内存
+        """
+        size = fileobj.seek(0, os.SEEK_END)
+        if size > self._max_bytes:
+            return
+
+        fileobj.seek(0)
+        fd, tmp_path = tempfile.mkstemp(dir=self._cache_dir, prefix=".")
+        with os.fdopen(fd, "wb") as f:
+            shutil.copyfileobj(fileobj, f, 1024 * 1024)
+        self._commit(key, tmp_path, size)
+
+    def _commit(self, key: str, tmp_path: str, size: int):
+        os.replace(tmp_path, self._path(key))
+
+        with self._lock:
+            self._total_bytes += size - self._entries.pop(key, 0)
+            self._entries[key] = size
+            evict_keys = []
+            while self._total_bytes > self._max_bytes and self._entries:
+                evict_key, evict_size = self._entries.popitem(last=False)
+                self._total_bytes -= evict_size
+                evict_keys.append(evict_key)
+
+        for evict_key in evict_keys:
+            try:
+                os.remove(self._path(evict_key))
+            except FileNotFoundError:
+                pass
+
+
+class _Flight(object):
+    """
+    正在加载的key，同一key的并发未命中等待同一次加载
+    """
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error: Exception = None
+
+
+class LRUTTLCache(object):
+    """
+    进程内LRU缓存，条目超过 ttl 秒过期，条目数超过 max_entries 或总大小超过 max_bytes 时淘汰最久未访问的条目
+    get_or_load 对同一key的并发未命中只加载一次(single-flight)
+    """
+
+    _MISSING = object()
+
+    def __init__(self, max_entries: int, max_bytes: int, ttl: float, sizeof: Callable[[Any], int] = lambda value: 1, stats: CacheStats = None):
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self._ttl = ttl
+        self._sizeof = sizeof
+        self.stats = stats or CacheStats()
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[Any, tuple[float, Any, int]] = OrderedDict()  # key -> (过期时间, value, size)，按访问时间排序
+        self._total_bytes = 0
+        self._inflight: dict[Any, _Flight] = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def total_bytes(self) -> int:
+        return self._total_bytes
+
+    def _get_locked(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return self._MISSING
+        expires_at, value, size = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            self._total_bytes -= size
+            return self._MISSING
+        self._entries.move_to_end(key)
+        return value
+
+    def get(self, key) -> Optional[Any]:
+        with self._lock:
+            value = self._get_locked(key)
+        return None if value is self._MISSING else value
+
+    def set(self, key, value):
+        size = self._sizeof(value)
+        if size > self._max_bytes:
+            return
+
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._total_bytes -= old[2]
+            self._entries[key] = (time.monotonic() + self._ttl, value, size)
+            self._total_bytes += size
+            while self._entries and (len(self._entries) > self._max_entries or self._total_bytes > self._max_bytes):
+                _, (_, _, evict_size) = self._entries.popitem(last=False)
+                self._total_bytes -= evict_size
+
+    def get_or_load(self, key, loader: Callable[[], Any]) -> Any:
+        """
+        命中时直接返回；未命中时调用 loader 加载并缓存，加载中的key由其他线程等待同一结果
+        统计 tier: memory(缓存命中) | inflight(等待并发加载的结果)
+        """
+        with self._lock:
+            value = self._get_locked(key)
+            if value is not self._MISSING:
+                self.stats.hit("memory")
+                return value
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = _Flight()
+
+        if not leader:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            self.stats.hit("inflight")
+            return flight.value
+
+        self.stats.miss()
+        try:
+            flight.value = loader()
+            self.set(key, flight.value)
+            return flight.value
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            flight.event.set()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._total_bytes = 0
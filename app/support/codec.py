@@ -0,0 +1,101 @@
+from abc import ABC, abstractmethod
+import gzip
+import zlib
+from typing import BinaryIO, Iterable, Iterator
+
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+
+class Codec(ABC):
+    """
+    压缩格式，写入时流式压缩到文件对象，读取时按内容的magic判断格式
+    """
+
+    name: str = ""
+    ext: str = ""
+    content_type: str = "application/octet-stream"
+
+    @abstractmethod
+    def open_writer(self, fileobj: BinaryIO) -> BinaryIO:
+        """
+        返回写入时压缩的文件对象，关闭时结束压缩流，不关闭 fileobj
+        """
+        ...
+
+    @abstractmethod
+    def compress(self, data: bytes) -> bytes:
+        ...
+
+    @abstractmethod
+    def decompress(self, data: bytes) -> bytes:
+        ...
+
+    @abstractmethod
+    def iter_decompress(self, chunks: Iterable[bytes]) -> Iterator[bytes]:
+        ...
+
+
+class GzipCodec(Codec):
+    name = "gzip"
+    ext = ".gz"
+    content_type = "application/gzip"
+
+    def __init__(self, level: int = 9):
+        self.level = level
+
+    def open_writer(self, fileobj: BinaryIO) -> BinaryIO:
+        return gzip.GzipFile(fileobj=fileobj, mode="wb", compresslevel=self.level)
+
+    def compress(self, data: bytes) -> bytes:
+        return gzip.compress(data, compresslevel=self.level)
+
+    def decompress(self, data: bytes) -> bytes:
+        return gzip.decompress(data)
+
+    def iter_decompress(self, chunks: Iterable[bytes]) -> Iterator[bytes]:
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        for chunk in chunks:
+            yield decompressor.decompress(chunk)
+        yield decompressor.flush()
+
+
+class ZstdCodec(Codec):
+    """
+    zstd压缩，可使用预先训练的字典(zstd --train)，同类json较小时字典可以明显提高压缩率
+    """
+
+    name = "zstd"
+    ext = ".zst"
+    content_type = "application/zstd"
+
+    def __init__(self, level: int = 3, dict_path: str = None):
+        # 只有使用zstd时才需要安装zstandard
+        import zstandard
+        self._zstd = zstandard
+        self.level = level
+        self.dict_data = None
+        if dict_path:
+            with open(dict_path, "rb") as f:
+                self.dict_data = zstandard.ZstdCompressionDict(f.read())
+
+    def _compressor(self):
+        return self._zstd.ZstdCompressor(level=self.level, dict_data=self.dict_data, write_content_size=True)
+
+    def _decompressor(self):
+        return self._zstd.ZstdDecompressor(dict_data=self.dict_data)
+
+    def open_writer(self, fileobj: BinaryIO) -> BinaryIO:
+        return self._compressor().stream_writer(fileobj, closefd=False)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor().compress(data)
+
+    def decompress(self, data: bytes) -> bytes:
+        # 流式写入的数据帧头中没有原始大小，按流读取
+        return self._decompressor().decompressobj().decompress(data)
+
+    def iter_decompress(self, chunks: Iterable[bytes]) -> Iterator[bytes]:
+        decompressor = self._decompressor().decompressobj()
+        for chunk in chunks:
+            yield decompressor.decompress(chunk)
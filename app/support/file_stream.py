@@ -0,0 +1,50 @@
+import asyncio
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+from typing import AsyncIterator, BinaryIO
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def ensure_disk_file(fileobj: BinaryIO) -> BinaryIO:
+    """
+    返回有文件描述符的磁盘文件
+    SpooledTemporaryFile 调用 fileno() 时会自动落盘，其他内存文件复制到临时文件
+    """
+    try:
+        fileobj.fileno()
+        # 保证缓冲区已写入磁盘，后续按文件描述符读取
+        fileobj.flush()
+        return fileobj
+    except (AttributeError, io.UnsupportedOperation):
+        spooled = tempfile.TemporaryFile()
+        fileobj.seek(0)
+        shutil.copyfileobj(fileobj, spooled, CHUNK_SIZE)
+        spooled.seek(0)
+        return spooled
+
+
+def file_sha256(fileobj: BinaryIO, chunk_size: int = CHUNK_SIZE) -> str:
+    """
+    分块计算文件内容的sha256，按偏移读取，不改变文件当前位置
+    """
+    sha256 = hashlib.sha256()
+    fd, offset = fileobj.fileno(), 0
+    while chunk := os.pread(fd, chunk_size, offset):
+        sha256.update(chunk)
+        offset += len(chunk)
+    return sha256.hexdigest()
+
+
+async def aiter_file(fileobj: BinaryIO, chunk_size: int = CHUNK_SIZE) -> AsyncIterator[bytes]:
+    """
+    分块异步读取文件，用于流式上传(chunked)
+    按偏移读取，同一个文件可以同时被多个请求读取
+    """
+    fd, offset = fileobj.fileno(), 0
+    while chunk := await asyncio.to_thread(os.pread, fd, chunk_size, offset):
+        offset += len(chunk)
+        yield chunk
@@ -5,14 +5,16 @@ import gzip
 from io import BytesIO
 import logging
 import math
+import resource
 import time
 import uuid
 import base62
 
-import numpy as np
 import requests
 from PIL import Image
 
+from app.support import scoring
+
 
 def log_duration(prefix: str = ""):
     # 外层函数接受 prefix 参数
@@ -105,8 +107,7 @@ def softmax(x) -> list[float]:
     if not x:
         return []
 
-    e_x = np.exp(x - np.max(x))  # 防止指数溢出
-    return (e_x / np.sum(e_x)).tolist()
+    return scoring.softmax(x).tolist()
 
 
 def sigmoid(x):
@@ -152,6 +153,13 @@ def group_by_func(entities: list[object], keyfunc: callable) -> list[tuple]:
     return groups
 
 
+def get_peak_rss_mb() -> float:
+    """
+    进程的内存峰值(RSS, MB)，Linux下 ru_maxrss 单位为KB
+    """
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
 def compress(data):
     json_bytes = data.encode('utf-8')
     buffer = BytesIO()
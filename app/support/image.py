@@ -0,0 +1,40 @@
+import base64
+from io import BytesIO
+import time
+
+from PIL import Image
+
+
+def encode_webp(image: Image.Image, quality: int) -> bytes:
+    output_buffer = BytesIO()
+    image.save(output_buffer, format="WEBP", quality=quality)
+    return output_buffer.getvalue()
+
+
+def convert_page_image(image_base64: str, quality: int, variants: dict[str, tuple[int, int]]) -> dict:
+    """
+    页面图片转换为WebP，在进程池中执行，只依赖PIL，不加载应用配置
+    同一次解码同时生成各尺寸的变体(缩略图、预览图等)
+    :param image_base64: textin返回的base64图片
+    :param quality: 原尺寸WebP的质量
+    :param variants: {变体名称: (最长边像素, 质量)}
+    :return: {webp, variants: {变体名称: bytes}, src_bytes, duration_ms}
+    """
+    start_time = time.perf_counter()
+    image_bytes = base64.b64decode(image_base64)
+    image = Image.open(BytesIO(image_bytes))
+    image.load()
+
+    variant_bytes = {}
+    for name, (max_size, variant_quality) in variants.items():
+        variant = image.copy()
+        # 等比缩小，不超过原图尺寸
+        variant.thumbnail((max_size, max_size))
+        variant_bytes[name] = encode_webp(variant, variant_quality)
+
+    return dict(
+        webp=encode_webp(image, quality),
+        variants=variant_bytes,
+        src_bytes=len(image_bytes),
+        duration_ms=round((time.perf_counter() - start_time) * 1000, 1),
+    )
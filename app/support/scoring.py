@@ -0,0 +1,120 @@
+import numpy as np
+
+
+def softmax(scores: np.ndarray) -> np.ndarray:
+    """
+    数值稳定的softmax，减去最大值防止指数溢出
+    """
+    scores = np.asarray(scores, dtype=np.float64)
+    if scores.size == 0:
+        return scores
+    e_x = np.exp(scores - np.max(scores))
+    return e_x / np.sum(e_x)
+
+
+def factorize(values, sort: bool = False) -> tuple[list, np.ndarray]:
+    """
+    把id等可哈希的值映射为从0开始的整数编码，避免对object数组排序
+    :param sort: 编码是否按值排序，否则按第一次出现的先后
+    :return: (去重后的值, 每个值的编码)
+    """
+    codes = {}
+    encoded = np.fromiter((codes.setdefault(value, len(codes)) for value in values), dtype=np.int64, count=len(values))
+    uniques = list(codes)
+    if sort and uniques:
+        order = sorted(range(len(uniques)), key=uniques.__getitem__)
+        remap = np.empty(len(uniques), dtype=np.int64)
+        remap[order] = np.arange(len(uniques))
+        return [uniques[i] for i in order], remap[encoded]
+    return uniques, encoded
+
+
+def rrf(ids: np.ndarray, groups: np.ndarray, k: float = 60, weights: dict = None) -> tuple[np.ndarray, np.ndarray]:
+    """
+    加权的倒数排名融合(Reciprocal Rank Fusion)
+    :param ids: 各路召回结果的id，同一路召回内按排名先后排列
+    :param groups: 每个结果所属的召回路(如 bm25/acge)
+    :param k: rrf常数，得分为 weight / (rank + k)，rank从0开始
+    :param weights: {召回路: 权重}，未配置的召回路权重为1
+    :return: (融合后的id, 得分)，按得分降序，得分相同时按召回路名称、排名先后
+    """
+    n = len(ids)
+    if n == 0:
+        return np.zeros(0, dtype=object), np.zeros(0)
+
+    group_names, group_idx = factorize(groups, sort=True)
+    # 按召回路稳定排序，组内位置即排名
+    order = np.argsort(group_idx, kind="stable")
+    sorted_groups = group_idx[order]
+    group_starts = np.searchsorted(sorted_groups, np.arange(len(group_names)))
+    ranks = np.empty(n, dtype=np.int64)
+    ranks[order] = np.arange(n) - group_starts[sorted_groups]
+
+    group_weights = np.array([(weights or {}).get(name, 1.0) for name in group_names], dtype=np.float64)
+    scores = group_weights[group_idx] / (ranks + k)
+
+    id_values, id_idx = factorize(ids)
+    unique_ids = np.empty(len(id_values), dtype=object)
+    unique_ids[:] = id_values
+    fused = np.zeros(len(unique_ids))
+    # 按召回路顺序累加，与逐路累加的浮点结果一致
+    np.add.at(fused, id_idx[order], scores[order])
+
+    # 同分时保持按召回路遍历时第一次出现的先后
+    first_visit = np.full(len(unique_ids), n, dtype=np.int64)
+    np.minimum.at(first_visit, id_idx[order], np.arange(n))
+
+    rank_order = np.lexsort((first_visit, -fused))
+    return unique_ids[rank_order], fused[rank_order]
+
+
+def top_k_similarity(matrix: np.ndarray, query: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    与query向量相似度(点积，向量已归一化时即余弦相似度)最高的k行
+    :return: (行号, 相似度)，按相似度降序，相同时行号小的在前
+    """
+    similarities = np.asarray(matrix, dtype=np.float64) @ np.asarray(query, dtype=np.float64)
+    k = min(k, len(similarities))
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0)
+    if k < len(similarities):
+        # 第k大的值，与其相同的行取行号小的
+        kth = -np.partition(-similarities, k - 1)[k - 1]
+        greater = np.flatnonzero(similarities > kth)
+        candidates = np.concatenate([greater, np.flatnonzero(similarities == kth)[:k - len(greater)]])
+    else:
+        candidates = np.arange(len(similarities))
+    candidates = candidates[np.lexsort((candidates, -similarities[candidates]))]
+    return candidates, similarities[candidates]
+
+
+def top_p_cutoff(scores: np.ndarray, top_p: float, normalize: bool = False) -> int:
+    """
+    按累计得分截断，返回保留的个数：前面各项的累计得分不超过 top_p 时保留当前项
+    :param normalize: 是否先按总分归一化
+    """
+    scores = np.asarray(scores, dtype=np.float64)
+    if scores.size == 0 or top_p < 0:
+        return 0
+    cumulative = np.cumsum(scores)
+    if normalize:
+        total = cumulative[-1]
+        if total <= 0:
+            return len(scores)
+        cumulative = np.cumsum(scores / total)
+    exceeded = np.flatnonzero(cumulative[:-1] > top_p)
+    return int(exceeded[0]) + 1 if exceeded.size else len(scores)
+
+
+def segment_max(values: np.ndarray, lengths: list[int]) -> np.ndarray:
+    """
+    按长度分段取最大值，空段为0
+    """
+    values = np.asarray(values, dtype=np.float64)
+    lengths = np.asarray(lengths, dtype=np.int64)
+    result = np.zeros(len(lengths))
+    non_empty = lengths > 0
+    if values.size and non_empty.any():
+        starts = np.cumsum(lengths) - lengths
+        result[non_empty] = np.maximum.reduceat(values, starts[non_empty])
+    return result
@@ -0,0 +1,67 @@
+import os
+import tempfile
+import threading
+from typing import Iterable, Iterator
+
+from app.support import xjson
+
+
+class JsonLinesSpool(object):
+    """
+    把大量json对象按行转存到临时文件，需要时再逐个读回，避免整体常驻内存
+    临时文件没有文件名，关闭或进程退出后由系统回收
+    """
+
+    def __init__(self, spool_dir: str = None):
+        if spool_dir:
+            os.makedirs(spool_dir, exist_ok=True)
+        self._file = tempfile.TemporaryFile(dir=spool_dir or None)
+        self._lock = threading.Lock()
+        self._count = 0
+        self._size = 0
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def append(self, obj):
+        self.append_line(xjson.dumpb(obj))
+
+    def extend(self, objs: Iterable):
+        for obj in objs:
+            self.append(obj)
+
+    def append_line(self, line: bytes):
+        """
+        追加已经序列化好的一行json
+        """
+        with self._lock:
+            self._file.seek(0, os.SEEK_END)
+            self._file.write(line + b"\n")
+            self._count += 1
+            self._size += len(line) + 1
+
+    def iter_lines(self) -> Iterator[bytes]:
+        offset = 0
+        while True:
+            with self._lock:
+                self._file.seek(offset)
+                line = self._file.readline()
+                offset = self._file.tell()
+            if not line:
+                return
+            yield line.rstrip(b"\n")
+
+    def __iter__(self) -> Iterator:
+        for line in self.iter_lines():
+            yield xjson.loads(line)
+
+    def close(self):
+        self._file.close()
+
+    def __del__(self):
+        if hasattr(self, "_file"):
+            self.close()
@@ -0,0 +1,123 @@
+from lxml import etree
+
+from app.support.transform import _html_info_to_text_list, _html_to_list_info, list2markdown, markdown2list
+
+TABLE_TAG = """<table border="1">"""
+
+
+def merge_table_htmls(htmls: list[str]) -> list[str]:
+    """
+    合并表格，合并逻辑为连续的表格进行合并
+    :param htmls:
+    :return:
+    """
+
+    def end_id(i, htmls):
+        while i < len(htmls) - 1:
+            if TABLE_TAG in htmls[i] and TABLE_TAG in htmls[i + 1]:
+                i += 1
+            else:
+                break
+        return i
+
+    result = []
+    i = 0
+    while i < len(htmls):
+        if TABLE_TAG in htmls[i]:
+            j = end_id(i, htmls)
+            result.append(TABLE_TAG
+                          + "".join([r.replace(TABLE_TAG, "").replace("""</table>""", "") for r in htmls[i:j + 1]])
+                          + """</table>""")
+            i = j + 1
+        else:
+            result.append(htmls[i])
+            i += 1
+    return result
+
+
+def _is_cell_tag(tag) -> bool:
+    # 与 BeautifulSoup find_all(re.compile(r'(td|th)')) 的匹配规则保持一致
+    return isinstance(tag, str) and ("td" in tag or "th" in tag)
+
+
+def _html_to_list_info_lxml(html: str):
+    """
+    _html_to_list_info 的lxml实现，直接遍历lxml元素树，不再构造BeautifulSoup对象
+    """
+    root = etree.HTML(html)
+    if root is None:
+        return [], 0, 0
+
+    table = []
+    nb_col = 0
+    for tr in root.iter("tr"):
+        row = []
+        for cell in tr.iterdescendants():
+            if not _is_cell_tag(cell.tag):
+                continue
+            text = "".join(cell.xpath(".//text()")).replace(" ", "").replace(",", "")
+            row.append({'colspan': int(cell.get("colspan", 1)), 'rowspan': int(cell.get("rowspan", 1)), 'text': text})
+        table.append(row)
+        nb_col = max(nb_col, len(row))
+
+    return table, len(table), nb_col
+
+
+def html2rows(html: str) -> list[list[str]]:
+    """
+    html表格转换为二维列表，优先使用lxml，解析失败时回退到BeautifulSoup
+    """
+    try:
+        table, nb_row, nb_col = _html_to_list_info_lxml(html)
+    except (ValueError, etree.LxmlError):
+        table, nb_row, nb_col = _html_to_list_info(html)
+    return _html_info_to_text_list(table, nb_row, nb_col)
+
+
+class Table(object):
+    """
+    原文切片中的表格，每个原文切片只解析一次，供各解析阶段直接使用
+
+    - htmls: 连续表格合并后的html列表
+    - parts: 每个html对应的二维列表，非表格内容为空列表
+    - rows: 与 markdown2list(markdown) 结果一致的行列表，各部分之间以空行分隔
+    """
+
+    __slots__ = ("htmls", "parts", "_markdown", "_rows")
+
+    def __init__(self, htmls: list[str], parts: list[list[list[str]]]):
+        self.htmls = htmls
+        self.parts = parts
+        self._markdown = None
+        self._rows = None
+
+    @classmethod
+    def from_htmls(cls, htmls: list[str]) -> 'Table':
+        merged_htmls = merge_table_htmls(htmls)
+        return cls(merged_htmls, [html2rows(html) for html in merged_htmls])
+
+    @property
+    def markdown(self) -> str:
+        if self._markdown is None:
+            self._markdown = "\n".join(list2markdown(part) for part in self.parts)
+        return self._markdown
+
+    @property
+    def rows(self) -> list[list[str]]:
+        if self._rows is None and any("|" in cell or "\n" in cell for part in self.parts for row in part for cell in row):
+            # 单元格中含有分隔符时，与markdown的拆分结果保持一致
+            self._rows = markdown2list(self.markdown)
+        if self._rows is None:
+            rows = []
+            for part in self.parts:
+                for ind, row in enumerate(part):
+                    # 与markdown中的 "||" 行一致，空行解析为一个空单元格
+                    rows.append([str(cell) for cell in row] if row else [""])
+                    if ind == 0:
+                        rows.append(["-"] * len(row))
+                rows.append([])
+            # markdown2list 跳过第二行（第一个表格的分隔行）
+            if len(rows) > 1:
+                del rows[1]
+            self._rows = rows or [[]]
+        return self._rows
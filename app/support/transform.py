@@ -1,5 +1,10 @@
+from functools import lru_cache
+import logging
 import re
+from typing import Callable
+
 from bs4 import BeautifulSoup
+import tiktoken
 
 
 def _html_to_list_info(html, encoding='utf-8'):
@@ -96,13 +101,13 @@ def html2list(html, encoding='utf-8') -> list:
 
 
 def list2markdown(table_list) -> str:
-    markdown = ""
+    lines = []
     for ind, row in enumerate(table_list):
+        lines.append("|" + "|".join(str(cell) for cell in row) + "|")
         if ind == 0:
-            markdown += "|" + "|".join(str(cell) for cell in row) + "|" + "\n" + "|" + "-|" * len(row) + "\n"
-        else:
-            markdown += "|" + "|".join(str(cell) for cell in row) + "|" + "\n"
-    return markdown
+            lines.append("|" + "-|" * len(row))
+    # 每行以换行结尾，与逐行拼接的结果一致
+    return "".join(line + "\n" for line in lines)
 
 
 def uneven_list_to_markdown_table(data, fill_value=""):
@@ -164,9 +169,24 @@ def financial_string_to_number(s):
         return float(s.replace(".", "", 1))  # 仅替换第一个点，保留可能的小数部分
 
 
+@lru_cache(maxsize=65536)
 def is_financial_string(s):
     try:
         financial_string_to_number(s)
         return True
     except ValueError:
         return False
+
+
+@lru_cache(maxsize=None)
+def get_token_counter(encoding: str = "") -> Callable[[str], int]:
+    """
+    返回文本token计数函数，encoding为tiktoken的编码名称，为char或加载失败时按字符数计数
+    """
+    if encoding != "char":
+        try:
+            enc = tiktoken.get_encoding(encoding)
+            return lambda text: len(enc.encode(text, disallowed_special=()))
+        except Exception as e:
+            logging.warning(f"load tiktoken encoding {encoding} error: {e}, count tokens by characters")
+    return len
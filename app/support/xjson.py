@@ -9,3 +9,7 @@ def loads(s):
 
 def dumps(obj):
     return orjson.dumps(obj).decode(encoding='utf-8', errors="ignore")
+
+
+def dumpb(obj) -> bytes:
+    return orjson.dumps(obj)
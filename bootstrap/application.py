@@ -3,15 +3,20 @@ from fastapi import FastAPI
 from contextlib import asynccontextmanager
 
 
-from app.providers import app_provider, logging_provider, route_provider, elasticsearch_provider
+from app.libs.textin_pic_download import TextinDownload
+from app.providers import app_provider, logging_provider, route_provider, elasticsearch_provider, parse_job_provider
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     startup(app, app_provider)
+    startup(app, elasticsearch_provider)
+    startup(app, parse_job_provider)
     yield  # 允许请求处理
     # 释放 Elasticsearch 资源等
+    cleanup(app, parse_job_provider)
     cleanup(app, elasticsearch_provider)
+    await TextinDownload.aclose()
 
 
 def create_app() -> FastAPI:
@@ -59,7 +59,44 @@ class AppSettings(BaseSettings):
         embedding_batch_size: int = 32
         insert_es_concurrency: int = 20
         insert_es_batch_size: int = 3000
-        insert_es_with_vector_batch_size: int = 300
+        bulk_flush_bytes: int = 10 * 1024 ** 2      # 单次bulk请求的最大字节数
+        bulk_queue_max_bytes: int = 64 * 1024 ** 2  # 待写入队列的最大字节数，超过时阻塞上游
+        bulk_flush_interval: float = 0.2            # 队列未攒够一批时的最长等待时间(秒)
+        bulk_max_retries: int = 3                   # 单条文档429/5xx失败的重试次数
+        ingest_mode: bool = False                   # 解析时默认是否开启批量写入模式(关闭refresh、副本数置0)
+        pic_download_concurrency: int = 20
+        pic_convert_workers: int = 0        # 页面图片转换进程数，0表示 min(4, cpu核数)
+        pic_webp_quality: int = 80          # 页面图片WebP质量
+        pic_variants: dict[str, list[int]] = {}  # 页面图片的其他尺寸 {名称: [最长边像素, 质量]}
+        pic_backup_mode: str = "eager"      # 页面图片备份 eager|lazy
+        pic_eager_pages: int = 1            # lazy模式下解析时备份的页数
+        pic_sweeper_interval: float = 5.0   # lazy模式下后台补齐页面图片的检查间隔(秒)
+        table_split_token_limit: int = 1000         # 表格段落切片的token上限
+        table_split_token_encoding: str = "cl100k_base"  # 计算表格token数的tiktoken编码，char时按字符数计算
+        job_workers: int = 2                # 后台解析任务并发数
+        job_queue_size: int = 100           # 后台解析任务队列长度
+        job_store: str = "memory"           # 解析任务状态存储 memory|sqlite
+        job_store_path: str = os.path.join(BASE_DIR, "storages/parse_jobs.sqlite3")
+        job_store_max_size: int = 10000     # memory存储最多保留的任务数量
+        job_owner_ttl: int = 60             # sqlite存储中进程心跳的过期时间(秒)，超过后该进程未结束的任务标记为失败
+        job_events_interval: float = 0.5    # SSE进度推送的轮询间隔(秒)
+        pdf2md_cache_enabled: bool = True   # 是否按文件内容hash缓存pdf2md结果
+        pdf2md_cache_dir: str = os.path.join(BASE_DIR, "storages/cache/pdf2md")
+        pdf2md_cache_max_bytes: int = 2 * 1024 ** 3  # 本地磁盘缓存上限，默认2G
+        pdf2md_spool_dir: str = os.path.join(BASE_DIR, "storages/tmp")  # pdf2md结果中pages的转存目录
+        char_details_mode: str = "inline"   # 字符详情 inline|none|split
+        pdf2md_codec: str = "gzip"          # pdf2md结果的压缩格式 gzip|zstd
+        pdf2md_layout: str = "single"       # pdf2md结果的保存方式 single|chunked
+        pdf2md_chunk_pages: int = 10        # chunked时每块的页数
+        pdf2md_gzip_level: int = 9          # gzip压缩级别
+        pdf2md_zstd_level: int = 3          # zstd压缩级别
+        pdf2md_zstd_dict_path: str = ""     # zstd字典路径，为空时不使用字典
+        pdf2md_upload_concurrency: int = 4  # pdf2md结果分块上传minio的并发数量，也是内存中最多保留的压缩块数
+        embedding_cache_enabled: bool = True    # 是否缓存入库文本的向量
+        embedding_cache_store: str = "sqlite"   # 向量缓存存储 sqlite|minio
+        embedding_cache_path: str = os.path.join(BASE_DIR, "storages/cache/embedding.sqlite3")
+        embedding_cache_max_entries: int = 1000000  # sqlite存储最多保留的向量数量
+        embedding_cache_minio_concurrency: int = 16  # minio存储并发读写的数量
 
         class Config:
             env_prefix = 'APP_WF_PARSE_'  # 设置环境变量前缀
@@ -156,6 +193,8 @@ class ApiSettings(BaseSettings):
         options_table_flavor: str = 'html'
         options_get_image: str = 'page'
         options_parse_mode: str = 'auto'
+        window_size: int = 0            # 按页窗口并发解析时每个窗口的页数，0表示整篇文档一次请求
+        window_concurrency: int = 4     # 页窗口并发请求数
 
         class Config:
             env_prefix = 'API_PDF2MD_'  # 设置环境变量前缀
@@ -164,6 +203,11 @@ class ApiSettings(BaseSettings):
         url: str = "http://gpt-qa-embedding.ai.intsig.net/get_embedding"
         dimension: int = 1024
         digit: int = 8
+        version: str = "acge_text_embedding"  # 模型版本标识，参与向量缓存的key，更换模型时需修改
+        query_cache_enabled: bool = True              # 是否在进程内缓存问题向量
+        query_cache_ttl: int = 3600                   # 问题向量缓存的过期时间(秒)
+        query_cache_max_entries: int = 10000          # 问题向量缓存的最大条目数
+        query_cache_max_bytes: int = 128 * 1024 ** 2  # 问题向量缓存的最大字节数
 
         class Config:
             env_prefix = 'API_EMBEDDING_'  # 设置环境变量前缀
@@ -192,6 +236,18 @@ class ElasticSearchSettings(BaseSettings):
         class Config:
             env_prefix = 'ELASTICSEARCH_INDEX_SETTINGS_'  # 设置环境变量前缀
 
+    class VectorSettings(BaseSettings):
+        search: str = "knn"             # 向量检索方式 knn|script_score
+        similarity: str = "cosine"      # 向量相似度 cosine|dot_product
+        index_type: str = "hnsw"        # 向量索引类型 hnsw|int8_hnsw
+        m: int = 16                     # HNSW每个节点的邻居数
+        ef_construction: int = 100      # HNSW建图时的候选数
+        num_candidates: int = 500       # knn检索时每个分片的候选数
+        fusion: str = "python"          # 混合检索的融合方式 python|es_rrf
+
+        class Config:
+            env_prefix = 'ELASTICSEARCH_VECTOR_SETTINGS_'  # 设置环境变量前缀
+
     hosts: str = "http://chatdoc-es-sandbox.ai.intsig.net:80"
     username: str = "elastic"
     password: str = "XXXXX"
@@ -201,7 +257,10 @@ class ElasticSearchSettings(BaseSettings):
     index_origin_slice: str = "v1_origin_slice"
     index_table_row_slice: str = "v1_table_row_slice"
     index_paragraph_slice: str = "v1_paragraph_slice"
+    index_ingest_lease: str = "v1_ingest_lease"
+    ingest_lease_ttl: int = 60          # 批量写入模式租约的过期时间(秒)，进程崩溃后超过此时间可恢复索引配置
     index_settings: IndexSettings
+    vector_settings: VectorSettings
 
     class Config:
         env_prefix = 'ELASTICSEARCH_'  # 设置环境变量前缀
@@ -0,0 +1,130 @@
+"""
+按页窗口解析pdf2md：使用本地的TextIn替身服务，检查按窗口请求合并后的结果与一次请求的结果一致
+"""
+import asyncio
+import socket
+import tempfile
+import threading
+import time
+
+import pytest
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+from app.libs.textin_ocr import TextinOcr
+from app.services.doc.workflow_parse.pdf2md import recognize, recognize_by_windows
+from config.config import settings
+
+TOTAL_PAGES = 7
+PARAGRAPHS_PER_PAGE = 2
+
+
+class FakeTextin(object):
+    """
+    TextIn替身：按 page_start/page_count 返回窗口内的页面
+    窗口内页码从1开始，paragraph_id 按 paragraph_scope 在窗口内跨页递增(document)或每页从0开始(page)
+    """
+
+    def __init__(self):
+        self.requests: list[tuple[int, int]] = []
+        self.report_total = True
+        self.paragraph_scope = "document"
+
+    async def pdf2md(self, request: Request):
+        await request.body()
+        page_start = int(request.query_params["page_start"])
+        page_count = int(request.query_params["page_count"])
+        self.requests.append((page_start, page_count))
+
+        doc_pages = range(page_start, min(page_start + page_count, TOTAL_PAGES))
+        pages, detail, metrics = [], [], []
+        for window_page_id, doc_page in enumerate(doc_pages, start=1):
+            pages.append(dict(page_id=window_page_id, status="success", content=[dict(id=0, text=f"page {doc_page}")]))
+            metrics.append(dict(angle=0, dpi=144, duration=1.0, image_id=f"img{doc_page}", page_id=window_page_id,
+                                page_image_height=1000, page_image_width=800, status="Success"))
+            for i in range(PARAGRAPHS_PER_PAGE):
+                paragraph_id = len(detail) if self.paragraph_scope == "document" else i
+                detail.append(dict(content=0, outline_level=-1, page_id=window_page_id, paragraph_id=paragraph_id,
+                                   position=[0, i, 10, i, 10, i + 1, 0, i + 1], text=f"p{doc_page}-{i}", type="paragraph"))
+
+        return JSONResponse(dict(
+            code=200,
+            result=dict(pages=pages, detail=detail, total_page_count=TOTAL_PAGES if self.report_total else 0),
+            metrics=metrics,
+            version="fake",
+            duration=len(pages),
+        ))
+
+
+@pytest.fixture(scope="module")
+def textin():
+    fake = FakeTextin()
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(Starlette(routes=[Route("/pdf2md", fake.pdf2md, methods=["POST"])]),
+                                           host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    fake.url = f"http://127.0.0.1:{port}/pdf2md"
+    yield fake
+    server.should_exit = True
+    thread.join()
+
+
+@pytest.fixture
+def textin_ocr(textin, monkeypatch):
+    monkeypatch.setattr(settings.api.pdf2md, "url", textin.url)
+    monkeypatch.setattr(settings.api.pdf2md, "options_page_start", 0)
+    monkeypatch.setattr(settings.api.pdf2md, "options_page_count", 2000)
+    monkeypatch.setattr(settings.api.pdf2md, "window_concurrency", 2)
+    textin.requests.clear()
+    textin.report_total = True
+    textin.paragraph_scope = "document"
+    return TextinOcr()
+
+
+@pytest.fixture
+def source():
+    with tempfile.TemporaryFile() as f:
+        f.write(b"%PDF-1.4 fake")
+        f.seek(0)
+        yield f
+
+
+def dump(pdf2md_result) -> tuple[dict, list[dict]]:
+    return pdf2md_result.model_dump(exclude={"result": {"pages"}}), list(pdf2md_result.result.iter_pages())
+
+
+# 窗口大小为1时无法判断paragraph_id的编号方式，不在此检查
+@pytest.mark.parametrize("window_size", [2, 3, 7, 10])
+@pytest.mark.parametrize("paragraph_scope", ["document", "page"])
+def test_windows_merge_equals_single_request(textin, textin_ocr, source, monkeypatch, window_size, paragraph_scope):
+    textin.paragraph_scope = paragraph_scope
+    single = dump(asyncio.run(recognize(textin_ocr, source)))
+    assert textin.requests == [(0, 2000)]
+
+    textin.requests.clear()
+    monkeypatch.setattr(settings.api.pdf2md, "window_size", window_size)
+    windowed = dump(asyncio.run(recognize_by_windows(textin_ocr, source)))
+
+    assert windowed == single
+    # 第一个窗口按窗口大小请求，之后的窗口截止到总页数
+    assert sorted(textin.requests) == [(0, window_size)] + [
+        (start, min(window_size, TOTAL_PAGES - start)) for start in range(window_size, TOTAL_PAGES, window_size)
+    ]
+
+
+def test_windows_stop_without_total_page_count(textin, textin_ocr, source, monkeypatch):
+    textin.report_total = False
+    monkeypatch.setattr(settings.api.pdf2md, "window_size", 3)
+    result = asyncio.run(recognize_by_windows(textin_ocr, source))
+
+    # 没有总页数时只请求第一个窗口，不会按 options_page_count 请求到文档之外
+    assert textin.requests == [(0, 3)]
+    assert [metric.page_id for metric in result.metrics] == [1, 2, 3]